@@ -1,3 +1,45 @@
+"""Parsing and processing framework for human-friendly structured data.
+
+The objects of the top-level API and the submodules are imported on first
+access, so that importing the package (or one of its submodules) does not
+load the entire framework.
+"""
+import importlib
 from hsd.common import HSDException
-from hsd.parser import HSDParser
-from hsd.formatter import HSDFormatter, HSDStreamFormatter
+
+# Objects of the top-level API and the modules defining them
+_API = {
+    "HSDParser": "hsd.parser",
+    "HSDFormatter": "hsd.formatter",
+    "HSDStreamFormatter": "hsd.formatter",
+    "HSDTree": "hsd.tree",
+    "HSDTreeBuilder": "hsd.treebuilder",
+    "HSDQuery": "hsd.query",
+    "to_dict": "hsd.dicts",
+    "to_json": "hsd.dicts",
+    "from_dict": "hsd.dicts",
+    "load_block": "hsd.index",
+}
+
+_SUBMODULES = frozenset([
+    "aio", "client", "common", "compression", "converter", "corpus", "dicts",
+    "diff", "events", "formatter", "index", "merge", "parser", "query",
+    "server", "shared", "template", "tree", "treebuilder", "validator",
+    "variant", "xmlstream" ])
+
+__all__ = [ "HSDException" ] + list(_API)
+
+
+def __getattr__(name):
+    modname = _API.get(name)
+    if modname is not None:
+        value = getattr(importlib.import_module(modname), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module("hsd." + name)
+    raise AttributeError("module 'hsd' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_API) | _SUBMODULES)
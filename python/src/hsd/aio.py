@@ -0,0 +1,332 @@
+"""Parsing and formatting HSD within asyncio applications."""
+import io
+import codecs
+import asyncio
+from hsd.common import *
+from hsd.compression import openinput
+from hsd.formatter import HSDFormatter
+from hsd.parser import HSDParser, _ErrorLimit
+from hsd.treebuilder import HSDTreeBuilder
+
+__all__ = [ "AsyncHSDParser", "AsyncTarget", "buildtree", "formathsd",
+            "writehsd", "fileloader" ]
+
+# Include interrupts, which need the content of files
+_INCLUDE_SIGNS = ("<<<", "<<!")
+
+# Number of lines parsed (nodes written) before control is handed back
+_YIELDINTERVAL = 500
+
+
+async def fileloader(fname):
+    """Default loader reading files in a worker thread.
+
+    Args:
+        fname: Name of the file (may be compressed).
+
+    Returns:
+        Content of the file.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, _readfile,
+                                                            fname)
+
+
+def _readfile(fname):
+    with openinput(fname) as fp:
+        return fp.read()
+
+
+class AsyncHSDParser(HSDParser):
+    """Event based HSD parser consuming asynchronous sources.
+
+    The input is parsed line by line as the chunks arrive. After every
+    yieldinterval lines, control is handed back to the event loop. The
+    handlers are called in the same way as for HSDParser, but the data must
+    be fed with feed_async() or iterated with events().
+
+    The content of the files included via the "<<<" and "<<!" interrupts is
+    obtained from an asynchronous loader before the line containing the
+    interrupt is parsed.
+    """
+
+    def __init__(self, defattrib="default", loader=fileloader,
+                 encoding="utf-8", yieldinterval=_YIELDINTERVAL,
+                 interner=None, recover=False, maxerrors=100):
+        """Initializes an AsyncHSDParser instance.
+
+        Args:
+            defattrib: Name of the default attribute (see HSDParser).
+            loader: Coroutine function returning the content of a file for a
+                given file name (default: fileloader).
+            encoding: Encoding of sources delivering bytes.
+            yieldinterval: Number of lines parsed before control is handed
+                back to the event loop.
+            interner: HSDInterner instance (see HSDParser).
+            recover: Whether errors should be collected (see HSDParser).
+            maxerrors: Maximal number of collected errors (see HSDParser).
+        """
+        super().__init__(defattrib=defattrib, interner=interner,
+                         recover=recover, maxerrors=maxerrors)
+        self._loader = loader
+        self._encoding = encoding
+        self._yieldinterval = yieldinterval
+        self._includes = {}
+
+    async def feed_async(self, source, tick=None):
+        """Feeds the parser with data from an asynchronous source.
+
+        Args:
+            source: asyncio.StreamReader or asynchronous iterable over chunks
+                (str or bytes) of the input.
+            tick: Coroutine function awaited after every yieldinterval lines
+                instead of just handing control back to the loop (e.g.
+                AsyncTarget.drain to apply backpressure).
+        """
+        if tick is None:
+            tick = _yieldcontrol
+        nlines = 0
+        try:
+            async for line in self._lines(source):
+                if "<<" in line:
+                    await self._loadincludes(line)
+                self._parse(line)
+                self._currline += 1
+                nlines += 1
+                if nlines == self._yieldinterval:
+                    nlines = 0
+                    await tick()
+            self._checkend()
+        except _ErrorLimit:
+            pass
+
+    async def events(self, source, tick=None):
+        """Parses an asynchronous source and yields the parser events.
+
+        The handlers of the parser are replaced by the iterator.
+
+        Args:
+            source: asyncio.StreamReader or asynchronous iterable over chunks
+                of the input.
+            tick: Coroutine function awaited after every yieldinterval lines
+                (see feed_async()).
+
+        Yields:
+            Tuples ("start", tagname, options, hsdoptions), ("close",
+            tagname), ("text", text) or ("array", array).
+        """
+        pending = []
+        self.start_handler = lambda *args: pending.append(("start",) + args)
+        self.close_handler = lambda tagname: pending.append(("close", tagname))
+        self.text_handler = lambda text: pending.append(("text", text))
+        self.array_handler = lambda array: pending.append(("array", array))
+        if tick is None:
+            tick = _yieldcontrol
+        nlines = 0
+        try:
+            async for line in self._lines(source):
+                if "<<" in line:
+                    await self._loadincludes(line)
+                self._parse(line)
+                self._currline += 1
+                for event in pending:
+                    yield event
+                del pending[:]
+                nlines += 1
+                if nlines == self._yieldinterval:
+                    nlines = 0
+                    await tick()
+            self._checkend()
+        except _ErrorLimit:
+            pass
+        for event in pending:
+            yield event
+
+    def interrupt_handler_hsd(self, command):
+        fname = unquote(command.strip())
+        parser = self._makesubparser()
+        parser.interrupt_handler_hsd = self.interrupt_handler_hsd
+        parser.interrupt_handler_txt = self.interrupt_handler_txt
+        parser.setposition(fname)
+        # The include belongs to the innermost parser of the chain of
+        # included files, so that the chain reflects the nesting.
+        including = self
+        while including._subparser is not None:
+            including = including._subparser
+        including._subparser = parser
+        try:
+            parser.feed(io.StringIO(self._getinclude(fname)))
+        finally:
+            including._subparser = None
+        self._checkerrorlimit()
+
+    def interrupt_handler_txt(self, command):
+        return self._getinclude(unquote(command.strip()))
+
+    def _getinclude(self, fname):
+        """Returns the content of an included file loaded in advance."""
+        content = self._includes.get(fname)
+        if content is None:
+            raise HSDParserError("Included file '{}' was not loaded."
+                                 .format(fname))
+        if isinstance(content, Exception):
+            raise content
+        return content
+
+    async def _loadincludes(self, line):
+        """Loads the files possibly included in a line (and recursively)."""
+        for sign in _INCLUDE_SIGNS:
+            if sign not in line:
+                continue
+            fname = unquote(line.partition(sign)[2].strip())
+            if not fname or fname in self._includes:
+                continue
+            try:
+                content = await self._loader(fname)
+            except Exception as exc:
+                # Text may only look like an interrupt (e.g. in a comment),
+                # the error is raised only if the content is really needed.
+                self._includes[fname] = exc
+                continue
+            self._includes[fname] = content
+            if sign == "<<!":
+                for includedline in content.split("\n"):
+                    if "<<" in includedline:
+                        await self._loadincludes(includedline)
+
+    async def _lines(self, source):
+        """Iterates over the lines of an asynchronous source."""
+        decoder = codecs.getincrementaldecoder(self._encoding)()
+        if isinstance(source, asyncio.StreamReader):
+            source = _streamchunks(source)
+        # Lines end only at "\n" (or "\r\n"), as for HSDParser.feed(). A
+        # trailing "\r" stays in the rest until the next chunk arrives.
+        rest = ""
+        async for chunk in source:
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            lines = (rest + chunk).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                if line.endswith("\r"):
+                    line = line[:-1]
+                yield line + "\n"
+        rest += decoder.decode(b"", True)
+        if rest:
+            yield rest
+
+
+async def _streamchunks(reader, chunksize=65536):
+    """Iterates over the chunks of a StreamReader."""
+    while True:
+        chunk = await reader.read(chunksize)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _yieldcontrol():
+    await asyncio.sleep(0)
+
+
+async def buildtree(source, parser=None, builder=HSDTreeBuilder):
+    """Builds a tree from an asynchronous source.
+
+    Args:
+        source: asyncio.StreamReader or asynchronous iterable over chunks of
+            the input.
+        parser: AsyncHSDParser instance to use (default: AsyncHSDParser()).
+        builder: Tree builder class (default: HSDTreeBuilder).
+
+    Returns:
+        Root of the tree.
+    """
+    if parser is None:
+        parser = AsyncHSDParser()
+    treebuilder = builder(parser=parser)
+    treebuilder.startdocument()
+    await parser.feed_async(source)
+    return treebuilder.enddocument()
+
+
+class AsyncTarget:
+    """Formatter target writing into an asyncio.StreamWriter.
+
+    The formatters write synchronously into the target, which passes the data
+    to the underlying transport. The writing coroutines await drain() in
+    regular intervals, which waits until the buffer of the transport is
+    flushed below its high-water mark, if more than highwater bytes were
+    written since the last call.
+    """
+
+    def __init__(self, writer, encoding="utf-8", highwater=65536):
+        """Initializes an AsyncTarget instance.
+
+        Args:
+            writer: asyncio.StreamWriter (or any object with write() accepting
+                bytes and a drain() coroutine).
+            encoding: Encoding of the output.
+            highwater: Number of bytes written before drain() waits for the
+                writer.
+        """
+        self._writer = writer
+        self._encoding = encoding
+        self._highwater = highwater
+        self._pending = 0
+
+    def write(self, text):
+        data = text.encode(self._encoding)
+        self._writer.write(data)
+        self._pending += len(data)
+
+    async def drain(self):
+        """Waits for the writer if enough data has been written."""
+        if self._pending >= self._highwater:
+            self._pending = 0
+            await self._writer.drain()
+        else:
+            await asyncio.sleep(0)
+
+
+async def formathsd(source, target, parser=None, **formatteroptions):
+    """Formats HSD input from an asynchronous source into an async target.
+
+    Args:
+        source: asyncio.StreamReader or asynchronous iterable over chunks of
+            the input.
+        target: AsyncTarget instance.
+        parser: AsyncHSDParser instance to use (default: AsyncHSDParser()).
+        **formatteroptions: Options passed to HSDFormatter.
+    """
+    if parser is None:
+        parser = AsyncHSDParser()
+    formatter = HSDFormatter(target=target, **formatteroptions)
+    parser.start_handler = formatter.start_tag
+    parser.close_handler = formatter.close_tag
+    parser.text_handler = formatter.text
+    parser.array_handler = formatter.array
+    await parser.feed_async(source, tick=target.drain)
+    await target.drain()
+
+
+async def writehsd(tree, target, formatter=None, arraywriter=None,
+                   yieldinterval=_YIELDINTERVAL):
+    """Writes a tree into an async target (see HSDTree.writehsd()).
+
+    Args:
+        tree: HSDTree instance.
+        target: AsyncTarget instance.
+        formatter: Formatter object writing into the target (default:
+            HSDFormatter(target=target)).
+        arraywriter: Optional callable storing array payloads externally.
+        yieldinterval: Number of nodes written before target.drain() is
+            awaited.
+    """
+    if formatter is None:
+        formatter = HSDFormatter(target=target)
+    nnodes = 0
+    for _ in tree.iterwritehsd(formatter, arraywriter):
+        nnodes += 1
+        if nnodes == yieldinterval:
+            nnodes = 0
+            await target.drain()
+    await target.drain()
@@ -0,0 +1,142 @@
+"""Client for the local HSD parse server (see hsd.server)."""
+import os
+import json
+import struct
+import socket
+import hsd.common
+from hsd.common import *
+from hsd.server import DEFAULT_ADDRESS, send, receive, decodetree, _OK
+
+__all__ = [ "HSDClient" ]
+
+# Exceptions re-raised by their name, if the server reports them
+_EXCEPTIONS = dict(
+    [ (name, cls) for name, cls in vars(hsd.common).items()
+      if isinstance(cls, type) and issubclass(cls, HSDException) ]
+    + [ (cls.__name__, cls) for cls in ( OSError, FileNotFoundError,
+                                         PermissionError, IsADirectoryError,
+                                         NotADirectoryError ) ])
+
+
+class HSDClient:
+    """Connection to an HSDServer.
+
+    The connection is opened at the first request and kept open until close()
+    is called. A client must not be shared between threads.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        """Initializes an HSDClient instance.
+
+        Args:
+            address: Path of the socket of the server.
+            timeout: Timeout for the socket operations in seconds (default:
+                no timeout).
+        """
+        self._address = address
+        self._timeout = timeout
+        self._sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the connection."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def ping(self):
+        """Checks whether the server is responding."""
+        self._request("ping")
+
+    def parse(self, fname):
+        """Returns the root of the tree of a file.
+
+        Args:
+            fname: Name of the file (relative to the current directory).
+        """
+        return decodetree(self._request("parse", os.path.abspath(fname)))
+
+    def query(self, fname, path):
+        """Returns the elements matching a path in the tree of a file.
+
+        Args:
+            fname: Name of the file (relative to the current directory).
+            path: ElementTree path relative to the root (e.g.
+                "Hamiltonian/DFTB/SCC").
+
+        Returns:
+            List of the matching elements.
+        """
+        return [ decodetree(data) for data in
+                 self._request("query", os.path.abspath(fname), path) ]
+
+    def format(self, fname):
+        """Returns the content of a file in HSD format as string.
+
+        Args:
+            fname: Name of the file (relative to the current directory).
+        """
+        return self._request("format", os.path.abspath(fname))
+
+    def stats(self):
+        """Returns the cache statistics of the server."""
+        return self._request("stats")
+
+    def _request(self, *request):
+        """Sends a request and returns the result or raises its exception."""
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            try:
+                sock.connect(self._address)
+                _checkpeer(sock, self._address)
+            except Exception:
+                sock.close()
+                raise
+            self._sock = sock
+        try:
+            send(self._sock, json.dumps(request).encode("utf-8"))
+            reply = receive(self._sock)
+        except OSError:
+            self.close()
+            raise
+        if reply is None:
+            self.close()
+            raise HSDException("Connection closed by the server.")
+        result = json.loads(reply[1:].decode("utf-8"))
+        if reply[:1] != _OK:
+            raise _exception(*result)
+        return result
+
+
+def _checkpeer(sock, address):
+    """Checks that the server is run by the same user as the client.
+
+    Raises:
+        HSDException: If the server is run by an other user.
+    """
+    peercred = getattr(socket, "SO_PEERCRED", None)
+    if peercred is not None:
+        creds = struct.Struct("3i")
+        uid = creds.unpack(sock.getsockopt(socket.SOL_SOCKET, peercred,
+                                           creds.size))[1]
+    else:
+        uid = os.stat(address).st_uid
+    if uid != os.getuid():
+        raise HSDException("Server on '{}' is run by an other user."
+                           .format(address))
+
+
+def _exception(name, message, errno=None, filename=None):
+    """Returns the exception reported by the server."""
+    cls = _EXCEPTIONS.get(name)
+    if cls is None:
+        return HSDException("{}: {}".format(name, message))
+    if errno is not None and issubclass(cls, OSError):
+        return cls(errno, message, filename)
+    return cls(message)
@@ -2,6 +2,7 @@ HSDATTR_PROC = "processed"
 HSDATTR_EQUAL = "equal"
 HSDATTR_FILE = "file"
 HSDATTR_LINE = "lines"
+HSDATTR_ARRAY = "array"
 
 class HSDException(Exception):
     """Base class for exceptions in the HSD packages."""
@@ -37,6 +38,107 @@ class HSDParserError(HSDException):
     pass
 
 
+class HSDBinaryInclude:
+    """Reference to an array stored in a binary file.
+    
+    Attributes:
+        fname: Name of the file containing the array.
+        dtype: Data type of the array, if the file contains raw binary data,
+            None if it is stored in numpy's .npy format.
+        shape: Shape of the array in a raw binary file (or None).
+    """
+    
+    # Interrupt sign introducing a binary include in HSD
+    sign = "<<@"
+    
+    def __init__(self, fname, dtype=None, shape=None):
+        self.fname = fname
+        self.dtype = dtype
+        self.shape = tuple(shape) if shape is not None else None
+        
+    @classmethod
+    def fromcommand(cls, command):
+        """Creates a reference from the command of a binary include interrupt.
+        
+        Args:
+            command: File name (eventually quoted), optionally followed by the
+                data type and the dimensions of the array.
+                
+        Returns:
+            HSDBinaryInclude instance.
+            
+        Raises:
+            HSDParserError: if the command is invalid.
+        """
+        import shlex
+        try:
+            words = shlex.split(command)
+            shape = [ int(word) for word in words[2:] ] or None
+        except ValueError:
+            raise HSDParserError("Invalid binary include '{}'.".format(
+                command.strip()))
+        if not words:
+            raise HSDParserError("Missing file name in binary include.")
+        dtype = words[1] if len(words) > 1 else None
+        return cls(words[0], dtype, shape)
+    
+    def totext(self):
+        """Returns the HSD representation of the include."""
+        import shlex
+        words = [ self.sign, shlex.quote(self.fname) ]
+        if self.dtype is not None:
+            words.append(self.dtype)
+            if self.shape is not None:
+                words += [ str(dim) for dim in self.shape ]
+        return " ".join(words)
+
+    
+class HSDInterner:
+    """Keeps a single instance of equal strings.
+    
+    Tag names and option names are always interned. Values (option values
+    and texts) are only interned, if they are short, and only up to a given
+    number of different values, so that documents with many distinct values
+    do not fill the table. An interner can be used for a single document or
+    shared by the parsers of a batch of similar documents.
+    """
+    
+    def __init__(self, maxvaluelen=32, maxvalues=65536):
+        """Initializes an HSDInterner instance.
+        
+        Args:
+            maxvaluelen: Maximal length of the values to intern.
+            maxvalues: Maximal number of different values to intern (0: do not
+                intern values).
+        """
+        self.maxvaluelen = maxvaluelen
+        self.maxvalues = maxvalues
+        self._strings = {}
+        self._nvalues = 0
+        
+    def name(self, string):
+        """Returns the interned instance of a tag or option name."""
+        return self._strings.setdefault(string, string)
+    
+    def value(self, string):
+        """Returns the interned instance of a value (or the value itself)."""
+        if len(string) > self.maxvaluelen:
+            return string
+        interned = self._strings.get(string)
+        if interned is not None:
+            return interned
+        if self._nvalues >= self.maxvalues:
+            return string
+        self._nvalues += 1
+        self._strings[string] = string
+        return string
+    
+    def clear(self):
+        """Empties the table."""
+        self._strings.clear()
+        self._nvalues = 0
+    
+    
 def unquote(txt):
     """Giving string without quotes if enclosed in those."""
     if len(txt) >= 2 and (txt[0] in "\"'") and txt[-1] == txt[0]:
@@ -66,3 +168,58 @@ def splitbycharset(txt, charset):
         return '',  txt, '' 
     return txt[firstpos], txt[:firstpos], txt[firstpos+1:]
 
+
+class _ReadOnlyElement:
+    """Reading part of the element interface for read-only node proxies.
+
+    Subclasses provide tag, text, attrib, hsdattrib, len(), indexing and
+    iteration. Paths in find() and findall() consist of tag names, "*" or "."
+    separated by "/".
+    """
+
+    __slots__ = ()
+
+    tail = None
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def keys(self):
+        return self.attrib.keys()
+
+    def items(self):
+        return self.attrib.items()
+
+    def find(self, path):
+        for elem in self._select(path):
+            return elem
+        return None
+
+    def findall(self, path):
+        return list(self._select(path))
+
+    def findtext(self, path, default=None):
+        elem = self.find(path)
+        if elem is None:
+            return default
+        return elem.text or ""
+
+    def iter(self, tag=None):
+        if tag == "*":
+            tag = None
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self:
+            yield from child.iter(tag)
+
+    def _select(self, path):
+        """Iterates over the nodes matching a simple path."""
+        elems = [ self, ]
+        for step in path.split("/"):
+            if step == ".":
+                continue
+            if not step or step == ".." or "[" in step or "{" in step:
+                raise ValueError("Unsupported path '{}'.".format(path))
+            elems = [ child for elem in elems for child in elem
+                      if step == "*" or child.tag == step ]
+        return elems
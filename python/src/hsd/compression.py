@@ -0,0 +1,177 @@
+"""Transparent handling of compressed input and output streams.
+
+Supported are the compression formats of the standard library: gzip, bz2 and
+xz/lzma. The format of an input is determined by the suffix of the file name,
+or if it has no known suffix, by the magic bytes at the beginning of the data.
+Decompression happens chunk by chunk while the stream is read.
+"""
+import io
+import bz2
+import gzip
+import lzma
+from contextlib import contextmanager
+from hsd.common import HSDException
+
+__all__ = [ "COMPRESSIONS", "getcompression", "openinput", "openoutput" ]
+
+
+def _gzipfile(fileobj, mode):
+    """Opens a gzip file by name or on top of a binary stream."""
+    if isinstance(fileobj, str):
+        return gzip.GzipFile(fileobj, mode)
+    return gzip.GzipFile(fileobj=fileobj, mode=mode)
+
+
+# Functions opening a file name or binary stream with a given compression
+COMPRESSIONS = { "gzip": _gzipfile, "bz2": bz2.BZ2File, "xz": lzma.LZMAFile }
+
+# File name suffixes of the compression formats
+_SUFFIXES = { ".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".lzma": "xz" }
+
+# Magic bytes of the compression formats
+_MAGICS = [ (b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "xz") ]
+
+
+def getcompression(fname):
+    """Returns the compression format belonging to the suffix of a file name.
+
+    Args:
+        fname: Name of the file.
+
+    Returns:
+        Name of the compression format (key of COMPRESSIONS) or None.
+    """
+    for suffix, compression in _SUFFIXES.items():
+        if fname.endswith(suffix):
+            return compression
+    return None
+
+
+@contextmanager
+def openinput(fileobj):
+    """Opens an input for reading text, decompressing it if necessary.
+
+    Args:
+        fileobj: Name of a file, text stream or binary stream. Binary streams
+            and files are decompressed if they are compressed.
+
+    Yields:
+        Text stream with the (decompressed) content. Streams passed in are not
+        closed on exit.
+    """
+    if isinstance(fileobj, str):
+        compression = getcompression(fileobj)
+        fp = open(fileobj, "rb")
+        try:
+            text = io.TextIOWrapper(_decompress(fp, compression))
+        except:
+            fp.close()
+            raise
+        try:
+            yield text
+        finally:
+            text.close()
+            fp.close()
+    elif not _isbinary(fileobj):
+        yield fileobj
+    else:
+        buffered = fileobj
+        if not hasattr(buffered, "peek"):
+            buffered = io.BufferedReader(fileobj)
+        stream = _decompress(buffered, None)
+        text = io.TextIOWrapper(stream)
+        try:
+            yield text
+        finally:
+            # Release the wrappers without closing the stream passed in
+            text.detach()
+            if stream is not buffered:
+                stream.close()
+            if buffered is not fileobj:
+                buffered.detach()
+
+
+def openoutput(target, compression=None):
+    """Opens an output for writing text, compressing it if requested.
+
+    Args:
+        target: Name of a file, text stream or binary stream.
+        compression: Compression format (key of COMPRESSIONS). For file names
+            it is derived from the suffix if not specified. Text streams can
+            only be compressed if they have an underlying binary buffer.
+
+    Returns:
+        Tuple of a text stream and a function, which must be called after
+        writing has been finished. The function closes the file opened or
+        finishes the compressed stream, but does not close streams passed in.
+
+    Raises:
+        HSDException: If the compression format is unknown or the target can
+            not be compressed.
+    """
+    if isinstance(target, str):
+        if compression is None:
+            compression = getcompression(target)
+        if compression is None:
+            fp = open(target, "w")
+            return fp, fp.close
+        fp = _compressor(compression)(target, "wb")
+        text = io.TextIOWrapper(fp)
+        return text, text.close
+    if compression is None:
+        if not _isbinary(target):
+            return target, getattr(target, "flush", _donothing)
+        stream = target
+    else:
+        if not _isbinary(target):
+            if not hasattr(target, "buffer"):
+                raise HSDException("Text stream can not be compressed.")
+            target.flush()
+            target = target.buffer
+        stream = _compressor(compression)(target, "wb")
+    text = io.TextIOWrapper(stream)
+
+    def finish():
+        # Release the wrappers without closing the stream passed in
+        text.flush()
+        text.detach()
+        if stream is not target:
+            stream.close()
+
+    return text, finish
+
+
+def _donothing():
+    pass
+
+
+def _compressor(compression):
+    """Returns the function opening streams with a compression format."""
+    try:
+        return COMPRESSIONS[compression]
+    except KeyError:
+        raise HSDException("Unknown compression format '{}'.".format(
+            compression))
+
+
+def _isbinary(fileobj):
+    """Whether a file object is a binary stream."""
+    if isinstance(fileobj, io.TextIOBase):
+        return False
+    if isinstance(fileobj, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    mode = getattr(fileobj, "mode", "")
+    return isinstance(mode, str) and "b" in mode
+
+
+def _decompress(fp, compression):
+    """Wraps a buffered binary stream into a decompressor if needed."""
+    if compression is None:
+        magic = fp.peek(6)
+        for magicbytes, name in _MAGICS:
+            if magic.startswith(magicbytes):
+                compression = name
+                break
+        else:
+            return fp
+    return _compressor(compression)(fp, "rb")
@@ -1,9 +1,10 @@
 """Contains various converters for the query module."""
+import re
 from hsd.common import *
-from hsd.tree import Element
 
 __all__ = [ "HSDConverter", "HSDNode", "HSDScalar", "HSDScalarUnit", "HSDList",
-            "HSDListUnit", "MultiplicativeUnitConverter",
+            "HSDListUnit", "MultiplicativeUnitConverter", "AffineUnitConverter",
+            "unitconversion",
             "TxtConverter", "TxtFloat", "TxtInt", "TxtBool", "TxtStr",
             "hsdnode", "hsdfloat", "hsdint", "hsdbool", "hsdstr",
             "hsdfloatlist", "hsdintlist", "hsdboollist", "hsdstrlist"]
@@ -50,6 +51,7 @@ class HSDConverter:
         Raises:
             Anything derived from the HSD exceptions on error.
         """
+        from hsd.tree import Element
         node = Element(tag, attrib)
         node.text = str(value)
         return node
@@ -97,6 +99,7 @@ class HSDNode(HSDConverter):
         return node[0]
     
     def tohsd(self, tag, value, attrib):
+        from hsd.tree import Element
         node = Element(tag, attrib)
         node.append(value)
         return node
@@ -121,13 +124,14 @@ class HSDScalar(HSDConverter):
     def fromhsd(self, node):
         self.checkattributes(node)
         try:
-            elem = self.type.fromtxt(node.text.strip())
+            elem = self.type.fromtxt(_gettext(node).strip())
         except ValueError:
             raise HSDInvalidTagValueException(msg="The value of tag '{}' could "
                 "not be converted.".format(node.tag), node=node)
         return elem 
     
     def tohsd(self, tag, value, attrib):
+        from hsd.tree import Element
         node = Element(tag, attrib)
         node.text = self.type.totxt(value)
         return node
@@ -159,7 +163,10 @@ class HSDScalarUnit(HSDScalar):
         elem = super().fromhsd(node)
         unit = node.get(self.unitattrib, None)
         if unit:
-            return self.unitconverter(elem, unit)
+            try:
+                return self.unitconverter(elem, unit)
+            except KeyError:
+                raise _invalidunit(node, unit)
         else:
             return elem
          
@@ -188,7 +195,7 @@ class HSDList(HSDConverter):
     def fromhsd(self, node):
         self.checkattributes(node)
         try:
-            elems = [ self.type.fromtxt(ss) for ss in node.text.split() ]
+            elems = [ self.type.fromtxt(ss) for ss in _gettext(node).split() ]
         except ValueError:
             raise HSDInvalidTagValueException(node=node, msg="One of the "
                 "values of tag '{}' could not be converted.".format(node.tag))
@@ -196,8 +203,10 @@ class HSDList(HSDConverter):
             raise HSDInvalidTagValueException(node=node, msg="Tag '{}' contains"
                 " {} elements instead of {}.".format(node.tag, len(elems), 
                                                      self.nitem)) 
+        return elems
     
     def tohsd(self, tag, value, attrib):
+        from hsd.tree import Element
         strs = [ self.type.totxt(vv) for vv in value ]
         return Element(" ".join(strs), attrib)
     
@@ -226,15 +235,23 @@ class HSDListUnit(HSDList):
         super().__init__(valuetype, nitem)
         self.unitconverter = unitconverter
         self.unitattrib = unitattrib
-        self.setallowedattribs(unitattrib)
+        self.setallowedattribs([ unitattrib, ])
         
     def fromhsd(self, node):
-        elems = super().fromhsd(self, node)
+        elems = super().fromhsd(node)
         unit = node.get(self.unitattrib, None)
-        if unit:
-            return [ self.unitconverter(elem, unit) for elem in elems ]
-        else:
-            return elem
+        if not unit:
+            return elems
+        conversion = unitconversion(self.unitconverter, unit, node)
+        if conversion is None:
+            try:
+                return [ self.unitconverter(elem, unit) for elem in elems ]
+            except KeyError:
+                raise _invalidunit(node, unit)
+        factor, offset = conversion
+        if offset:
+            return [ elem * factor + offset for elem in elems ]
+        return [ elem * factor for elem in elems ]
 
 
 #########################################################################
@@ -299,7 +316,13 @@ class TxtStr(TxtConverter):
 
 
 class MultiplicativeUnitConverter:
-    """Implements a conversion by multiplication with a conversion factor."""
+    """Implements a conversion by multiplication with a conversion factor.
+    
+    Apart of the units in the dictionary, compound units built out of them with
+    "*", "/" and integer powers ("^") are accepted as well (e.g. "eV/AA",
+    "kcal/mol", "AA^3"). Every unit string is resolved only once, the factor
+    obtained is stored and reused in subsequent conversions.
+    """
     
     def __init__(self, units):
         """Initializes the converter.
@@ -309,6 +332,97 @@ class MultiplicativeUnitConverter:
                 values contain the corresponding float conversion factor.
         """
         self.units = units
+        self._factors = {}
+        
+    def __call__(self, value, unit):
+        """Does the conversion.
+        
+        Args:
+            value: Value in a given unit.
+            unit: Name of the unit.
+            
+        Returns:
+            Converted value.        
+        """
+        return value * self.getfactor(unit)
+    
+    def getconversion(self, unit):
+        """Returns the conversion for a given unit.
+        
+        Args:
+            unit: Name of the unit.
+            
+        Returns:
+            Tuple (factor, offset), with offset being always zero.
+            
+        Raises:
+            KeyError: if the unit (or one of its components) is unknown.
+        """
+        return self.getfactor(unit), 0.0
+    
+    def getfactor(self, unit):
+        """Returns the conversion factor for a given (possibly compound) unit.
+        
+        Args:
+            unit: Name of the unit.
+            
+        Returns:
+            Conversion factor.
+            
+        Raises:
+            KeyError: if the unit (or one of its components) is unknown.
+        """
+        factor = self._factors.get(unit)
+        if factor is None:
+            factor = self._resolve(unit)
+            self._factors[unit] = factor
+        return factor
+    
+    def _resolve(self, unit):
+        """Calculates the conversion factor of a compound unit."""
+        factor = self.units.get(unit)
+        if factor is not None:
+            return factor
+        words = _COMPOUND_UNIT_SPLITTER.split(unit.strip())
+        factor = self._resolveterm(words[0], unit)
+        for ii in range(1, len(words), 2):
+            termfactor = self._resolveterm(words[ii + 1], unit)
+            if words[ii] == "*":
+                factor *= termfactor
+            else:
+                factor /= termfactor
+        return factor
+    
+    def _resolveterm(self, term, unit):
+        """Calculates the conversion factor of a (powered) unit term."""
+        name, caret, power = term.partition("^")
+        if name == "1" and not caret:
+            return 1.0
+        if name not in self.units:
+            raise KeyError(unit)
+        if not caret:
+            return self.units[name]
+        try:
+            return self.units[name]**int(power)
+        except ValueError:
+            raise KeyError(unit)
+        
+
+class AffineUnitConverter:
+    """Implements a conversion by a conversion factor and an offset.
+    
+    The converted value is value * factor + offset, allowing for units with
+    shifted origin (e.g. temperatures in Celsius).
+    """
+    
+    def __init__(self, units):
+        """Initializes the converter.
+        
+        Args:
+            units: Dictionary. Key contain the name of the units in text form,
+                values contain the (factor, offset) tuple of the conversion.
+        """
+        self.units = units
         
     def __call__(self, value, unit):
         """Does the conversion.
@@ -320,9 +434,77 @@ class MultiplicativeUnitConverter:
         Returns:
             Converted value.        
         """
-        factor = self.units[unit]
-        return value * factor
+        factor, offset = self.units[unit]
+        return value * factor + offset
     
+    def getconversion(self, unit):
+        """Returns the conversion for a given unit.
+        
+        Args:
+            unit: Name of the unit.
+            
+        Returns:
+            Tuple (factor, offset).
+            
+        Raises:
+            KeyError: if the unit is unknown.
+        """
+        return self.units[unit]
+    
+
+def unitconversion(unitconverter, unit, node):
+    """Resolves the conversion belonging to the unit of a node.
+    
+    Converters with many values should call it only once per node and apply
+    the returned factor and offset to all values at once.
+    
+    Args:
+        unitconverter: Unit converter. If it offers a getconversion() method
+            (as MultiplicativeUnitConverter and AffineUnitConverter), it is
+            used to look up the conversion.
+        unit: Name of the unit.
+        node: Node containing the values (used for error reporting).
+        
+    Returns:
+        Tuple (factor, offset) or None, if the unit converter is a simple
+        callable, which must be called for each value separately.
+        
+    Raises:
+        HSDInvalidAttributeValueException: if the unit is unknown.
+    """
+    getconversion = getattr(unitconverter, "getconversion", None)
+    if getconversion is None:
+        return None
+    try:
+        return getconversion(unit)
+    except KeyError:
+        raise _invalidunit(node, unit)
+    
+    
+def _gettext(node):
+    """Returns the text of a node (empty string if it has none).
+    
+    Raises:
+        HSDInvalidTagValueException: If the node carries an array payload
+            instead of text (e.g. filled by a text sink).
+    """
+    text = node.text
+    if text is None:
+        if node.hsdattrib and HSDATTR_ARRAY in node.hsdattrib:
+            raise HSDInvalidTagValueException(node=node, msg="Tag '{}' "
+                "contains an array payload instead of text.".format(node.tag))
+        return ""
+    return text
+
+
+def _invalidunit(node, unit):
+    """Creates the exception signalizing an unknown unit."""
+    return HSDInvalidAttributeValueException(node=node, msg="Invalid unit '{}'"
+        " in tag '{}'.".format(unit, node.tag))
+
+
+_COMPOUND_UNIT_SPLITTER = re.compile(r"\s*([*/])\s*")
+
 
 ###########################################################################
 # Convenience functions, abbreviations
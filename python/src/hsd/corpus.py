@@ -0,0 +1,263 @@
+"""Searchable index of the tags of many HSD files.
+
+The tags of all files of a corpus are stored in an SQLite database, each with
+its path (tag names separated by "/"), options, the beginning of its text, the
+numerical value of the text (if it is a single number), the file and the line.
+Queries are answered from the database without reading the HSD files.
+"""
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from hsd.common import *
+from hsd.parser import HSDParser
+
+__all__ = [ "HSDCorpus", "MAXTEXT" ]
+
+# Maximal number of characters stored of the text of a tag
+MAXTEXT = 64
+
+# Comparison operators allowed in queries
+_OPERATORS = frozenset([ "=", "!=", "<", "<=", ">", ">=", "like", "glob" ])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    file INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    attrib TEXT,
+    text TEXT,
+    number REAL,
+    line INTEGER
+);
+CREATE INDEX IF NOT EXISTS tags_path_text ON tags (path, text);
+CREATE INDEX IF NOT EXISTS tags_path_number ON tags (path, number);
+CREATE INDEX IF NOT EXISTS tags_file ON tags (file);
+"""
+
+
+class HSDCorpus:
+    """Index of the tags of a collection of HSD files."""
+
+    def __init__(self, dbname):
+        """Opens (or creates) the database of a corpus.
+
+        Args:
+            dbname: Name of the SQLite database file.
+        """
+        self._db = sqlite3.connect(dbname)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database."""
+        self._db.close()
+
+    def update(self, fnames, processes=None, chunksize=16):
+        """Indexes new and changed files.
+
+        Files, whose size and modification time agree with the values stored
+        in the database, are skipped. The entries of files, which do not
+        exist (any more), are removed from the index. Other files, which can
+        not be read, are indexed with the error (see errors()).
+
+        Args:
+            fnames: Iterable over the names of the files to index.
+            processes: If specified, the files are parsed by a process pool
+                with the given number of processes (0 or None: no pool).
+            chunksize: Number of files sent at once to a process.
+
+        Returns:
+            List of the names of the files, which have been (re)indexed.
+        """
+        known = dict([ (name, (size, mtime)) for name, size, mtime
+                       in self._db.execute(
+                           "SELECT name, size, mtime FROM files") ])
+        changed = []
+        missing = []
+        for fname in fnames:
+            fname = os.path.abspath(fname)
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                missing.append(fname)
+                continue
+            except OSError:
+                changed.append(fname)
+                continue
+            if known.get(fname) != (stat.st_size, stat.st_mtime_ns):
+                changed.append(fname)
+        with self._db:
+            for fname in missing:
+                self._remove(fname)
+        if not processes:
+            results = map(_indexfile, changed)
+            self._store(results)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                self._store(executor.map(_indexfile, changed,
+                                         chunksize=chunksize))
+        return changed
+
+    def prune(self):
+        """Removes the entries of files, which do not exist any more.
+
+        Returns:
+            List of the names of the removed files.
+        """
+        removed = [ name for name, in self._db.execute(
+            "SELECT name FROM files") if not os.path.exists(name) ]
+        with self._db:
+            for name in removed:
+                self._remove(name)
+        return removed
+
+    def errors(self):
+        """Returns the files which could not be indexed.
+
+        Returns:
+            List of (file name, error message) tuples.
+        """
+        return self._db.execute("SELECT name, error FROM files WHERE error "
+                                "IS NOT NULL ORDER BY name").fetchall()
+
+    def find(self, path, op=None, value=None):
+        """Returns the occurrences of tags matching a condition.
+
+        Args:
+            path: Path of the tags (e.g. "Hamiltonian/DFTB/SCCTolerance"). If
+                it contains any of the characters "*?[", it is interpreted as
+                glob pattern (e.g. "*/Mixer/Anderson").
+            op: Comparison operator ("=", "!=", "<", "<=", ">", ">=", "like"
+                or "glob"). If None, all tags with the given path match.
+            value: Value to compare with. Numbers are compared with the
+                numerical value of the text, strings with the (beginning of
+                the) text itself.
+
+        Returns:
+            List of (file name, line, text) tuples.
+        """
+        where, args = _condition(path, op, value)
+        return self._db.execute(
+            "SELECT files.name, tags.line, tags.text FROM tags JOIN files ON "
+            "tags.file = files.id WHERE " + where
+            + " ORDER BY files.name, tags.line", args).fetchall()
+
+    def files(self, *conditions):
+        """Returns the files containing tags matching all given conditions.
+
+        Args:
+            *conditions: Either paths or (path, op, value) tuples with the same
+                meaning as the arguments of find().
+
+        Returns:
+            Sorted list of file names.
+        """
+        selects = []
+        allargs = []
+        for condition in conditions:
+            if isinstance(condition, str):
+                condition = (condition, None, None)
+            where, args = _condition(*condition)
+            selects.append("SELECT file FROM tags WHERE " + where)
+            allargs += args
+        if not selects:
+            return []
+        return [ name for name, in self._db.execute(
+            "SELECT name FROM files WHERE id IN (" + " INTERSECT ".join(selects)
+            + ") ORDER BY name", allargs) ]
+
+    def _store(self, results):
+        """Stores the results of the indexing processes."""
+        with self._db:
+            for fname, size, mtime, rows, error in results:
+                self._remove(fname)
+                fileid = self._db.execute(
+                    "INSERT INTO files (name, size, mtime, error) VALUES "
+                    "(?, ?, ?, ?)", (fname, size, mtime, error)).lastrowid
+                self._db.executemany(
+                    "INSERT INTO tags (file, path, attrib, text, number, line) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [ (fileid,) + row for row in rows ])
+
+    def _remove(self, fname):
+        """Removes the entries of a file."""
+        row = self._db.execute("SELECT id FROM files WHERE name = ?",
+                               (fname,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM tags WHERE file = ?", row)
+            self._db.execute("DELETE FROM files WHERE id = ?", row)
+
+
+def _condition(path, op, value):
+    """Returns the SQL condition and its arguments for a query."""
+    if any([ char in path for char in "*?[" ]):
+        where = "path GLOB ?"
+    else:
+        where = "path = ?"
+    args = [ path, ]
+    if op is None:
+        return where, args
+    if op not in _OPERATORS:
+        raise ValueError("Invalid operator '{}'.".format(op))
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        column = "number"
+    else:
+        column = "text"
+        value = str(value)
+    return where + " AND " + column + " " + op.upper() + " ?", args + [ value ]
+
+
+class _TagCollector:
+    """Collects the rows of the tags table from parser events."""
+
+    def __init__(self, parser):
+        self.rows = []
+        self._stack = []
+        self._parser = parser
+        parser.start_handler = self.start
+        parser.close_handler = self.close
+        parser.text_handler = self.data
+
+    def start(self, tagname, options, hsdoptions):
+        if self._stack:
+            path = self._stack[-1][0] + "/" + tagname
+        else:
+            path = tagname
+        attrib = ",".join([ key + "=" + value
+                            for key, value in options.items() ])
+        self._stack.append((path, attrib or None,
+                            hsdoptions.get(HSDATTR_LINE), []))
+
+    def data(self, text):
+        self._stack[-1][3].append(text)
+
+    def close(self, tagname):
+        path, attrib, line, texts = self._stack.pop()
+        text = "".join(texts)
+        number = None
+        if text and len(text) < MAXTEXT and len(text.split()) == 1:
+            try:
+                number = float(text)
+            except ValueError:
+                pass
+        self.rows.append((path, attrib, text[:MAXTEXT] or None, number, line))
+
+
+def _indexfile(fname):
+    """Parses a file and returns its rows (runs in the worker processes)."""
+    try:
+        stat = os.stat(fname)
+    except OSError as exc:
+        return fname, None, None, [], str(exc)
+    parser = HSDParser()
+    collector = _TagCollector(parser)
+    try:
+        parser.feed(fname)
+    except (HSDException, OSError, UnicodeDecodeError) as exc:
+        return fname, stat.st_size, stat.st_mtime_ns, [], str(exc)
+    return fname, stat.st_size, stat.st_mtime_ns, collector.rows, None
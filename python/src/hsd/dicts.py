@@ -0,0 +1,266 @@
+"""Conversion between HSD and nested Python dictionaries (and JSON).
+
+Every tag is mapped onto a key of the dictionary representing its parent. The
+value is
+
+* the text of the tag (or None for empty tags), if the tag has neither
+  children nor options,
+* a dictionary otherwise, containing the children, the options (with keys
+  prefixed by ATTRIB_PREFIX) and the text (with key TEXT_KEY).
+
+The values of tags occurring repeatedly within the same parent are collected
+in a list.
+"""
+import json
+from hsd.common import *
+from hsd.formatter import HSDFormatter, arraytotext
+from hsd.parser import HSDParser
+
+__all__ = [ "ATTRIB_PREFIX", "TEXT_KEY", "to_dict", "to_json", "from_dict" ]
+
+# Prefix of the keys containing the options of a tag
+ATTRIB_PREFIX = "@"
+
+# Key of the text of tags with options or children
+TEXT_KEY = "#text"
+
+
+class _DictBuilder:
+    """Builds nested dictionaries directly from parser events."""
+
+    def __init__(self, parser, converters, toplevel=None):
+        self._parser = parser
+        self._converters = converters or {}
+        self._toplevel = toplevel
+        parser.start_handler = self.start
+        parser.close_handler = self.close
+        parser.text_handler = self.data
+        parser.array_handler = self.array
+        self.root = {}
+        # Open tags, each as [ tag, path, node, haschild, texts, repeated ]
+        self._stack = [ [ None, "", self.root, False, [], set() ] ]
+
+    def start(self, tagname, options, hsdoptions):
+        parent = self._stack[-1]
+        parent[3] = True
+        path = parent[1] + "/" + tagname if parent[1] else tagname
+        node = dict([ (ATTRIB_PREFIX + key, value)
+                      for key, value in options.items() ])
+        self._stack.append([ tagname, path, node, False, [], set() ])
+
+    def data(self, text):
+        self._stack[-1][4].append(text)
+
+    def array(self, array):
+        if isinstance(array, HSDBinaryInclude):
+            self.data(array.totext())
+        else:
+            self.data(arraytotext(array))
+
+    def close(self, tagname):
+        tag, path, node, haschild, texts, _ = self._stack.pop()
+        text = "".join(texts) if texts else None
+        if text is not None:
+            converter = self._converters.get(path)
+            if converter is None:
+                converter = self._converters.get(tag)
+            if converter is not None:
+                try:
+                    text = converter.fromtxt(text)
+                except (ValueError, KeyError):
+                    # TxtBool signals unknown texts by KeyError
+                    raise HSDInvalidTagValueException(msg="The value of tag "
+                        "'{}' could not be converted.".format(path))
+        if haschild or node:
+            if text is not None:
+                node[TEXT_KEY] = text
+            value = node
+        else:
+            value = text
+        parent = self._stack[-1]
+        if len(self._stack) == 1 and self._toplevel is not None:
+            self._toplevel(tag, value)
+            return
+        _addvalue(parent[2], parent[5], tag, value)
+
+
+def _addvalue(node, repeated, tag, value):
+    """Adds the value of a tag to a node, collecting repeated tags in a list."""
+    if tag not in node:
+        node[tag] = value
+    elif tag in repeated:
+        node[tag].append(value)
+    else:
+        node[tag] = [ node[tag], value ]
+        repeated.add(tag)
+
+
+def to_dict(fileobj, converters=None, parser=None):
+    """Converts HSD input into nested dictionaries.
+
+    Args:
+        fileobj: File like object or name of a file containing the HSD input.
+        converters: Dictionary mapping paths (tag names separated by "/", e.g.
+            "Hamiltonian/DFTB/SCC") or tag names onto objects with a fromtxt()
+            method (e.g. hsd.converter.TxtFloat()), which are used to convert
+            the text of the matching tags. Paths take precedence over tag
+            names. Texts of all other tags are stored as strings.
+        parser: Parser to use (default: HSDParser()).
+
+    Returns:
+        Dictionary representing the input.
+
+    Raises:
+        HSDInvalidTagValueException: If a text can not be converted.
+    """
+    if parser is None:
+        parser = HSDParser()
+    builder = _DictBuilder(parser, converters)
+    parser.feed(fileobj)
+    return builder.root
+
+
+def to_json(fileobj, target=None, converters=None, parser=None,
+            **jsonoptions):
+    """Converts HSD input into JSON.
+
+    If a target is given, the output is written while the input is parsed.
+    Only one top level tag (or a run of consecutive top level tags with the
+    same name) is kept in memory at a time.
+
+    Args:
+        fileobj: File like object or name of a file containing the HSD input.
+        target: File where the output should be written. If None, the output
+            is returned as string.
+        converters: Converters for the texts of the tags (see to_dict()).
+        parser: Parser to use (default: HSDParser()).
+        **jsonoptions: Further options passed to json.dumps() (e.g. indent).
+
+    Returns:
+        JSON representation of the input, if no target was given.
+
+    Raises:
+        HSDException: If written to a target and a top level tag appears
+            repeatedly, but not in consecutive blocks.
+    """
+    if target is None:
+        return json.dumps(to_dict(fileobj, converters, parser), **jsonoptions)
+    if parser is None:
+        parser = HSDParser()
+    writer = _JSONStreamWriter(target, jsonoptions)
+    _DictBuilder(parser, converters, toplevel=writer.add)
+    parser.feed(fileobj)
+    writer.close()
+
+
+class _JSONStreamWriter:
+    """Writes the top level tags of a dictionary as they get complete."""
+
+    def __init__(self, target, jsonoptions):
+        self._target = target
+        self._jsonoptions = jsonoptions
+        self._written = set()
+        self._tag = None
+        self._values = []
+        self._separator = "{"
+
+    def add(self, tag, value):
+        if tag != self._tag:
+            if tag in self._written:
+                raise HSDException("Top level tag '{}' repeated after other "
+                                   "tags, can not be streamed.".format(tag))
+            self._flush()
+            self._tag = tag
+        self._values.append(value)
+
+    def close(self):
+        self._flush()
+        self._target.write("{}" if self._separator == "{" else "}")
+
+    def _flush(self):
+        if self._tag is None:
+            return
+        value = self._values[0] if len(self._values) == 1 else self._values
+        self._target.write(self._separator + json.dumps(self._tag) + ": "
+                           + json.dumps(value, **self._jsonoptions))
+        self._separator = ", "
+        self._written.add(self._tag)
+        self._tag = None
+        self._values = []
+
+
+def from_dict(data, formatter=None, converters=None):
+    """Converts nested dictionaries into HSD.
+
+    The events are passed directly to a formatter. Tags containing only single
+    line text (which is not an interrupt) are written with an equal sign, all
+    other tags as blocks.
+
+    Args:
+        data: Dictionary in the format created by to_dict().
+        formatter: Formatter object receiving the events (default:
+            HSDFormatter(), writing to sys.stdout).
+        converters: Dictionary mapping paths or tag names onto objects with a
+            totxt() method used to convert the values of the matching tags.
+            Strings are written as they are, booleans as Yes or No, all other
+            values as returned by str().
+    """
+    if formatter is None:
+        formatter = HSDFormatter()
+    _emitnode(formatter, data, "", converters or {})
+
+
+_TXTBOOL = { True: "Yes", False: "No" }
+
+
+def _emitnode(formatter, node, path, converters):
+    """Passes the children of a node to the formatter."""
+    for key, value in node.items():
+        if key == TEXT_KEY:
+            formatter.text(_totext(value, path, path.rpartition("/")[2],
+                                   converters))
+        elif not key.startswith(ATTRIB_PREFIX):
+            childpath = path + "/" + key if path else key
+            values = value if isinstance(value, list) else [ value, ]
+            for value in values:
+                _emittag(formatter, key, value, childpath, converters)
+
+
+def _emittag(formatter, tag, value, path, converters):
+    """Passes a tag with its content to the formatter."""
+    if isinstance(value, dict):
+        options = dict([ (key[len(ATTRIB_PREFIX):], str(val))
+                         for key, val in value.items()
+                         if key.startswith(ATTRIB_PREFIX) ])
+        haschild = any([ key != TEXT_KEY and not key.startswith(ATTRIB_PREFIX)
+                         for key in value ])
+        text = value.get(TEXT_KEY)
+    else:
+        options = {}
+        haschild = False
+        text = value
+    if text is not None:
+        text = _totext(text, path, tag, converters)
+    # Interrupts (e.g. binary includes) are only recognized in blocks
+    equal = (not haschild and text is not None and "\n" not in text
+             and not text.startswith("<<"))
+    formatter.start_tag(tag, options, { HSDATTR_EQUAL: True } if equal else {})
+    if haschild:
+        _emitnode(formatter, value, path, converters)
+    elif text is not None:
+        formatter.text(text)
+    formatter.close_tag(tag)
+
+
+def _totext(value, path, tag, converters):
+    """Converts a value into HSD text."""
+    converter = converters.get(path)
+    if converter is None:
+        converter = converters.get(tag)
+    if converter is not None:
+        return converter.totxt(value)
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return _TXTBOOL[value]
+    return str(value)
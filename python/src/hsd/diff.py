@@ -0,0 +1,178 @@
+"""Structural differences between HSD trees."""
+import copy
+from collections import namedtuple
+from hsd.common import HSDATTR_ARRAY
+from hsd.tree import FINGERPRINT_HSDATTRIBS
+
+__all__ = [ "HSDPatchOp", "INSERT", "DELETE", "REPLACE", "ATTRIB",
+            "difftrees", "patchtree" ]
+
+# Patch operations
+INSERT = "insert"
+DELETE = "delete"
+REPLACE = "replace"
+ATTRIB = "attrib"
+
+
+# A single patch operation.
+#
+# Nodes are addressed by their path, a tuple of (tag, occurrence) pairs, where
+# occurrence is the index of the node among its siblings with the same tag.
+#
+# op: Operation type (INSERT, DELETE, REPLACE or ATTRIB).
+# path: Path of the parent node for INSERT, path of the node otherwise.
+# index: Position of the inserted node among the children (INSERT only).
+# value: Node to insert or to replace the original node with (INSERT,
+#     REPLACE) or (attrib, hsdattrib) tuple with the new attributes of the
+#     node (ATTRIB). In latter, hsd attributes mapped to None must be removed.
+HSDPatchOp = namedtuple("HSDPatchOp", [ "op", "path", "index", "value" ])
+
+
+def difftrees(old, new, hsdattribs=FINGERPRINT_HSDATTRIBS):
+    """Calculates the patch transforming one tree into an other one.
+
+    Subtrees with equal fingerprints are skipped, so the time needed is
+    proportional to the number of nodes along the paths to the differences.
+    Children of a node are aligned by their tags and by their order among the
+    siblings with the same tag.
+
+    Args:
+        old: Root of the original tree.
+        new: Root of the changed tree.
+        hsdattribs: Names of the hsd attributes taken into account.
+            (default: FINGERPRINT_HSDATTRIBS)
+
+    Returns:
+        List of HSDPatchOp instances, which should be applied in the given
+        order.
+    """
+    hsdattribs = tuple(hsdattribs)
+    ops = []
+    if old.fingerprint(hsdattribs) != new.fingerprint(hsdattribs):
+        if old.tag != new.tag:
+            ops.append(HSDPatchOp(REPLACE, (), None, copy.deepcopy(new)))
+        else:
+            _diffnodes(old, new, (), hsdattribs, ops)
+    return ops
+
+
+def patchtree(root, ops):
+    """Applies a patch to a tree.
+
+    Args:
+        root: Root of the tree to change. It is changed in place.
+        ops: List of HSDPatchOp instances as created by difftrees().
+
+    Returns:
+        Root of the patched tree (differs from the original root only, if the
+        patch replaces the root node).
+
+    Raises:
+        KeyError: If a node addressed by the patch does not exist.
+    """
+    for op, path, index, value in ops:
+        if op == INSERT:
+            _findnode(root, path).insert(index, copy.deepcopy(value))
+        elif op == DELETE:
+            parent = _findnode(root, path[:-1])
+            del parent[_findindex(parent, path[-1])]
+        elif op == REPLACE:
+            if not path:
+                root = copy.deepcopy(value)
+            else:
+                parent = _findnode(root, path[:-1])
+                parent[_findindex(parent, path[-1])] = copy.deepcopy(value)
+        elif op == ATTRIB:
+            node = _findnode(root, path)
+            attrib, hsdattrib = value
+            node.attrib.clear()
+            node.attrib.update(attrib)
+            if node.hsdattrib is None:
+                node.hsdattrib = {}
+            for key, val in hsdattrib.items():
+                if val is None:
+                    node.hsdattrib.pop(key, None)
+                else:
+                    node.hsdattrib[key] = val
+            node.invalidate()
+    return root
+
+
+def _diffnodes(old, new, path, hsdattribs, ops):
+    """Appends the operations transforming old into new (with equal tags)."""
+    if (old.text != new.text or (len(old) == 0) != (len(new) == 0)
+        or _haspayload(old) or _haspayload(new)):
+        ops.append(HSDPatchOp(REPLACE, path, None, copy.deepcopy(new)))
+        return
+    oldhsdattrib = old.hsdattrib or {}
+    newhsdattrib = new.hsdattrib or {}
+    if (old.attrib != new.attrib
+        or any([ oldhsdattrib.get(key) != newhsdattrib.get(key)
+                 for key in hsdattribs ])):
+        hsdattrib = dict([ (key, newhsdattrib.get(key))
+                           for key in hsdattribs ])
+        ops.append(HSDPatchOp(ATTRIB, path, None,
+                              (dict(new.attrib), hsdattrib)))
+    oldkeys = _childkeys(old)
+    newkeys = _childkeys(new)
+    newindices = dict([ (key, ii) for ii, key in enumerate(newkeys) ])
+    matched = []
+    deleted = []
+    for oldindex, key in enumerate(oldkeys):
+        newindex = newindices.get(key)
+        if newindex is None:
+            deleted.append(key)
+        else:
+            matched.append((oldindex, newindex, key))
+    for ii in range(1, len(matched)):
+        if matched[ii][1] < matched[ii - 1][1]:
+            # Children were reordered, replace the entire node.
+            ops.append(HSDPatchOp(REPLACE, path, None, copy.deepcopy(new)))
+            return
+    for key in reversed(deleted):
+        ops.append(HSDPatchOp(DELETE, path + (key,), None, None))
+    oldkeyset = set(oldkeys)
+    for newindex, key in enumerate(newkeys):
+        if key not in oldkeyset:
+            ops.append(HSDPatchOp(INSERT, path, newindex,
+                                  copy.deepcopy(new[newindex])))
+    for oldindex, newindex, key in matched:
+        oldchild, newchild = old[oldindex], new[newindex]
+        if (oldchild.fingerprint(hsdattribs)
+            != newchild.fingerprint(hsdattribs)):
+            _diffnodes(oldchild, newchild, path + (key,), hsdattribs, ops)
+
+
+def _haspayload(node):
+    """Whether node has an array payload."""
+    return bool(node.hsdattrib) and HSDATTR_ARRAY in node.hsdattrib
+
+
+def _childkeys(node):
+    """Returns the (tag, occurrence) keys of the children of a node."""
+    counts = {}
+    keys = []
+    for child in node:
+        occurrence = counts.get(child.tag, 0)
+        counts[child.tag] = occurrence + 1
+        keys.append((child.tag, occurrence))
+    return keys
+
+
+def _findindex(parent, key):
+    """Returns the index of the child with a given (tag, occurrence) key."""
+    tag, occurrence = key
+    for index, child in enumerate(parent):
+        if child.tag == tag:
+            if not occurrence:
+                return index
+            occurrence -= 1
+    raise KeyError(key)
+
+
+def _findnode(root, path):
+    """Returns the node with a given path."""
+    node = root
+    for key in path:
+        node = node[_findindex(node, key)]
+    return node
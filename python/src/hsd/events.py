@@ -0,0 +1,308 @@
+"""Recording and replaying of HSD parser events."""
+import sys
+import json
+from array import array
+from collections import OrderedDict
+from hsd.common import *
+from hsd.parser import HSDParser
+
+__all__ = [ "HSDEventRecording", "HSDEventRecorder", "HSDEventReplayer" ]
+
+# Opcodes of the events
+OP_START = 1
+OP_CLOSE = 2
+OP_TEXT = 3
+OP_ARRAY = 4
+
+# Identifies the files with serialized recordings
+_MAGIC = b"HSDEVENTS1\n"
+
+
+class HSDEventRecording:
+    """Compact columnar representation of a stream of parser events.
+
+    Attributes:
+        ops: Array with the opcodes of the events.
+        args: Array with the integer arguments of the events. Start events
+            have four arguments (tag index, option set index, hsd option set
+            index, line number or -1), close events one (tag index), text
+            events two (offset and length of the text in the text blob) and
+            array events one (index of the payload).
+        tags: List of the (distinct) tag names.
+        optionsets: List of the distinct option sets, each stored as tuple of
+            (key, value) pairs.
+        hsdoptionsets: List of the distinct hsd option sets (without the line
+            number), each stored as tuple of (key, value) pairs.
+        text: String containing the concatenated texts of all text events.
+        payloads: List of the array payloads.
+    """
+
+    def __init__(self):
+        self.ops = array("B")
+        self.args = array("q")
+        self.tags = []
+        self.optionsets = []
+        self.hsdoptionsets = []
+        self.text = ""
+        self.payloads = []
+
+    def replay(self, start_handler, close_handler, text_handler,
+               array_handler=None, sink_handler=None):
+        """Replays the recorded events.
+
+        Args:
+            start_handler: Called with tag name, options and hsd options.
+            close_handler: Called with tag name.
+            text_handler: Called with text.
+            array_handler: Called with array payload (optional).
+            sink_handler: If specified, it is called for each text before
+                text_handler. If it returns True, the text is considered to be
+                processed and text_handler is not called.
+        """
+        args = self.args
+        tags = self.tags
+        optionsets = self.optionsets
+        hsdoptionsets = self.hsdoptionsets
+        text = self.text
+        iarg = 0
+        for op in self.ops:
+            if op == OP_START:
+                itag, iopt, ihsdopt, line = args[iarg:iarg+4]
+                iarg += 4
+                hsdoptions = OrderedDict(hsdoptionsets[ihsdopt])
+                if line >= 0:
+                    hsdoptions[HSDATTR_LINE] = line
+                start_handler(tags[itag], OrderedDict(optionsets[iopt]),
+                              hsdoptions)
+            elif op == OP_CLOSE:
+                close_handler(tags[args[iarg]])
+                iarg += 1
+            elif op == OP_TEXT:
+                offset = args[iarg]
+                txt = text[offset:offset+args[iarg+1]]
+                iarg += 2
+                if sink_handler is None or not sink_handler(txt):
+                    text_handler(txt)
+            else:
+                if array_handler is not None:
+                    array_handler(self.payloads[args[iarg]])
+                iarg += 1
+
+    def save(self, fileobj):
+        """Writes the recording to a binary file.
+
+        Args:
+            fileobj: Binary file like object or name of the file.
+
+        Raises:
+            HSDException: If the recording contains array payloads, which
+                are not binary includes.
+        """
+        payloads = []
+        for payload in self.payloads:
+            if not isinstance(payload, HSDBinaryInclude):
+                raise HSDException("Only binary includes can be stored as "
+                                   "array payloads in recordings.")
+            payloads.append((payload.fname, payload.dtype, payload.shape))
+        text = self.text.encode("utf-8")
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "nops": len(self.ops), "nargs": len(self.args),
+            "ntext": len(text),
+            "tags": self.tags, "optionsets": self.optionsets,
+            "hsdoptionsets": self.hsdoptionsets,
+            "payloads": payloads }).encode("utf-8")
+        isfilename = isinstance(fileobj, str)
+        fp = open(fileobj, "wb") if isfilename else fileobj
+        fp.write(_MAGIC)
+        fp.write("{:d}\n".format(len(header)).encode("ascii"))
+        fp.write(header)
+        fp.write(self.ops.tobytes())
+        fp.write(self.args.tobytes())
+        fp.write(text)
+        if isfilename:
+            fp.close()
+
+    @classmethod
+    def load(cls, fileobj):
+        """Reads a recording written by save().
+
+        Args:
+            fileobj: Binary file like object or name of the file.
+
+        Returns:
+            HSDEventRecording instance.
+
+        Raises:
+            HSDException: If the file does not contain a recording.
+        """
+        isfilename = isinstance(fileobj, str)
+        fp = open(fileobj, "rb") if isfilename else fileobj
+        try:
+            if fp.read(len(_MAGIC)) != _MAGIC:
+                raise HSDException("Invalid HSD event recording.")
+            header = json.loads(fp.read(int(fp.readline())).decode("utf-8"))
+            recording = cls()
+            recording.ops.frombytes(fp.read(header["nops"]))
+            recording.args.frombytes(
+                fp.read(header["nargs"] * recording.args.itemsize))
+            if header["byteorder"] != sys.byteorder:
+                recording.args.byteswap()
+            recording.text = fp.read(header["ntext"]).decode("utf-8")
+        finally:
+            if isfilename:
+                fp.close()
+        recording.tags = header["tags"]
+        recording.optionsets = [ tuple([ tuple(item) for item in items ])
+                                 for items in header["optionsets"] ]
+        recording.hsdoptionsets = [ tuple([ tuple(item) for item in items ])
+                                    for items in header["hsdoptionsets"] ]
+        recording.payloads = [ HSDBinaryInclude(*payload)
+                               for payload in header["payloads"] ]
+        return recording
+
+
+class HSDEventRecorder:
+    """Records the events of a parser into an HSDEventRecording."""
+
+    def __init__(self, parser=None):
+        """Initializes a recorder.
+
+        Args:
+            parser: Parser to record the events of (default: HSDParser()).
+        """
+        if parser:
+            self.parser = parser
+        else:
+            self.parser = HSDParser()
+        self.parser.start_handler = self.start
+        self.parser.close_handler = self.close
+        self.parser.text_handler = self.data
+        self.parser.array_handler = self.array
+        self._reset()
+
+    def start(self, tagname, options, hsdoptions):
+        self._ops.append(OP_START)
+        line = hsdoptions.get(HSDATTR_LINE, -1)
+        if HSDATTR_LINE in hsdoptions:
+            hsdoptions = hsdoptions.copy()
+            del hsdoptions[HSDATTR_LINE]
+        self._args.extend((self._index(self._tags, tagname),
+                           self._index(self._optionsets,
+                                       tuple(options.items())),
+                           self._index(self._hsdoptionsets,
+                                       tuple(hsdoptions.items())),
+                           line))
+
+    def close(self, tagname):
+        self._ops.append(OP_CLOSE)
+        self._args.append(self._index(self._tags, tagname))
+
+    def data(self, text):
+        self._ops.append(OP_TEXT)
+        self._args.extend((self._textlen, len(text)))
+        self._texts.append(text)
+        self._textlen += len(text)
+
+    def array(self, array):
+        self._ops.append(OP_ARRAY)
+        self._args.append(len(self._payloads))
+        self._payloads.append(array)
+
+    def record(self, fileobj):
+        """Parses a HSD input and records the events.
+
+        Args:
+            fileobj: File like object or name of a file containing the data.
+
+        Returns:
+            HSDEventRecording instance.
+        """
+        self.parser.feed(fileobj)
+        recording = HSDEventRecording()
+        recording.ops = self._ops
+        recording.args = self._args
+        recording.tags = list(self._tags)
+        recording.optionsets = list(self._optionsets)
+        recording.hsdoptionsets = list(self._hsdoptionsets)
+        recording.text = "".join(self._texts)
+        recording.payloads = self._payloads
+        self._reset()
+        return recording
+
+    def _reset(self):
+        self._ops = array("B")
+        self._args = array("q")
+        self._tags = {}
+        self._optionsets = {}
+        self._hsdoptionsets = {}
+        self._texts = []
+        self._textlen = 0
+        self._payloads = []
+
+    @staticmethod
+    def _index(table, item):
+        """Returns index of item in an interning table (dict)."""
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+
+class HSDEventReplayer:
+    """Drop-in replacement for HSDParser replaying recorded events.
+
+    It can be passed as parser to objects setting the parser handlers (e.g.
+    HSDTreeBuilder or HSDStreamFormatter), which then process recorded events
+    without parsing the original input again.
+    """
+
+    def start_handler(self, tagname, options, hsdoptions):
+        pass
+
+    def close_handler(self, tagname):
+        pass
+
+    def text_handler(self, text):
+        pass
+
+    def array_handler(self, array):
+        pass
+
+    def __init__(self):
+        self._sink = None
+
+    def feed(self, fileobj):
+        """Replays a recording.
+
+        Args:
+            fileobj: HSDEventRecording instance or binary file (or name of
+                the file) containing a saved recording.
+        """
+        if isinstance(fileobj, HSDEventRecording):
+            recording = fileobj
+        else:
+            recording = HSDEventRecording.load(fileobj)
+        recording.replay(self._start, self._close, self.text_handler,
+                         self.array_handler, self._sinktext)
+
+    def settextsink(self, sink):
+        """Redirects the text of the tag being opened into a sink.
+
+        See HSDParser.settextsink().
+        """
+        self._sink = sink
+
+    def _start(self, tagname, options, hsdoptions):
+        self._sink = None
+        self.start_handler(tagname, options, hsdoptions)
+
+    def _close(self, tagname):
+        self._sink = None
+        self.close_handler(tagname)
+
+    def _sinktext(self, text):
+        if self._sink is None:
+            return False
+        self._sink.feed(text)
+        return True
@@ -1,28 +1,33 @@
 """Formatting utilities for HSD content.
 """
 import sys
-from hsd.common import HSDATTR_EQUAL
+from hsd.common import HSDATTR_EQUAL, HSDBinaryInclude
+from hsd.compression import openoutput
 
-__all__ = [ "HSDFormatter", "HSDStreamFormatter" ]
+__all__ = [ "HSDFormatter", "HSDStreamFormatter", "arraytotext" ]
 
 
 class HSDFormatter:
     """Event controlled formatter producing HSD output."""
     
     def __init__(self, target=sys.stdout, indentstring="  ",
-                 closecomments=False, defattrib=None):
+                 closecomments=False, defattrib=None, compression=None):
         """Initializes HSDFormatter instance.
         
         Args:
-            target: File where the output is written (default: sys.stdout).
+            target: File where the output is written (default: sys.stdout)
+                or name of the file to create.
             indentstring: String used for indenting (default: "  ").
             closecomments: Whether comments after tag closing should indicate
                 which tag was closed (default: False).
             defattrib: When specified, attribute with that name is handled as
                 default. When it is the only attribute, the name is not printed
                 just the value. (default: None)  
+            compression: Compression format of the output ("gzip", "bz2" or
+                "xz"). For file names as target it is derived from the suffix
+                (e.g. ".hsd.gz") if not specified. (default: None)
         """
-        self._target = target
+        self._target, self._finish = openoutput(target, compression)
         self._closecomments = closecomments
         self._indent = indentstring
         self._defattrib = defattrib
@@ -90,6 +95,29 @@ class HSDFormatter:
             self._target.write("\n")
         self._target.write(text)
         self._last2, self._last = self._last, 3
+        
+    def array(self, array):
+        """Adds an array payload between tag opening and closing.
+        
+        Arrays stored in binary files are written as binary include interrupts,
+        all other arrays are written as text.
+        
+        Args:
+            array: Array payload (HSDBinaryInclude or numpy array like object).
+        """
+        if isinstance(array, HSDBinaryInclude):
+            self.text(array.totext())
+        else:
+            self.text(arraytotext(array))
+                
+    def close(self):
+        """Finishes the output.
+        
+        It must be called after the last event, if the target was specified
+        as file name or compression was requested. Files opened by the
+        formatter are closed, streams passed as target are left open.
+        """
+        self._finish()
                 
     def _increaseindentation(self):
         """Increases indentation level and adjusts indentation string."""
@@ -102,6 +130,23 @@ class HSDFormatter:
         self._curindent = self._indentlist.pop()
 
 
+def arraytotext(array):
+    """Converts an array payload (numpy array like object) into HSD text.
+    
+    Args:
+        array: Array payload of a node.
+        
+    Returns:
+        Text representation with one line for each item along the first
+        axis (all values in one line for one dimensional arrays).
+    """
+    if array.ndim > 1:
+        rows = array.reshape((array.shape[0], -1)).tolist()
+    else:
+        rows = [ array.reshape(-1).tolist(), ]
+    return "\n".join([ " ".join([ str(val) for val in row ]) for row in rows ])
+
+
 class HSDStreamFormatter:
     """Reads a HSD feed and writes it on the fly formatted into a stream."""
     
@@ -117,6 +162,7 @@ class HSDStreamFormatter:
         self._parser.start_handler = self._formatter.start_tag
         self._parser.close_handler = self._formatter.close_tag
         self._parser.text_handler= self._formatter.text
+        self._parser.array_handler = self._formatter.array
         
     def feed(self, fileobj):
         """Feeds the printer with content.
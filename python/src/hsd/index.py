@@ -0,0 +1,253 @@
+"""Random access to the blocks of large HSD files via sidecar index files.
+
+The index contains the byte offsets and line numbers of all tags on the first
+two levels of an HSD file. It is stored next to the file (with suffix
+INDEX_SUFFIX appended) and is only used as long as the size and modification
+time of the file agree with the values recorded in it.
+"""
+import os
+import json
+import locale
+from collections import deque
+from hsd.common import *
+from hsd.compression import getcompression
+from hsd.parser import HSDParser
+from hsd.treebuilder import HSDTreeBuilder
+
+__all__ = [ "INDEX_SUFFIX", "HSDIndex", "load_block" ]
+
+# Suffix of the index files
+INDEX_SUFFIX = ".hsdidx"
+
+# Version of the index file format
+_VERSION = 1
+
+# Number of lines, for which offsets are kept while building the index
+_OFFSETCACHE = 256
+
+
+class HSDIndex:
+    """Index of the tags on the first two levels of an HSD file.
+
+    Attributes:
+        fname: Name of the indexed file.
+        entries: Dictionary mapping tag paths (e.g. "Hamiltonian/DFTB") onto
+            lists of (byte offset of the line, line number, column) tuples,
+            one for every occurrence of the path.
+    """
+
+    def __init__(self, fname, entries, size, mtime):
+        self.fname = fname
+        self.entries = entries
+        self._size = size
+        self._mtime = mtime
+
+    @classmethod
+    def build(cls, fname, parser=None):
+        """Builds the index of a file by parsing it.
+
+        Args:
+            fname: Name of the file. It must not be compressed.
+            parser: Parser to use (default: HSDParser()).
+
+        Returns:
+            HSDIndex instance.
+
+        Raises:
+            HSDException: If the file is compressed.
+        """
+        if getcompression(fname):
+            raise HSDException("Compressed file '{}' can not be indexed."
+                               .format(fname))
+        stat = os.stat(fname)
+        if parser is None:
+            parser = HSDParser()
+        entries = {}
+        paths = []
+        offsets = deque(maxlen=_OFFSETCACHE)
+
+        def start(tagname, options, hsdoptions):
+            if len(paths) < 2 and not parser.includelevel():
+                path = paths[-1] + "/" + tagname if paths else tagname
+                line, col = parser.tagposition()
+                for offsetline, offset in reversed(offsets):
+                    if offsetline == line:
+                        entries.setdefault(path, []).append(
+                            (offset, line, col))
+                        break
+            else:
+                path = None
+            paths.append(path)
+
+        def close(tagname):
+            paths.pop()
+
+        parser.start_handler = start
+        parser.close_handler = close
+        parser.setposition(fname)
+        fp = open(fname, "rb")
+        try:
+            parser.feed(_recordoffsets(fp, offsets))
+        finally:
+            fp.close()
+        return cls(fname, entries, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, fname):
+        """Loads the index of a file from its sidecar file.
+
+        Args:
+            fname: Name of the indexed file.
+
+        Returns:
+            HSDIndex instance or None, if the index file does not exist or
+            is not valid for the current state of the file.
+        """
+        try:
+            fp = open(fname + INDEX_SUFFIX, "r")
+            try:
+                data = json.load(fp)
+            finally:
+                fp.close()
+            stat = os.stat(fname)
+        except (OSError, ValueError):
+            return None
+        if (data.get("version") != _VERSION or data["size"] != stat.st_size
+            or data["mtime"] != stat.st_mtime_ns):
+            return None
+        entries = dict([ (path, [ tuple(entry) for entry in pathentries ])
+                         for path, pathentries in data["entries"].items() ])
+        return cls(fname, entries, data["size"], data["mtime"])
+
+    @classmethod
+    def get(cls, fname, parser=None):
+        """Returns a valid index of a file, building and saving it if needed.
+
+        Args:
+            fname: Name of the indexed file.
+            parser: Parser to use, if the index must be built.
+
+        Returns:
+            HSDIndex instance.
+        """
+        index = cls.load(fname)
+        if index is None:
+            index = cls.build(fname, parser)
+            try:
+                index.save()
+            except OSError:
+                pass
+        return index
+
+    def save(self):
+        """Writes the index into the sidecar file."""
+        fp = open(self.fname + INDEX_SUFFIX, "w")
+        json.dump({ "version": _VERSION, "size": self._size,
+                    "mtime": self._mtime, "entries": self.entries }, fp)
+        fp.close()
+
+    def locate(self, path, occurrence=0):
+        """Returns the position of a tag.
+
+        Args:
+            path: Path of the tag (one or two tag names separated by "/").
+            occurrence: Index of the occurrence, if the path occurs several
+                times.
+
+        Returns:
+            Tuple of byte offset of the line, line number and column.
+
+        Raises:
+            KeyError: If the path (or the occurrence) is not in the index.
+        """
+        try:
+            return self.entries[path][occurrence]
+        except IndexError:
+            raise KeyError(path)
+
+
+def load_block(fname, path, occurrence=0, index=None, parser=None,
+               builder=HSDTreeBuilder):
+    """Loads a single block of an HSD file.
+
+    Only the block itself is parsed, starting at the position recorded in the
+    index. The line numbers stored in the hsd attributes are the same as when
+    parsing the entire file.
+
+    Args:
+        fname: Name of the HSD file.
+        path: Path of the tag (one or two tag names separated by "/", e.g.
+            "Hamiltonian/DFTB").
+        occurrence: Index of the occurrence, if the path occurs several times.
+        index: HSDIndex of the file (default: HSDIndex.get(fname)).
+        parser: Parser to use (default: HSDParser()).
+        builder: Tree builder class (default: HSDTreeBuilder).
+
+    Returns:
+        The node of the block.
+
+    Raises:
+        KeyError: If the block does not exist.
+    """
+    if index is None:
+        index = HSDIndex.get(fname)
+    offset, line, col = index.locate(path, occurrence)
+    if parser is None:
+        parser = HSDParser()
+    treebuilder = builder(parser=parser)
+    close_handler = parser.close_handler
+
+    def closeblock(tagname):
+        elem = close_handler(tagname)
+        if not parser.depth():
+            raise _BlockComplete(elem)
+
+    parser.close_handler = closeblock
+    parser.setposition(fname, line)
+    fp = open(fname, "rb")
+    try:
+        fp.seek(offset)
+        treebuilder.build(_blocklines(fp, col))
+    except _BlockComplete as exc:
+        return exc.elem
+    finally:
+        fp.close()
+    raise HSDParserError("Block '{}' not closed in file '{}'.".format(path,
+                                                                      fname))
+
+
+class _BlockComplete(Exception):
+    """Raised to stop the parser after the block has been closed."""
+
+    def __init__(self, elem):
+        super().__init__()
+        self.elem = elem
+
+
+def _decodedlines(fp):
+    """Iterates over the lines of a binary file as (offset, text) tuples."""
+    encoding = locale.getpreferredencoding(False)
+    offset = fp.tell()
+    for rawline in fp:
+        line = rawline.decode(encoding)
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        yield offset, line
+        offset += len(rawline)
+
+
+def _recordoffsets(fp, offsets):
+    """Iterates over the lines, recording the (line number, offset) pairs."""
+    for linenr, (offset, line) in enumerate(_decodedlines(fp)):
+        offsets.append((linenr, offset))
+        yield line
+
+
+def _blocklines(fp, col):
+    """Iterates over the lines of a block starting at a given column."""
+    lines = _decodedlines(fp)
+    for offset, line in lines:
+        yield " " * col + line[col:]
+        break
+    for offset, line in lines:
+        yield line
@@ -0,0 +1,259 @@
+"""Overlay merging of HSD trees (e.g. defaults, project and user input).
+
+The trees are stacked as layers, later layers taking precedence. The nodes
+with the same path are merged according to the policy for that path:
+
+* MERGE_OVERRIDE: The node of the topmost layer defining it replaces the
+  nodes of the lower layers together with their subtrees.
+* MERGE_APPEND: The children of the nodes of all layers are concatenated.
+  Texts are joined by newlines, if the nodes of all layers contain text.
+* MERGE_DEEP: Children are matched by their tag and their order among the
+  siblings with the same tag and merged recursively. Unmatched children are
+  appended.
+
+Unless texts are appended, a node with text (or array payload) overrides the
+nodes of the lower layers. Independent of the policy, a node opened with an
+equal sign containing a single child (a choice like
+"Hamiltonian = DFTB {...}") overrides lower nodes containing a different
+choice. The merged node carries the tag, attributes and hsd attributes of the
+topmost node, so that its HSDATTR_FILE and HSDATTR_LINE attributes point to
+the winning definition.
+
+Children are matched via dictionaries, so merging takes time proportional to
+the number of nodes. The result can be built as a new tree or obtained as a
+lazy view, which merges the children of a node when they are accessed first.
+"""
+from collections import OrderedDict
+from types import MappingProxyType
+from hsd.common import *
+from hsd.common import _ReadOnlyElement
+from hsd.tree import HSDTree, Element
+
+__all__ = [ "MERGE_OVERRIDE", "MERGE_APPEND", "MERGE_DEEP", "mergetrees",
+            "HSDMergedElement" ]
+
+# Merge policies
+MERGE_OVERRIDE = "override"
+MERGE_APPEND = "append"
+MERGE_DEEP = "deep"
+
+_POLICIES = frozenset([ MERGE_OVERRIDE, MERGE_APPEND, MERGE_DEEP ])
+
+
+def mergetrees(layers, policies=None, default=MERGE_DEEP, files=None,
+               lazy=False):
+    """Merges trees stacked as layers.
+
+    Args:
+        layers: Roots of the trees (or HSDTree instances), the lowest layer
+            (e.g. the defaults) first. The trees are not changed.
+        policies: Dictionary mapping paths onto merge policies. Paths consist
+            of tag names or "*" separated by "/" (e.g. "Hamiltonian/*/Mixer"),
+            the empty string denotes the root. If several paths match a node,
+            the most specific one wins, i.e. the one with a tag name at the
+            first step where the matching paths differ.
+        default: Policy for all paths without explicit policy.
+        files: Names of the files the layers were read from. If specified,
+            HSDATTR_FILE is set for all merged nodes not carrying it already.
+        lazy: If True, a read-only view of the merged tree is returned
+            instead of a new tree.
+
+    Returns:
+        Root of the merged tree or its HSDMergedElement view.
+    """
+    roots = [ layer.getroot() if isinstance(layer, HSDTree) else layer
+              for layer in layers ]
+    if not roots:
+        raise ValueError("No trees to merge")
+    if files is not None and len(files) != len(roots):
+        raise ValueError("Number of file names differs from number of trees")
+    merger = _Merger(policies or {}, default, files)
+    view = HSDMergedElement(merger, list(enumerate(roots)),
+                            [ merger.policytree ])
+    if lazy:
+        return view
+    return view.materialize()
+
+
+class _Merger:
+    """Settings shared by the nodes of a merged tree."""
+
+    def __init__(self, policies, default, files):
+        _checkpolicy(default)
+        self.default = default
+        self.files = files
+        # Policy tree, each node being a list [ policy, children by tag ]
+        self.policytree = [ None, {} ]
+        for path, policy in policies.items():
+            _checkpolicy(policy)
+            node = self.policytree
+            for step in path.split("/") if path else []:
+                node = node[1].setdefault(step, [ None, {} ])
+            node[0] = policy
+
+
+class HSDMergedElement(_ReadOnlyElement):
+    """Read-only view of a node of merged trees.
+
+    It provides the same reading interface as hsd.shared.SharedElement. The
+    children are merged when accessed first. The merged subtree can be
+    converted into a normal tree with materialize().
+    """
+
+    __slots__ = ("_merger", "_contribs", "_policynodes", "_policy",
+                 "_children")
+
+    def __init__(self, merger, contribs, policynodes):
+        """Initializes the view of a node.
+
+        Args:
+            merger: Settings of the merge.
+            contribs: List of (layer index, node) tuples with the nodes of the
+                layers for this path, the lowest layer first.
+            policynodes: Nodes of the policy tree matching the path, the most
+                specific one first.
+        """
+        self._merger = merger
+        self._policynodes = policynodes
+        policies = [ node[0] for node in policynodes if node[0] is not None ]
+        self._policy = policies[0] if policies else merger.default
+        self._contribs = _effective(contribs, self._policy)
+        self._children = None
+
+    @property
+    def tag(self):
+        return self._contribs[-1][1].tag
+
+    @property
+    def text(self):
+        contribs = self._contribs
+        winner = contribs[-1][1]
+        if len(contribs) > 1 and _isleaf(winner):
+            # Appended texts
+            return "\n".join([ node.text.strip() for layer, node in contribs ])
+        return winner.text
+
+    @property
+    def attrib(self):
+        return MappingProxyType(self._contribs[-1][1].attrib)
+
+    @property
+    def hsdattrib(self):
+        return MappingProxyType(self._hsdattrib())
+
+    @property
+    def layer(self):
+        """Index of the layer the winning node stems from."""
+        return self._contribs[-1][0]
+
+    def __len__(self):
+        return len(self._getchildren())
+
+    def __getitem__(self, index):
+        return self._getchildren()[index]
+
+    def __iter__(self):
+        return iter(self._getchildren())
+
+    def __repr__(self):
+        return "<HSDMergedElement {!r} at {:#x}>".format(self.tag, id(self))
+
+    def materialize(self):
+        """Returns the merged subtree as a new tree.
+
+        Array payloads are shared with the original trees.
+        """
+        node = self._contribs[-1][1]
+        elem = Element(node.tag, node.attrib, self._hsdattrib())
+        elem.text = self.text
+        elem.extend([ child.materialize() for child in self._getchildren() ])
+        return elem
+
+    def _hsdattrib(self):
+        """Returns a copy of the hsd attributes with provenance."""
+        layer, node = self._contribs[-1]
+        hsdattrib = dict(node.hsdattrib) if node.hsdattrib else {}
+        files = self._merger.files
+        if files is not None and HSDATTR_FILE not in hsdattrib:
+            hsdattrib[HSDATTR_FILE] = files[layer]
+        return hsdattrib
+
+    def _getchildren(self):
+        children = self._children
+        if children is None:
+            children = self._children = self._mergechildren()
+        return children
+
+    def _mergechildren(self):
+        """Returns the views of the merged children."""
+        merger = self._merger
+        if self._policy == MERGE_DEEP:
+            groups = OrderedDict()
+            for layer, node in self._contribs:
+                occurrences = {}
+                for child in node:
+                    occurrence = occurrences.get(child.tag, 0)
+                    occurrences[child.tag] = occurrence + 1
+                    key = (child.tag, occurrence)
+                    group = groups.get(key)
+                    if group is None:
+                        groups[key] = [ (layer, child) ]
+                    else:
+                        group.append((layer, child))
+            contribsets = [ (key[0], group) for key, group in groups.items() ]
+        else:
+            contribsets = [ (child.tag, [ (layer, child) ])
+                            for layer, node in self._contribs
+                            for child in node ]
+        return [ HSDMergedElement(merger, contribs, self._matchpolicies(tag))
+                 for tag, contribs in contribsets ]
+
+    def _matchpolicies(self, tag):
+        """Returns the policy nodes matching a child, most specific first."""
+        matches = []
+        for node in self._policynodes:
+            for step in (tag, "*"):
+                child = node[1].get(step)
+                if child is not None:
+                    matches.append(child)
+        return matches
+
+
+def _effective(contribs, policy):
+    """Returns the contributions merged into a node."""
+    winner = contribs[-1][1]
+    if len(contribs) == 1 or policy == MERGE_OVERRIDE:
+        return contribs[-1:]
+    if _isleaf(winner):
+        if policy == MERGE_APPEND and all([ _isleaf(node) and node.text
+                                            for layer, node in contribs ]):
+            return contribs
+        return contribs[-1:]
+    choice = _choice(winner)
+    first = len(contribs) - 1
+    while first > 0:
+        node = contribs[first - 1][1]
+        if _isleaf(node) or (choice is not None and any(
+                [ child.tag != choice for child in node ])):
+            break
+        first -= 1
+    return contribs[first:]
+
+
+def _isleaf(node):
+    """Whether a node contains text or an array payload."""
+    return bool((node.text and node.text.strip())
+                or (node.hsdattrib and HSDATTR_ARRAY in node.hsdattrib))
+
+
+def _choice(node):
+    """Returns the tag of the single child of a node opened by an equal sign
+    (None for other nodes)."""
+    if node.hsdattrib and node.hsdattrib.get(HSDATTR_EQUAL) and len(node) == 1:
+        return node[0].tag
+    return None
+
+
+def _checkpolicy(policy):
+    if policy not in _POLICIES:
+        raise ValueError("Invalid merge policy '{}'".format(policy))
@@ -1,9 +1,12 @@
+import re
 from hsd.common import *
-from collections import OrderedDict
+from hsd.compression import openinput
+from collections import OrderedDict, namedtuple
 
 
-__all__ = [ "HSDParserError", "HSDParser",
-           "SYNTAX_ERROR", "UNCLOSED_TAG_ERROR", "QUOTATION_ERROR", "BRACKET_ERROR" ]
+__all__ = [ "HSDParserError", "HSDParser", "HSDDiagnostic",
+           "SYNTAX_ERROR", "UNCLOSED_TAG_ERROR", "UNCLOSED_OPTION_ERROR",
+           "UNCLOSED_QUOTATION_ERROR", "ORPHAN_TEXT_ERROR" ]
 
 SYNTAX_ERROR = 1
 UNCLOSED_TAG_ERROR = 2
@@ -14,6 +17,26 @@ ORPHAN_TEXT_ERROR = 5
 GENERAL_SPECIALS = "{}[]<=\"'#;"
 OPTION_SPECIALS = ",]=\"'#{};"
 
+# Characters at which the parser resynchronizes after an error
+_RESYNC_SPECIALS = "{};"
+
+
+class HSDDiagnostic(namedtuple("HSDDiagnostic", [ "code", "file", "lines" ])):
+    """Error recorded by the parser in recovery mode.
+    
+    Attributes:
+        code: Error code (e.g. SYNTAX_ERROR).
+        file: Name of the file (empty string if not known).
+        lines: Tuple with the first and last line (starting from 0) of the
+            region containing the error.
+    """
+    
+    __slots__ = ()
+    
+    def __str__(self):
+        return _errormessage(self.code, self.file, self.lines)
+
+
 class HSDParser:
     """Event based parser for the Human-readable Structured Data format.
     
@@ -21,13 +44,40 @@ class HSDParser:
     should be overridden by the actual application.
     """
     
-    def __init__(self, defattrib="default"):
+    def __init__(self, defattrib="default", interner=None, recover=False,
+                 maxerrors=100):
         """Intializes a HSDParser instance.
+        
+        Args:
+            defattrib: Name of the option, if specified without name.
+            interner: HSDInterner instance used to intern tag names, option
+                names and short values. Pass the same instance to the parsers
+                of a batch of documents to share the strings between them.
+                If None, the parser uses its own interner, if False, strings
+                are not interned. The instance (or False) is available as the
+                interner attribute.
+            recover: If True, the default error handler records the errors in
+                the errors attribute instead of raising an exception, and the
+                parser resynchronizes and continues, so that all errors of an
+                input are found in one pass.
+            maxerrors: Number of errors after which parsing is stopped in
+                recovery mode.
         """
+        self.errors = []                   # errors recorded in recovery mode
+        self._recover = recover
+        self._maxerrors = maxerrors
+        if interner is None:
+            interner = HSDInterner()
+        self.interner = interner           # interner (or False)
+        if interner is False:
+            self._internname = self._internvalue = _notinterned
+        else:
+            self._internname = interner.name
+            self._internvalue = interner.value
         self._fname = ""                   # Name of file being processed
         self._defattrib = defattrib        # def. attribute name
-        self._checkstr = GENERAL_SPECIALS  # special characters to look for
-        self._oldcheckstr = ""             # buffer fo checkstr
+        self._state = _STATE_GENERAL       # state of the parser
+        self._oldstate = None              # state before quotation
         self._currenttags = []             # info about opened tags
         self._buffer = []                  # buffering plain text between lines 
         self._options = OrderedDict()      # options for current tag
@@ -39,39 +89,35 @@ class HSDParser:
         self._flag_quote = False           # parser inside quotation
         self._flag_haschild = False
         self._oldbefore = ""         
+        self._sink = None                  # sink for text of current tag
+        self._sinkfed = False              # whether sink received any text
+        self._subparser = None             # parser processing included file
+        self._linelen = 0                  # length of current line
+        self._tagcol = 0                   # column of tag being opened
+        self._oldtagpos = (0, 0)           # position of tag in _oldbefore
+        self._tagposition = (0, 0)         # position of last opened tag
 
         
     def feed(self, fileobj):
         """Feeds the parser with data.
         
+        Files compressed with gzip, bz2 or xz are decompressed on the fly
+        (see hsd.compression.openinput()).
+        
         Args:
-            fileobj: File like object or name of a file containing the data.
+            fileobj: File like object (text or binary) or name of a file
+                containing the data.
         """
-        isfilename = isinstance(fileobj, str)
-        if isfilename:
-            fp = open(fileobj, "r")
+        if isinstance(fileobj, str):
             self._fname = fileobj
-        else:
-            fp = fileobj
-        for line in fp.readlines():
-            self._parse(line)
-            self._currline += 1
-        if isfilename:
-            fp.close()
-        
-        # Check for errors
-        if self._currenttags:
-            line0 = self._currenttags[-1][1]
-        else:
-            line0 = 0
-        if self._flag_quote:
-            self._error(UNCLOSED_QUOTATION_ERROR, (line0, self._currline))
-        elif self._flag_option:
-            self._error(UNCLOSED_OPTION_ERROR, (line0, self._currline))
-        elif self._currenttags:
-            self._error(UNCLOSED_TAG_ERROR, (line0, line0))
-        elif ("".join(self._buffer)).strip():
-            self._error(ORPHAN_TEXT_ERROR, (line0, self._currline))
+        try:
+            with openinput(fileobj) as fp:
+                for line in fp:
+                    self._parse(line)
+                    self._currline += 1
+            self._checkend()
+        except _ErrorLimit:
+            pass
 
         
     def start_handler(self, tagname, options, hsdoptions):
@@ -115,20 +161,41 @@ class HSDParser:
         pass
 
         
+    def array_handler(self, array):
+        """Handler which is called with an array payload found inside a tag.
+        
+        The default implementation does nothing. It should be overriden in the
+        application to handle the event in a customized way.
+        
+        Args:
+            array: Array payload (e.g. HSDBinaryInclude instance referencing
+                an array stored in a binary file).
+        """
+        pass
+    
+    
     def error_handler(self, error_code, file, lines):
         """Handler which is called if an error was detected during parsing.
         
         The default implementation throws a HSDException or a descendant of it.
+        In recovery mode, it appends an HSDDiagnostic to the errors attribute
+        instead and stops the parser, once maxerrors errors were recorded. If
+        the handler returns, the parser skips the unexpected character and
+        continues. In recovery mode, it resynchronizes instead (see
+        _resync()).
         
         Args:
             error_code: Code for signalizing the type of the error.
             file: Current file name (empty string if not known).
             lines: Lines between the error occurred.
         """
-        error_msg = (
-            "Parsing error ({}) between lines {} - {} in file '{}'.".format(
-            error_code, lines[0] + 1, lines[1] + 1, file))
-        raise HSDParserError(error_msg)
+        if not self._recover:
+            raise HSDParserError(_errormessage(error_code, file, lines))
+        if len(self.errors) >= self._maxerrors:
+            raise _ErrorLimit()
+        self.errors.append(HSDDiagnostic(error_code, file, tuple(lines)))
+        if len(self.errors) >= self._maxerrors:
+            raise _ErrorLimit()
     
     
     def interrupt_handler_hsd(self, command):
@@ -143,11 +210,13 @@ class HSDParser:
                 the interrupt sign.   
         """
         fname = unquote(command.strip())
-        parser = HSDParser(defattrib=self._defattrib)
-        parser.start_handler = self.start_handler
-        parser.close_handler = self.close_handler
-        parser.text_handler = self.text_handler
-        parser.feed(fname)
+        parser = self._makesubparser()
+        self._subparser = parser
+        try:
+            parser.feed(fname)
+        finally:
+            self._subparser = None
+        self._checkerrorlimit()
 
     
     def interrupt_handler_txt(self, command):
@@ -165,147 +234,424 @@ class HSDParser:
             Unparsed text to be added to the HSD input.
         """
         fname =  unquote(command.strip())
-        fp = open(fname, "r")
-        txt = fp.read()
-        fp.close()
+        with openinput(fname) as fp:
+            txt = fp.read()
         return txt
 
+
+    def interrupt_handler_bin(self, command):
+        """Handles binary array type interrupt.
+        
+        The base class implements following handling: Command is interpreted as
+        a file name (quotes eventually removed), optionally followed by the
+        data type and the dimensions of the array, if the file contains raw
+        binary data instead of numpy's .npy format. The file is not opened,
+        only a reference to it is created, which can be resolved lazily (e.g.
+        by hsdnum.converter.getarraypayload()).
+        
+        Args:
+            command: Unstripped string as specified in the HSD input after
+                the interrupt sign.
+        
+        Returns:
+            Array payload to be passed to array_handler().
+        """
+        return HSDBinaryInclude.fromcommand(command)
+
+    
+    def settextsink(self, sink):
+        """Redirects the text of the tag being opened into a sink.
+        
+        It should be called from within start_handler(). Instead of collecting
+        the entire text of the tag and passing it to text_handler() at once,
+        the text is handed over to the sink chunk by chunk as it is read. Each
+        chunk consists of complete (whitespace separated) words. The sink is
+        detached when the tag is closed or if it turns out to contain child
+        tags.
+        
+        Args:
+            sink: Object with a feed() method accepting a string.
+        """
+        if self._subparser is not None:
+            self._subparser.settextsink(sink)
+            return
+        self._sink = sink
+        self._sinkfed = False
+
+
+    def tagposition(self):
+        """Returns the position of the name of the tag opened last.
+        
+        It should be called from within start_handler(). For tags opened in
+        included files, the position refers to the included file.
+        
+        Returns:
+            Tuple with the line number (counted from zero) and the column
+            (index of the first character of the tag name in the line).
+        """
+        if self._subparser is not None:
+            return self._subparser.tagposition()
+        return self._tagposition
+
+
+    def currentfile(self):
+        """Returns the name of the file being parsed.
+        
+        Within included files, the name of the included file is returned.
+        """
+        if self._subparser is not None:
+            return self._subparser.currentfile()
+        return self._fname
+
+
+    def currentline(self):
+        """Returns the number of the line being parsed (counted from zero).
+        
+        Within included files, the line refers to the included file.
+        """
+        if self._subparser is not None:
+            return self._subparser.currentline()
+        return self._currline
+
+
+    def depth(self):
+        """Returns the number of open tags (including those in included files).
+        """
+        if self._subparser is not None:
+            return len(self._currenttags) + self._subparser.depth()
+        return len(self._currenttags)
+
+
+    def includelevel(self):
+        """Returns the number of included files being parsed (0 outside of
+        included files)."""
+        if self._subparser is not None:
+            return 1 + self._subparser.includelevel()
+        return 0
+
+
+    def setposition(self, fname, line=0):
+        """Sets the position of the input fed next.
+        
+        It allows to parse parts of a file with correct file names and line
+        numbers in the hsd attributes and error messages.
+        
+        Args:
+            fname: Name of the file.
+            line: Number of the first line fed (counted from zero).
+        """
+        self._fname = fname
+        self._currline = line
+
+
+    @classmethod
+    def registerinterrupt(cls, marker, handler):
+        """Registers an interrupt type for the class and its subclasses.
+
+        Interrupts are recognized outside of option specifications and tags
+        opened by an equal sign. Included files are parsed by an HSDParser
+        with the interrupts of the including parser.
+
+        Args:
+            marker: Three characters starting the interrupt, the first one
+                being "<" (e.g. "<<$").
+            handler: Function called with the parser, the text preceding the
+                interrupt in the current line and the rest of the line after
+                the marker (the command). The rest of the line is not parsed.
+                The handler should pass the preceding text on by calling
+                flushtext() before it inserts text via addtext() or arrays
+                via array_handler().
+        """
+        if len(marker) != 3 or marker[0] != "<":
+            raise ValueError("Invalid interrupt marker '{}'".format(marker))
+        if "_interrupts" not in cls.__dict__:
+            cls._interrupts = dict(cls._interrupts)
+        cls._interrupts[marker[1:]] = handler
+
+
+    def flushtext(self, before=""):
+        """Passes the buffered text on to the text handler.
+        
+        It should be called from within interrupt handlers (see
+        registerinterrupt()), so that the text preceding the interrupt is
+        handled before the text or array inserted by the interrupt.
+        
+        Args:
+            before: Text preceding the interrupt in the current line.
+        """
+        self._text("".join(self._buffer) + before)
+        self._buffer = []
+
+
+    def addtext(self, text):
+        """Passes text inserted by an interrupt handler on unchanged.
+        
+        The text is handed to the text handler (or to the text sink of the
+        current tag) as if it had been part of the input.
+        
+        Args:
+            text: Text to insert.
+        """
+        self._rawtext(text)
+
                     
+    def _makesubparser(self):
+        """Returns a parser for an included file with the same handlers."""
+        parser = HSDParser(defattrib=self._defattrib, interner=self.interner,
+                           recover=self._recover, maxerrors=self._maxerrors)
+        parser.errors = self.errors
+        parser._interrupts = self._interrupts
+        parser.start_handler = self.start_handler
+        parser.close_handler = self.close_handler
+        parser.text_handler = self.text_handler
+        parser.array_handler = self.array_handler
+        parser.error_handler = self.error_handler
+        return parser
+
+
+    def _checkerrorlimit(self):
+        """Stops parsing, if an included file reached the error limit."""
+        if self._recover and len(self.errors) >= self._maxerrors:
+            raise _ErrorLimit()
+
+
     def _parse(self, line):
-        """Parses a given line."""
-        
-        while True:
-            sign, before, after = splitbycharset(line, self._checkstr)
-
-            # End of line    
-            if not sign:
-                if self._flag_quote:
-                    self._buffer.append(before)
-                elif self._flag_equalsign:
-                    self._text("".join(self._buffer) + before.strip())
-                    self._closetag()
-                    self._flag_equalsign = False 
-                elif not self._flag_haschild and not self._flag_option:
-                    self._buffer.append(before)
-                elif before.strip():
-                    self._error(SYNTAX_ERROR, (self._currline, self._currline))
-                break
-            
+        """Parses a given line.
+        
+        The special characters of the current state are looked up with the
+        precompiled pattern of the state and dispatched to their handlers
+        through the table of the state (see _makestate()). Each handler
+        returns the rest of the line to be parsed or None, if the line is
+        finished.
+        """
+        self._linelen = len(line)
+        while line is not None:
+            search, handlers = self._state
+            match = search(line)
+            if match is None:
+                handlers[""](self, "", line, "")
+                return
+            pos = match.start()
+            sign = line[pos]
+            before = line[:pos]
             # Special character is escaped
-            elif before.endswith("\\") and not before.endswith("\\\\"):
+            if before.endswith("\\") and not before.endswith("\\\\"):
                 self._buffer.append(before + sign)
-                
-            # Equal sign outside option specification
-            elif sign == "=" and not self._flag_option:
-                # Ignore if followed by "{" (DFTB+ compatibility)
-                if after.lstrip().startswith("{"):
-                    self._oldbefore = before
-                else:
-                    self._flag_haschild = True
-                    self._hsdoptions[HSDATTR_EQUAL] = True
-                    self._starttag(before, False)
-                    self._flag_equalsign = True
-                    
-            # Equal sign inside option specification
-            elif sign == "=":
-                self._key = before.strip()
-                self._buffer = []
-                
-            # Opening tag by curly brace
-            elif sign == "{" and not self._flag_option:
-                self._flag_haschild = True
-                self._starttag(before, self._flag_equalsign)
-                self._buffer = []
-                self._flag_equalsign = False
+                line = line[pos + 1:]
+            else:
+                line = handlers[sign](self, sign, before, line[pos + 1:])
 
-            # Closing tag by curly brace
-            elif (sign == "}" and not self._flag_equalsign
-                  and not self._flag_option):
-                self._text("".join(self._buffer) + before)
-                self._buffer = []
-                self._closetag()
-            
-            # Closing tag by semicolon
-            elif sign == ";" and self._flag_equalsign and not self._flag_option:
-                self._flag_equalsign = False
-                self._text(before)
-                self._closetag()
-                
-            # Comment line
-            elif sign == "#":
+
+    def _updatestate(self):
+        """Sets the state corresponding to the flags outside of quotations."""
+        if self._flag_option:
+            if self._flag_equalsign:
+                self._state = _STATE_EQUALOPTION
+            else:
+                self._state = _STATE_OPTION
+        elif self._flag_equalsign:
+            self._state = _STATE_EQUAL
+        else:
+            self._state = _STATE_GENERAL
+
+
+    def _column(self, before, after):
+        """Returns the column of the text preceding the current sign."""
+        return self._linelen - len(before) - len(after) - 1
+
+
+    # Handlers of the end of the line
+
+    def _eol_general(self, sign, before, after):
+        if not self._flag_haschild:
+            if self._sink is None:
                 self._buffer.append(before)
-                after = ""
-            
-            # Opening option specification
-            elif sign == "[" and not self._flag_option:
-                if "".join(self._buffer).strip():
-                    self._error(SYNTAX_ERROR, (self._currline, self._currline))
-                self._oldbefore = before
-                self._buffer = []
-                self._flag_option = True
-                self._key = ""
-                self._currenttags.append(("[", self._currline, None))
-                self._checkstr = OPTION_SPECIALS
-            
-            # Closing option specification
-            elif sign == "]" and self._flag_option:
-                value = "".join(self._buffer) + before
-                key = self._key if self._key else self._defattrib
-                self._options[key] = value.strip()
-                self._flag_option = False
-                self._buffer = []
-                self._currenttags.pop()
-                self._checkstr = GENERAL_SPECIALS
-                
-            # Quoting strings
-            elif sign == "'" or sign == '"':
-                if self._flag_quote:
-                    self._checkstr = self._oldcheckstr
-                    self._flag_quote = False
-                    self._buffer.append(before + sign)
-                    self._currenttags.pop()
-                else:
-                    self._oldcheckstr = self._checkstr
-                    self._checkstr = sign
-                    self._flag_quote = True
-                    self._buffer.append(sign)
-                    self._currenttags.append(('"', self._currline, None))
-            
-            # Closing attribute specification
-            elif sign == "," and self._flag_option:
-                value = "".join(self._buffer) + before
-                key = self._key if self._key else self._defattrib
-                self._options[key] = value.strip()
-                
-            # Interrupt
-            elif (sign == "<" and not self._flag_option 
-                  and not self._flag_equalsign):
-                txtint = after.startswith("<<")
-                hsdint = after.startswith("<!")
-                if txtint:
-                    self._text("".join(self._buffer) + before)
-                    self._buffer = []
-                    self.text_handler(self.interrupt_handler_txt(after[2:]))
-                    break
-                elif hsdint:
-                    self.interrupt_handler_hsd(after[2:])
-                    break
-                else:
-                    self._buffer.append(before + sign)
-                    
             else:
-                self._error(SYNTAX_ERROR, (self._currline, self._currline))
-                                    
-            line = after
+                self._rawtext("".join(self._buffer) + before)
+                self._buffer = []
+        elif before.strip():
+            self._error(SYNTAX_ERROR, (self._currline, self._currline))
+            self._resync("", "")
+
+
+    def _eol_equalsign(self, sign, before, after):
+        self._text("".join(self._buffer) + before.strip())
+        self._closetag()
+        self._flag_equalsign = False
+        self._updatestate()
+
+
+    def _eol_equaloption(self, sign, before, after):
+        line0 = self._currenttags[-1][1]
+        self._error(UNCLOSED_OPTION_ERROR, (line0, self._currline))
+        self._buffer = []
+        self._abandonoption("")
+        self._eol_equalsign(sign, before, after)
+
+
+    def _eol_option(self, sign, before, after):
+        if before.strip():
+            self._error(SYNTAX_ERROR, (self._currline, self._currline))
+            self._resync("", "")
+
+
+    def _eol_quote(self, sign, before, after):
+        self._buffer.append(before)
+
+
+    # Handlers of the special characters
+
+    def _equalsign(self, sign, before, after):
+        # Ignore if followed by "{" (DFTB+ compatibility)
+        if after.lstrip().startswith("{"):
+            self._oldbefore = before
+            self._oldtagpos = (self._currline, self._column(before, after))
+        else:
+            self._flag_haschild = True
+            self._hsdoptions[HSDATTR_EQUAL] = True
+            self._tagcol = self._column(before, after)
+            self._starttag(before, False)
+            self._flag_equalsign = True
+            self._updatestate()
+        return after
+
+
+    def _optionname(self, sign, before, after):
+        self._key = self._internname(before.strip())
+        self._buffer = []
+        return after
+
+
+    def _openingbrace(self, sign, before, after):
+        self._flag_haschild = True
+        self._tagcol = self._column(before, after)
+        self._starttag(before, self._flag_equalsign)
+        self._buffer = []
+        self._flag_equalsign = False
+        self._updatestate()
+        return after
+
+
+    def _closingbrace(self, sign, before, after):
+        self._text("".join(self._buffer) + before)
+        self._buffer = []
+        self._closetag()
+        return after
+
+
+    def _semicolon(self, sign, before, after):
+        self._flag_equalsign = False
+        self._updatestate()
+        self._text(before)
+        self._closetag()
+        return after
+
+
+    def _comment(self, sign, before, after):
+        self._buffer.append(before)
+        return ""
+
+
+    def _openoption(self, sign, before, after):
+        if "".join(self._buffer).strip():
+            self._error(SYNTAX_ERROR, (self._currline, self._currline))
+        self._oldbefore = before
+        self._oldtagpos = (self._currline, self._column(before, after))
+        self._buffer = []
+        self._flag_option = True
+        self._key = ""
+        self._currenttags.append(("[", self._currline, None))
+        self._updatestate()
+        return after
+
+
+    def _closeoption(self, sign, before, after):
+        self._optionvalue(sign, before, after)
+        self._flag_option = False
+        self._buffer = []
+        self._currenttags.pop()
+        self._updatestate()
+        return after
+
+
+    def _optionvalue(self, sign, before, after):
+        value = "".join(self._buffer) + before
+        key = self._key if self._key else self._defattrib
+        self._options[key] = self._internvalue(value.strip())
+        return after
+
+
+    def _openquote(self, sign, before, after):
+        self._oldstate = self._state
+        self._state = _STATE_QUOTE[sign]
+        self._flag_quote = True
+        self._buffer.append(sign)
+        self._currenttags.append(('"', self._currline, None))
+        return after
+
+
+    def _closequote(self, sign, before, after):
+        self._state = self._oldstate
+        self._flag_quote = False
+        self._buffer.append(before + sign)
+        self._currenttags.pop()
+        return after
+
+
+    def _interrupt(self, sign, before, after):
+        handler = self._interrupts.get(after[:2])
+        if handler is None:
+            self._buffer.append(before + sign)
+            return after
+        handler(self, before, after[2:])
+        return None
+
+
+    def _unexpected(self, sign, before, after):
+        self._error(SYNTAX_ERROR, (self._currline, self._currline))
+        return self._resync(sign, after)
+
+
+    # Handlers of the interrupts
+
+    def _textinterrupt(self, before, command):
+        self.flushtext(before)
+        self.addtext(self.interrupt_handler_txt(command))
+
+
+    def _hsdinterrupt(self, before, command):
+        self.interrupt_handler_hsd(command)
+
+
+    def _bininterrupt(self, before, command):
+        self.flushtext(before)
+        self.array_handler(self.interrupt_handler_bin(command))
+
+
+    # Interrupt handlers by the two characters following the opening "<"
+    _interrupts = { "<<": _textinterrupt, "<!": _hsdinterrupt,
+                    "<@": _bininterrupt }
 
                             
     def _text(self, text):
         stripped = text.strip()
         if stripped:
-            self.text_handler(stripped)
+            self._rawtext(self._internvalue(stripped))
+
+
+    def _rawtext(self, text):
+        if self._sink is None:
+            self.text_handler(text)
+        elif text.strip():
+            self._sink.feed(text)
+            self._sinkfed = True
 
             
     def _starttag(self, tagname, closeprev):
+        if self._sink is not None:
+            if self._sinkfed:
+                self._error(SYNTAX_ERROR, (self._currline, self._currline))
+            self._sink = None
         if "".join(self._buffer).strip():
             if self._currenttags:
                 line0 = self._currenttags[-1][1]
@@ -313,13 +659,19 @@ class HSDParser:
                 line0 = 0
             self._error(SYNTAX_ERROR, (line0, self._currline))
         tagname_stripped = tagname.strip()
+        tagline, tagcol = self._currline, self._tagcol
         if self._oldbefore:
             if tagname_stripped:
                 self._error(SYNTAX_ERROR, ( self._currline, self._currline ))
             else:
                 tagname_stripped = self._oldbefore.strip()
+                tagname = self._oldbefore
+                tagline, tagcol = self._oldtagpos
+        self._tagposition = (tagline,
+                             tagcol + len(tagname) - len(tagname.lstrip()))
         if len(tagname_stripped.split()) > 1:
             self._error(SYNTAX_ERROR, (self._currline, self._currline))
+        tagname_stripped = self._internname(tagname_stripped)
         self._hsdoptions[HSDATTR_LINE] = self._currline
         self.start_handler(tagname_stripped, self._options, self._hsdoptions)
         self._currenttags.append(
@@ -334,14 +686,140 @@ class HSDParser:
     def _closetag(self):
         if not self._currenttags:
             self._error(SYNTAX_ERROR, (0, self._currline))
+            return
         self._buffer = []
+        self._sink = None
         tag, line, closeprev, self._flag_haschild = self._currenttags.pop() 
         self.close_handler(tag)
         if closeprev:
             self._closetag()
             
+    def _checkend(self):
+        """Checks for errors at the end of the input."""
+        if self._currenttags:
+            line0 = self._currenttags[-1][1]
+        else:
+            line0 = 0
+        if self._flag_quote:
+            self._error(UNCLOSED_QUOTATION_ERROR, (line0, self._currline))
+        elif self._flag_option:
+            self._error(UNCLOSED_OPTION_ERROR, (line0, self._currline))
+        elif self._currenttags:
+            self._error(UNCLOSED_TAG_ERROR, (line0, line0))
+        elif ("".join(self._buffer)).strip():
+            self._error(ORPHAN_TEXT_ERROR, (line0, self._currline))
+
+
     def _error(self, code, lines):
         self.error_handler(code, self._fname, lines)
+        
+        
+    def _resync(self, sign, text):
+        """Returns the text to continue with after an unexpected sign.
+        
+        Outside of recovery mode only the sign is skipped. In recovery mode,
+        an unclosed option specification is abandoned (together with its tag,
+        unless the sign opens it) and the sign is parsed again. Otherwise, the
+        text up to the next brace or semicolon is skipped.
+        """
+        if not self._recover:
+            return text
+        self._buffer = []
+        if self._flag_option:
+            self._abandonoption(sign)
+            return sign + text
+        for pos, char in enumerate(text):
+            if char in _RESYNC_SPECIALS:
+                return text[pos:]
+        return ""
+
+
+    def _abandonoption(self, sign):
+        """Drops an unclosed option specification (see _resync())."""
+        self._currenttags.pop()
+        self._flag_option = False
+        self._updatestate()
+        self._options = OrderedDict()
+        if sign != "{":
+            self._oldbefore = ""
+
+
+def _makestate(specials, handlers):
+    """Returns a state of the parser.
+    
+    Args:
+        specials: Special characters of the state.
+        handlers: Dictionary mapping the special characters and the empty
+            string (end of line) onto their handlers. Special characters
+            without handler are treated as syntax errors.
+    
+    Returns:
+        Tuple with the search method of the pattern matching the special
+        characters and the dictionary with the handlers of all of them.
+    """
+    table = dict([ (char, HSDParser._unexpected) for char in specials ])
+    table.update(handlers)
+    return re.compile("[" + re.escape(specials) + "]").search, table
+
+
+_STATE_GENERAL = _makestate(GENERAL_SPECIALS, {
+    "": HSDParser._eol_general,
+    "=": HSDParser._equalsign,
+    "{": HSDParser._openingbrace,
+    "}": HSDParser._closingbrace,
+    "#": HSDParser._comment,
+    "[": HSDParser._openoption,
+    "'": HSDParser._openquote,
+    '"': HSDParser._openquote,
+    "<": HSDParser._interrupt,
+})
+
+# Inside a tag opened by an equal sign
+_STATE_EQUAL = _makestate(GENERAL_SPECIALS, {
+    "": HSDParser._eol_equalsign,
+    "=": HSDParser._equalsign,
+    "{": HSDParser._openingbrace,
+    ";": HSDParser._semicolon,
+    "#": HSDParser._comment,
+    "[": HSDParser._openoption,
+    "'": HSDParser._openquote,
+    '"': HSDParser._openquote,
+})
+
+_OPTION_HANDLERS = {
+    "": HSDParser._eol_option,
+    "=": HSDParser._optionname,
+    ",": HSDParser._optionvalue,
+    "]": HSDParser._closeoption,
+    "#": HSDParser._comment,
+    "'": HSDParser._openquote,
+    '"': HSDParser._openquote,
+}
+
+_STATE_OPTION = _makestate(OPTION_SPECIALS, _OPTION_HANDLERS)
+
+# Inside an option specification of a tag opened by an equal sign
+_STATE_EQUALOPTION = _makestate(OPTION_SPECIALS, dict(
+    _OPTION_HANDLERS, **{ "": HSDParser._eol_equaloption }))
+
+# Inside quotations, by the opening quote
+_STATE_QUOTE = dict([ (quote, _makestate(quote, {
+    "": HSDParser._eol_quote, quote: HSDParser._closequote }))
+                      for quote in "'\"" ])
+
+
+class _ErrorLimit(Exception):
+    """Raised to stop parsing when the maximal number of errors is reached."""
+    pass
+
+
+def _errormessage(code, file, lines):
+    return "Parsing error ({}) between lines {} - {} in file '{}'.".format(
+        code, lines[0] + 1, lines[1] + 1, file)
+
+
+def _notinterned(string):
+    return string
             
             
 if __name__ == "__main__":
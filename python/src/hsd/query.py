@@ -1,5 +1,4 @@
 from hsd.common import *
-from hsd.tree import Element
 
 __all__ = [ "HSDQueryError", "HSDMissingTagException", "HSDInvalidTagException",
            "HSDInvalidTagValueException", "HSDMissingAttributeException",
@@ -133,6 +132,7 @@ class HSDQuery:
         child = self.findchild(node, name, optional)
         # findchild only returns if child has been found or optional is True.
         if child is None:
+            from hsd.tree import Element
             child = Element(name, defattribs or {})
             child.text = deftext
             self.markprocessed(child)
@@ -258,7 +258,7 @@ if __name__ == "__main__":
     from io import StringIO
     from hsd.treebuilder import HSDTreeBuilder
     from hsd.parser import HSDParser
-    from hsd.tree import HSDTree
+    from hsd.tree import HSDTree, Element
     from hsd.converter import *
     parser = HSDParser(defattrib="unit")
     builder = HSDTreeBuilder(parser=parser)
@@ -0,0 +1,364 @@
+"""Local daemon keeping parsed HSD trees in memory.
+
+The server listens on a Unix domain socket and answers the requests of
+HSDClient instances (see hsd.client) from a cache of parsed trees, so that
+short-lived tools do not have to parse the same files again and again. A tree
+is parsed again when the size or the modification time of its file changes
+(changes of included files are not detected).
+
+Each message is prefixed by its length as a 4 byte unsigned integer in
+network byte order. Requests are JSON encoded lists containing the command and
+its arguments. Replies consist of a status byte and a JSON document containing
+the result or the name and message of the exception raised. Trees are sent in
+the flattened form used for pickling (see encodetree()), but only as data, so
+that a client never executes code received from the socket. The encoded
+replies of the parse and format requests are stored together with the tree, so
+that repeated requests are answered without any processing.
+
+The socket is placed in a directory only accessible for the user running the
+server (by default $XDG_RUNTIME_DIR/hsd or hsd-<uid> in the temporary
+directory), and the client checks that its peer is run by the same user.
+"""
+import io
+import os
+import json
+import stat
+import base64
+import struct
+import socket
+import tempfile
+import threading
+import socketserver
+from collections import OrderedDict
+from hsd.common import *
+from hsd.formatter import HSDFormatter
+from hsd.tree import HSDTree, _flatten, _unflatten
+from hsd.treebuilder import HSDTreeBuilder
+
+__all__ = [ "HSDServer", "HSDTreeCache", "DEFAULT_ADDRESS" ]
+
+
+def _defaultdir():
+    """Returns the per-user directory of the default socket."""
+    runtimedir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimedir:
+        return os.path.join(runtimedir, "hsd")
+    return os.path.join(tempfile.gettempdir(), "hsd-{}".format(os.getuid()))
+
+
+# Socket address used if none is specified
+DEFAULT_ADDRESS = os.path.join(_defaultdir(), "server.sock")
+
+# Length prefix of the messages
+_LENGTH = struct.Struct("!I")
+
+# Status bytes of the replies
+_OK, _ERROR = b"\x00", b"\x01"
+
+
+class HSDTreeCache:
+    """LRU cache of parsed trees, invalidated by file size and mtime."""
+
+    def __init__(self, maxtrees=64, builder=HSDTreeBuilder):
+        """Initializes an HSDTreeCache instance.
+
+        Args:
+            maxtrees: Maximal number of trees kept.
+            builder: Tree builder class used to parse the files.
+        """
+        self._maxtrees = maxtrees
+        self._builder = builder
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def getroot(self, fname):
+        """Returns the root of the tree of a file.
+
+        Args:
+            fname: Name of the file.
+
+        Returns:
+            Root of the (cached) tree. It must not be changed.
+        """
+        return self._getentry(fname)[2]
+
+    def getreply(self, fname, kind, serialize):
+        """Returns a reply derived from a tree, caching it with the tree.
+
+        Args:
+            fname: Name of the file.
+            kind: Name identifying the reply.
+            serialize: Function creating the reply from the root of the tree.
+        """
+        entry = self._getentry(fname)
+        replies = entry[3]
+        reply = replies.get(kind)
+        if reply is None:
+            reply = serialize(entry[2])
+            replies[kind] = reply
+        return reply
+
+    def clear(self):
+        """Removes all trees from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def _getentry(self, fname):
+        """Returns the entry [ size, mtime, root, replies ] for a file."""
+        stat = os.stat(fname)
+        with self._lock:
+            entry = self._entries.get(fname)
+            if (entry is not None and entry[0] == stat.st_size
+                    and entry[1] == stat.st_mtime_ns):
+                self._entries.move_to_end(fname)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Parsed outside the lock, so that other requests are not blocked
+        entry = [ stat.st_size, stat.st_mtime_ns,
+                  self._builder().build(fname), {} ]
+        with self._lock:
+            self._entries[fname] = entry
+            self._entries.move_to_end(fname)
+            while len(self._entries) > self._maxtrees:
+                self._entries.popitem(last=False)
+        return entry
+
+
+class HSDServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Server answering parse, query and format requests over a Unix socket.
+
+    Each connection is served by an own thread and may carry an arbitrary
+    number of requests. The commands and their arguments are:
+
+    * ["ping"]: Returns None.
+    * ["parse", fname]: Returns the root of the tree.
+    * ["query", fname, path]: Returns the list of the elements matching an
+      ElementTree path relative to the root.
+    * ["format", fname]: Returns the tree in HSD format as string.
+    * ["stats"]: Returns a dictionary with the number of cached trees, cache
+      hits and cache misses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=DEFAULT_ADDRESS, maxtrees=64,
+                 builder=HSDTreeBuilder):
+        """Initializes an HSDServer instance and binds it to the socket.
+
+        Args:
+            address: Path of the socket. Its directory is created if needed
+                and must be only accessible for the user. A stale socket file
+                left behind by a terminated server is replaced.
+            maxtrees: Maximal number of trees kept in the cache.
+            builder: Tree builder class used to parse the files.
+        """
+        _securedir(os.path.dirname(os.path.abspath(address)))
+        _removestale(address)
+        self.cache = HSDTreeCache(maxtrees, builder)
+        self._commands = {
+            "ping": self._ping,
+            "parse": self._parse,
+            "query": self._query,
+            "format": self._format,
+            "stats": self._stats,
+        }
+        oldmask = os.umask(0o077)
+        try:
+            super().__init__(address, _RequestHandler)
+        finally:
+            os.umask(oldmask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+    def process(self, request):
+        """Returns the encoded reply to a decoded request."""
+        command = self._commands.get(request[0])
+        if command is None:
+            raise HSDException("Unknown command '{}'.".format(request[0]))
+        return command(*request[1:])
+
+    def _ping(self):
+        return _reply(None)
+
+    def _parse(self, fname):
+        return self.cache.getreply(fname, "parse",
+                                   lambda root: _reply(encodetree(root)))
+
+    def _query(self, fname, path):
+        return _reply([ encodetree(node)
+                        for node in self.cache.getroot(fname).findall(path) ])
+
+    def _format(self, fname):
+        return self.cache.getreply(fname, "format",
+                                   lambda root: _reply(_formattree(root)))
+
+    def _stats(self):
+        cache = self.cache
+        return _reply({ "trees": len(cache), "hits": cache.hits,
+                        "misses": cache.misses })
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Serves the requests arriving over a connection."""
+
+    def handle(self):
+        sock = self.request
+        while True:
+            message = receive(sock)
+            if message is None:
+                return
+            try:
+                request = json.loads(message.decode("utf-8"))
+                reply = self.server.process(request)
+            except Exception as exc:
+                reply = _errorreply(exc)
+            send(sock, reply)
+
+
+def send(sock, message):
+    """Sends a length prefixed message."""
+    sock.sendall(_LENGTH.pack(len(message)) + message)
+
+
+def receive(sock):
+    """Receives a length prefixed message (None if the connection closed)."""
+    header = _receiveall(sock, _LENGTH.size)
+    if header is None:
+        return None
+    message = _receiveall(sock, _LENGTH.unpack(header)[0])
+    if message is None:
+        raise HSDException("Connection closed within a message.")
+    return message
+
+
+def _receiveall(sock, nbytes):
+    """Receives a given number of bytes (None if the connection closed)."""
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    pos = 0
+    while pos < nbytes:
+        received = sock.recv_into(view[pos:])
+        if not received:
+            return None
+        pos += received
+    return bytes(buffer)
+
+
+def encodetree(root):
+    """Returns a JSON compatible representation of a subtree.
+
+    The subtree is flattened as for pickling (see hsd.tree._flatten()). Hsd
+    attribute values other than strings and numbers are encoded as
+    dictionaries: {"array": [dtype, shape, base64 data]} for array payloads
+    and {"include": command} for binary includes.
+
+    Raises:
+        HSDException: If a hsd attribute has a value which can not be encoded.
+    """
+    strings, signatures, texts, objects, codes = _flatten(root)
+    return [ strings, signatures, texts,
+             [ _encodeobject(obj) for obj in objects ], codes.tolist() ]
+
+
+def decodetree(data):
+    """Rebuilds a subtree encoded by encodetree()."""
+    strings, signatures, texts, objects, codes = data
+    return _unflatten(strings, signatures, texts,
+                      [ _decodeobject(obj) for obj in objects ], codes)
+
+
+def _encodeobject(value):
+    if isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, HSDBinaryInclude):
+        return { "include": value.totext() }
+    if type(value).__name__ == "ndarray" and not value.dtype.hasobject:
+        data = base64.b64encode(value.tobytes()).decode("ascii")
+        return { "array": [ value.dtype.str, list(value.shape), data ] }
+    raise HSDException("Hsd attribute value of type '{}' can not be encoded."
+                       .format(type(value).__name__))
+
+
+def _decodeobject(value):
+    if not isinstance(value, dict):
+        return value
+    if "include" in value:
+        return HSDBinaryInclude.fromcommand(
+            value["include"][len(HSDBinaryInclude.sign):])
+    import numpy as np
+    dtype, shape, data = value["array"]
+    return np.frombuffer(bytearray(base64.b64decode(data)),
+                         dtype=dtype).reshape(shape)
+
+
+def _reply(result):
+    return _OK + json.dumps(result).encode("utf-8")
+
+
+def _errorreply(exc):
+    error = [ type(exc).__name__, str(exc) ]
+    if isinstance(exc, OSError) and exc.errno is not None:
+        error = [ type(exc).__name__, exc.strerror, exc.errno, exc.filename ]
+    return _ERROR + json.dumps(error).encode("utf-8")
+
+
+def _formattree(root):
+    """Returns the HSD representation of a tree."""
+    output = io.StringIO()
+    HSDTree(root).writehsd(HSDFormatter(target=output))
+    return output.getvalue()
+
+
+def _securedir(dirname):
+    """Creates the directory of the socket or checks an existing one.
+
+    Raises:
+        HSDException: If the directory is not owned by the user or accessible
+            for others.
+    """
+    try:
+        os.mkdir(dirname, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(dirname)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or info.st_mode & 0o077):
+        raise HSDException("Socket directory '{}' must be a directory owned "
+                           "by and only accessible for the user."
+                           .format(dirname))
+
+
+def _removestale(address):
+    """Removes a socket file, if no server is listening on it."""
+    if not os.path.exists(address):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(address)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(address)
+        else:
+            raise HSDException("Server already running on '{}'."
+                               .format(address))
+
+
+if __name__ == "__main__":
+    import sys
+    server = HSDServer(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,424 @@
+"""Read-only HSD trees in shared memory.
+
+A tree is published once into a multiprocessing.shared_memory block in a flat,
+offset based layout. Other processes (e.g. the workers of a process pool)
+attach to the block by its name and obtain read-only proxies of the nodes,
+which read tag names, options and texts directly from the block. Array
+payloads are exposed as read-only numpy views of the block without copying.
+
+SharedHSDTree instances and their nodes are pickled by the name of the block,
+so passing them to pool tasks costs only a few bytes.
+
+Layout of the block (all integers are native 64 bit integers):
+
+* header: magic, then the number of entries and the offset of each table,
+* nodes: one record per node in breadth first order (tag, text, first child,
+  number of children, first option, number of options, first hsd attribute,
+  number of hsd attributes), so that the children of a node are contiguous,
+* options: (name, value) string index pairs,
+* hsd attributes: (name, kind, value) triples,
+* payloads: (offset, dtype, ndim, first dimension, element count) records,
+  dimensions in a separate table,
+* strings: offset table and utf-8 encoded data (every string stored once),
+* array data, each array aligned to _ALIGNMENT bytes.
+"""
+import struct
+import threading
+from array import array
+from collections import deque
+from multiprocessing import shared_memory, resource_tracker
+from types import MappingProxyType
+from hsd.common import *
+from hsd.common import _ReadOnlyElement
+
+__all__ = [ "SharedHSDTree", "SharedElement" ]
+
+_MAGIC = b"HSDSHM1\0"
+
+# Tables of the block in the order they are stored
+_TABLES = ( "nodes", "options", "hsdattribs", "payloads", "shapes",
+            "stroffsets", "strings" )
+
+_HEADER = struct.Struct("8s" + "qq" * len(_TABLES))
+
+# Fields of the node records
+_TAG, _TEXT, _FIRSTCHILD, _NCHILD, _FIRSTOPT, _NOPT, _FIRSTHSD, _NHSD = \
+    range(8)
+_NODEFIELDS = 8
+
+# Kinds of the hsd attribute values
+_STR, _BOOL, _INT, _ARRAY, _INCLUDE = range(5)
+
+_PAYLOADFIELDS = 5
+
+# Alignment of the tables and the array data in bytes
+_ALIGNMENT = 64
+
+# Trees attached in the current process (name -> SharedHSDTree)
+_ATTACHED = {}
+_LOCK = threading.RLock()
+
+
+class SharedHSDTree:
+    """HSD tree published into a shared memory block.
+
+    Attributes:
+        name: Name of the shared memory block.
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self.name = shm.name
+        buf = shm.buf
+        header = _HEADER.unpack_from(buf)
+        if header[0] != _MAGIC:
+            raise HSDException("Shared memory block '{}' does not contain an "
+                               "HSD tree.".format(shm.name))
+        self._views = []
+        tables = {}
+        for ii, table in enumerate(_TABLES):
+            count, offset = header[1 + 2 * ii: 3 + 2 * ii]
+            if table == "strings":
+                view = buf[offset:offset + count]
+            else:
+                view = buf[offset:offset + 8 * count].cast("q")
+            self._views.append(view)
+            tables[table] = view
+        self._nodes = tables["nodes"]
+        self._options = tables["options"]
+        self._hsdattribs = tables["hsdattribs"]
+        self._payloads = tables["payloads"]
+        self._shapes = tables["shapes"]
+        self._stroffsets = tables["stroffsets"]
+        self._strings = tables["strings"]
+        self._decoded = {}
+
+    @classmethod
+    def publish(cls, root, name=None):
+        """Publishes a tree into a new shared memory block.
+
+        The block is owned by the returned instance. It must be unlinked (see
+        unlink()) when the tree is not needed any more.
+
+        Args:
+            root: Root node of the tree.
+            name: Name of the block (default: a random name).
+
+        Returns:
+            SharedHSDTree instance owning the block.
+
+        Raises:
+            HSDException: If a hsd attribute has a value which can not be
+                stored.
+        """
+        layout = _FlatLayout(root)
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=max(layout.size, 1))
+        try:
+            layout.write(shm.buf)
+            tree = cls(shm, True)
+        except:
+            shm.close()
+            shm.unlink()
+            raise
+        with _LOCK:
+            _ATTACHED[tree.name] = tree
+        return tree
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to a tree published by an other process.
+
+        Within a process, every block is attached only once, further calls
+        return the same instance until it is closed.
+
+        Args:
+            name: Name of the shared memory block.
+
+        Returns:
+            SharedHSDTree instance.
+        """
+        with _LOCK:
+            tree = _ATTACHED.get(name)
+            if tree is None:
+                tree = cls(_attachmemory(name), False)
+                _ATTACHED[name] = tree
+        return tree
+
+    def getroot(self):
+        """Returns the (read-only) root node."""
+        return SharedElement(self, 0)
+
+    def close(self):
+        """Closes the access to the block from the current process.
+
+        All arrays obtained from the tree must have been released before.
+        """
+        with _LOCK:
+            if _ATTACHED.get(self.name) is self:
+                del _ATTACHED[self.name]
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._shm.close()
+
+    def unlink(self):
+        """Frees the block (should be called once by the publishing process).
+        """
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        if self._owner:
+            self.unlink()
+
+    def __reduce__(self):
+        return (SharedHSDTree.attach, (self.name,))
+
+    def _string(self, index):
+        """Returns a string from the string table (decoded on first access)."""
+        string = self._decoded.get(index)
+        if string is None:
+            start, end = self._stroffsets[index], self._stroffsets[index + 1]
+            string = str(self._strings[start:end], "utf-8")
+            self._decoded[index] = string
+        return string
+
+    def _payload(self, index):
+        """Returns a read-only numpy view of an array payload."""
+        import numpy as np
+        offset, dtype, ndim, firstdim, count = self._payloads[
+            _PAYLOADFIELDS * index: _PAYLOADFIELDS * (index + 1)]
+        array = np.frombuffer(self._shm.buf, dtype=self._string(dtype),
+                              count=count, offset=offset)
+        array.flags.writeable = False
+        return array.reshape(tuple(self._shapes[firstdim:firstdim + ndim]))
+
+
+def _attachmemory(name):
+    """Attaches to a shared memory block without tracking it.
+
+    Before Python 3.13 the resource tracker registers the block also in
+    processes, which only attach to it, and unlinks it when such a process
+    terminates. The registration is therefore undone after attaching.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedElement(_ReadOnlyElement):
+    """Read-only proxy of a node of a tree in shared memory.
+
+    It provides the reading part of the element interface used by HSDQuery
+    and the converters: tag, text, attrib, hsdattrib, get(), keys(), items(),
+    len(), indexing, iteration, find(), findall(), findtext() and iter().
+    The attrib and hsdattrib dictionaries are read-only, so queries must not
+    mark nodes as processed or insert default values.
+
+    Paths in find() and findall() consist of tag names, "*" or "." separated
+    by "/".
+    """
+
+    __slots__ = ("_tree", "_index")
+
+    def __init__(self, tree, index):
+        self._tree = tree
+        self._index = index
+
+    @property
+    def tag(self):
+        return self._tree._string(self._field(_TAG))
+
+    @property
+    def text(self):
+        text = self._field(_TEXT)
+        return None if text < 0 else self._tree._string(text)
+
+    @property
+    def attrib(self):
+        tree = self._tree
+        first, count = self._field(_FIRSTOPT), self._field(_NOPT)
+        items = tree._options[2 * first: 2 * (first + count)]
+        return MappingProxyType(dict(
+            [ (tree._string(items[ii]), tree._string(items[ii + 1]))
+              for ii in range(0, len(items), 2) ]))
+
+    @property
+    def hsdattrib(self):
+        tree = self._tree
+        first, count = self._field(_FIRSTHSD), self._field(_NHSD)
+        items = tree._hsdattribs[3 * first: 3 * (first + count)]
+        hsdattrib = {}
+        for ii in range(0, len(items), 3):
+            kind, value = items[ii + 1], items[ii + 2]
+            if kind == _STR:
+                value = tree._string(value)
+            elif kind == _BOOL:
+                value = bool(value)
+            elif kind == _ARRAY:
+                value = tree._payload(value)
+            elif kind == _INCLUDE:
+                value = HSDBinaryInclude.fromcommand(
+                    tree._string(value)[len(HSDBinaryInclude.sign):])
+            hsdattrib[tree._string(items[ii])] = value
+        return MappingProxyType(hsdattrib)
+
+    def __len__(self):
+        return self._field(_NCHILD)
+
+    def __getitem__(self, index):
+        nchild = self._field(_NCHILD)
+        first = self._field(_FIRSTCHILD)
+        if isinstance(index, slice):
+            return [ SharedElement(self._tree, first + ii)
+                     for ii in range(*index.indices(nchild)) ]
+        if index < 0:
+            index += nchild
+        if not 0 <= index < nchild:
+            raise IndexError("child index out of range")
+        return SharedElement(self._tree, first + index)
+
+    def __iter__(self):
+        first = self._field(_FIRSTCHILD)
+        for index in range(first, first + self._field(_NCHILD)):
+            yield SharedElement(self._tree, index)
+
+    def __eq__(self, other):
+        return (isinstance(other, SharedElement) and other._tree is self._tree
+                and other._index == self._index)
+
+    def __hash__(self):
+        return hash((id(self._tree), self._index))
+
+    def __repr__(self):
+        return "<SharedElement {!r} at {:#x}>".format(self.tag, id(self))
+
+    def __reduce__(self):
+        return (_attachelement, (self._tree.name, self._index))
+
+    def _field(self, field):
+        return self._tree._nodes[_NODEFIELDS * self._index + field]
+
+
+def _attachelement(name, index):
+    """Returns a node of a tree in shared memory (used when unpickling)."""
+    return SharedElement(SharedHSDTree.attach(name), index)
+
+
+class _FlatLayout:
+    """Flat representation of a tree, as written into the shared memory."""
+
+    def __init__(self, root):
+        self._stringindex = {}
+        self._stringlist = []
+        self.nodes = array("q")
+        self.options = array("q")
+        self.hsdattribs = array("q")
+        self.payloads = array("q")
+        self.shapes = array("q")
+        self._arrays = []
+        nnodes = 1
+        queue = deque([ root, ])
+        while queue:
+            elem = queue.popleft()
+            text = -1 if elem.text is None else self._intern(elem.text)
+            nopt = len(self.options) // 2
+            for key, value in elem.attrib.items():
+                self.options.append(self._intern(key))
+                self.options.append(self._intern(value))
+            nhsd = len(self.hsdattribs) // 3
+            hsdattrib = getattr(elem, "hsdattrib", None) or {}
+            for key, value in hsdattrib.items():
+                self.hsdattribs.extend((self._intern(key),)
+                                       + self._encode(key, value))
+            self.nodes.extend([
+                self._intern(elem.tag), text, nnodes, len(elem),
+                nopt, len(self.options) // 2 - nopt,
+                nhsd, len(self.hsdattribs) // 3 - nhsd ])
+            nnodes += len(elem)
+            queue.extend(elem)
+        encoded = [ string.encode("utf-8") for string in self._stringlist ]
+        self.strings = b"".join(encoded)
+        self.stroffsets = array("q", [ 0 ])
+        offset = 0
+        for data in encoded:
+            offset += len(data)
+            self.stroffsets.append(offset)
+        self._placetables()
+
+    def _intern(self, string):
+        index = self._stringindex.get(string)
+        if index is None:
+            index = len(self._stringlist)
+            self._stringindex[string] = index
+            self._stringlist.append(string)
+        return index
+
+    def _encode(self, key, value):
+        """Returns the kind and the stored value of an hsd attribute."""
+        if isinstance(value, bool):
+            return _BOOL, int(value)
+        if isinstance(value, int):
+            return _INT, value
+        if isinstance(value, str):
+            return _STR, self._intern(value)
+        if isinstance(value, HSDBinaryInclude):
+            return _INCLUDE, self._intern(value.totext())
+        if key == HSDATTR_ARRAY:
+            return _ARRAY, self._addarray(value)
+        raise HSDException("Value of hsd attribute '{}' can not be stored in "
+                           "shared memory.".format(key))
+
+    def _addarray(self, value):
+        import numpy as np
+        value = np.ascontiguousarray(value)
+        if value.dtype.hasobject:
+            raise HSDException("Arrays of objects can not be stored in shared "
+                               "memory.")
+        index = len(self.payloads) // _PAYLOADFIELDS
+        self.payloads.extend([ 0, self._intern(value.dtype.str), value.ndim,
+                               len(self.shapes), value.size ])
+        self.shapes.extend(value.shape)
+        self._arrays.append(value)
+        return index
+
+    def _placetables(self):
+        """Determines the offsets of the tables and of the array data."""
+        offset = _align(_HEADER.size)
+        self._offsets = []
+        for table in _TABLES:
+            self._offsets.append(offset)
+            offset = _align(offset + _nbytes(getattr(self, table)))
+        for ii, value in enumerate(self._arrays):
+            self.payloads[_PAYLOADFIELDS * ii] = offset
+            offset = _align(offset + value.nbytes)
+        self.size = offset
+
+    def write(self, buf):
+        header = [ _MAGIC, ]
+        for table, offset in zip(_TABLES, self._offsets):
+            data = getattr(self, table)
+            header += [ len(data), offset ]
+            nbytes = _nbytes(data)
+            buf[offset:offset + nbytes] = memoryview(data).cast("B")
+        _HEADER.pack_into(buf, 0, *header)
+        for ii, value in enumerate(self._arrays):
+            offset = self.payloads[_PAYLOADFIELDS * ii]
+            buf[offset:offset + value.nbytes] = memoryview(value).cast("B")
+
+
+def _nbytes(data):
+    return len(data) if isinstance(data, bytes) else 8 * len(data)
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
@@ -0,0 +1,211 @@
+"""Fast generation of HSD inputs from a preformatted template."""
+import io
+from concurrent.futures import ProcessPoolExecutor
+from hsd.formatter import HSDFormatter
+from hsd.treebuilder import HSDTreeBuilder
+from hsd.variant import HSDVariant
+
+__all__ = [ "HSDTemplate" ]
+
+
+class HSDTemplate:
+    """Template for HSD inputs differing only in the text of some nodes.
+
+    The base tree is formatted once and split into constant text segments at
+    the positions of the texts of the slot nodes. Rendering a variant just
+    joins the segments with the values of the slots. The result is identical
+    to the output of HSDFormatter (with the same options) for the base tree
+    with the slot texts set to the given values. Empty slot texts change the
+    layout of the output, variants containing them are therefore formatted
+    by HSDFormatter.
+    """
+
+    def __init__(self, root, slots, **formatteroptions):
+        """Initializes a template.
+
+        Args:
+            root: Root of the base tree.
+            slots: Either a dictionary mapping slot names to node paths or a
+                list of node paths (which are then used as slot names as well).
+                Paths contain tag names separated by "/", the first child with
+                matching tag is taken at every level. Instead of a path, a
+                (path, converter) tuple can be specified, where the converter
+                has a totxt() method (e.g. hsd.converter.TxtFloat()) used to
+                convert values for the slot. Slot nodes must not have children.
+            **formatteroptions: Options passed to HSDFormatter (indentstring,
+                closecomments, defattrib).
+
+        Raises:
+            KeyError: If the node of a slot does not exist.
+            ValueError: If the node of a slot has children.
+        """
+        if not hasattr(slots, "items"):
+            slots = dict([ (path, path) for path in slots ])
+        self.defaults = {}
+        self._converters = {}
+        self._paths = {}
+        self._formatteroptions = formatteroptions
+        variant = HSDVariant(root)
+        markers = {}
+        for name, path in slots.items():
+            if isinstance(path, tuple):
+                path, self._converters[name] = path
+            self._paths[name] = path
+            node = variant.getnode(path)
+            if len(node):
+                raise ValueError("Slot node '{}' has children.".format(path))
+            self.defaults[name] = node.text
+            marker = "\0{:d}\0".format(len(markers))
+            markers[marker] = name
+            node.text = marker
+        self._root = variant.root
+        target = _SegmentRecorder(markers)
+        variant.gettree().writehsd(HSDFormatter(target=target,
+                                                **formatteroptions))
+        self.segments = target.finish()
+        self.slots = target.slots
+
+    @classmethod
+    def fromfile(cls, fileobj, slots, parser=None, **formatteroptions):
+        """Creates a template by parsing a HSD input.
+
+        Args:
+            fileobj: File like object or name of the file with the base input.
+            slots: Slot specification (see __init__()).
+            parser: Parser to use (default: HSDParser()).
+            **formatteroptions: Options passed to HSDFormatter.
+
+        Returns:
+            HSDTemplate instance.
+        """
+        root = HSDTreeBuilder(parser=parser).build(fileobj)
+        return cls(root, slots, **formatteroptions)
+
+    def render(self, values):
+        """Renders the template with given slot values.
+
+        Args:
+            values: Dictionary with slot names as keys. Slots not contained
+                keep the text of the base tree.
+
+        Returns:
+            The formatted HSD input.
+        """
+        segments = self.segments
+        parts = [ segments[0], ]
+        texts = {}
+        for ii, name in enumerate(self.slots):
+            value = values.get(name, None)
+            if value is None:
+                text = self.defaults[name]
+            elif isinstance(value, str):
+                text = value
+            elif name in self._converters:
+                text = self._converters[name].totxt(value)
+            else:
+                text = str(value)
+            texts[name] = text
+            parts.append(text)
+            parts.append(segments[ii + 1])
+        if not all(texts.values()):
+            return self._format(texts)
+        return "".join(parts)
+
+    def renderall(self, valuesets, processes=None, chunksize=64):
+        """Renders the template for several sets of slot values.
+
+        Args:
+            valuesets: Iterable of dictionaries with slot values.
+            processes: If specified, rendering is distributed over a process
+                pool with the given number of processes (0 or None: no pool).
+            chunksize: Number of value sets sent at once to a process.
+
+        Returns:
+            Iterator over the rendered inputs (in the order of the value sets).
+        """
+        if not processes:
+            return map(self.render, valuesets)
+        return self._poolmap(_renderinworker, valuesets, processes, chunksize)
+
+    def writefiles(self, items, processes=None, chunksize=64):
+        """Renders the template for several sets of values and writes them.
+
+        Args:
+            items: Iterable of (fname, values) tuples.
+            processes: If specified, rendering and writing is distributed over
+                a process pool with the given number of processes.
+            chunksize: Number of items sent at once to a process.
+        """
+        if not processes:
+            for fname, values in items:
+                _writefile(self, fname, values)
+        else:
+            for _ in self._poolmap(_writeinworker, items, processes,
+                                   chunksize):
+                pass
+
+    def _format(self, texts):
+        """Formats the base tree with given slot texts via HSDFormatter."""
+        variant = HSDVariant(self._root)
+        for name, text in texts.items():
+            variant.settext(self._paths[name], text or None)
+        output = io.StringIO()
+        variant.gettree().writehsd(HSDFormatter(target=output,
+                                                **self._formatteroptions))
+        return output.getvalue()
+
+    def _poolmap(self, func, iterable, processes, chunksize):
+        """Maps a function over a process pool, each holding the template."""
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_initworker,
+                                 initargs=(self,)) as executor:
+            for result in executor.map(func, iterable, chunksize=chunksize):
+                yield result
+
+
+class _SegmentRecorder:
+    """Formatter target splitting the output at the slot markers."""
+
+    def __init__(self, markers):
+        self._markers = markers
+        self._chunks = []
+        self._segments = []
+        self.slots = []
+
+    def write(self, text):
+        name = self._markers.get(text)
+        if name is None:
+            self._chunks.append(text)
+        else:
+            self._segments.append("".join(self._chunks))
+            self._chunks = []
+            self.slots.append(name)
+
+    def finish(self):
+        self._segments.append("".join(self._chunks))
+        self._chunks = []
+        return self._segments
+
+
+# Template used by the current worker process of a process pool
+_workertemplate = None
+
+
+def _initworker(template):
+    global _workertemplate
+    _workertemplate = template
+
+
+def _renderinworker(values):
+    return _workertemplate.render(values)
+
+
+def _writeinworker(item):
+    fname, values = item
+    _writefile(_workertemplate, fname, values)
+
+
+def _writefile(template, fname, values):
+    fp = open(fname, "w")
+    fp.write(template.render(values))
+    fp.close()
@@ -1,51 +1,436 @@
+import copy
+import hashlib
+import weakref
+from array import array
 import xml.etree.ElementTree as etree
+from hsd.common import HSDATTR_ARRAY, HSDATTR_EQUAL, HSDBinaryInclude
 from hsd.formatter import HSDFormatter
 
+# Hsd attributes taken into account by default when fingerprinting a node
+FINGERPRINT_HSDATTRIBS = (HSDATTR_EQUAL,)
+
+# Descriptors of the tag and text attributes of the underlying element
+# implementation
+_ELEMENT_TAG = etree.Element.tag
+_ELEMENT_TEXT = etree.Element.text
+_APPEND = etree.Element.append
+
+# Flags of the flattened nodes (see _flatten())
+_FLAG_TEXT, _FLAG_TAIL, _FLAG_NOHSDATTRIB = 1, 2, 4
+
+# Kinds of the hsd attribute values in the flattened nodes
+_VALUE_INT, _VALUE_FALSE, _VALUE_TRUE, _VALUE_OBJECT = range(4)
+
 class HSDTree(etree.ElementTree):
     """Wrapper around an entire tree."""  
 
-    def writehsd(self, formatter=None):
+    def writehsd(self, formatter=None, arraywriter=None):
         """Writes the tree in HSD format.
         
         Args:
             formatter: Optional formatter object. (default: HSDFormatter(), 
                 writing to sys.stdout)
+            arraywriter: Optional callable, which is called with the node and
+                the array for every node with an array payload. It may store
+                the array in an external file and return the HSDBinaryInclude
+                instance referencing it, or return None to write the array as
+                text (see hsdnum.sidecar.SidecarArrayWriter).
+        """
+        for _ in self.iterwritehsd(formatter, arraywriter):
+            pass
+        
+    def iterwritehsd(self, formatter=None, arraywriter=None):
+        """Writes the tree in HSD format node by node.
+        
+        The arguments are the same as for writehsd(). The returned generator
+        writes one node per step, so that writing can be interleaved with
+        other work (e.g. see hsd.aio.writehsd()).
+        
+        Yields:
+            The nodes after they had been closed.
         """
         if formatter is None:
             formatter = HSDFormatter()
-        self._writehsd(self.getroot(), formatter)
+        root = self.getroot()
+        if root.text:
+            formatter.text(root.text)
+            return
+        # Open nodes and the iterators over their children
+        opened = []
+        iterators = [ iter(root) ]
+        while iterators:
+            child = next(iterators[-1], None)
+            if child is None:
+                iterators.pop()
+                if opened:
+                    node = opened.pop()
+                    formatter.close_tag(node.tag)
+                    yield node
+                continue
+            array = (child.hsdattrib.get(HSDATTR_ARRAY)
+                     if child.hsdattrib else None)
+            if array is not None:
+                self._writearray(child, array, formatter, arraywriter)
+            else:
+                formatter.start_tag(child.tag, child.attrib, child.hsdattrib)
+                if not child.text:
+                    opened.append(child)
+                    iterators.append(iter(child))
+                    continue
+                formatter.text(child.text)
+            formatter.close_tag(child.tag)
+            yield child
         
-    def _writehsd(self, parent, formatter):
-        """Private helper routine for writehsd."""
-        if parent.text:
-            formatter.text(parent.text)
-        else:
-            for child in parent:
-                formatter.start_tag(child.tag, child.attrib,
-                                         child.hsdattrib)
-                self._writehsd(child, formatter)
-                formatter.close_tag(child.tag)
+    def merge(self, *overlays, policies=None, default=None, files=None,
+              lazy=False):
+        """Merges overlay trees onto the tree (see hsd.merge).
+        
+        Args:
+            *overlays: Trees (or their roots) taking precedence over the tree,
+                the topmost one last.
+            policies: Dictionary mapping paths (e.g. "Hamiltonian/*/Mixer")
+                onto merge policies (MERGE_OVERRIDE, MERGE_APPEND or
+                MERGE_DEEP from hsd.merge).
+            default: Policy for all other paths (default: MERGE_DEEP).
+            files: Names of the files of the tree and of the overlays, used
+                to set HSDATTR_FILE of the merged nodes.
+            lazy: If True, a read-only view of the merged tree is returned
+                instead of a new tree.
+        
+        Returns:
+            New HSDTree instance or root of the view (HSDMergedElement). The
+            tree and the overlays are not changed.
+        """
+        from hsd.merge import mergetrees, MERGE_DEEP
+        if default is None:
+            default = MERGE_DEEP
+        root = mergetrees((self,) + overlays, policies=policies,
+                          default=default, files=files, lazy=lazy)
+        return root if lazy else HSDTree(root)
+        
+    def _writearray(self, node, array, formatter, arraywriter):
+        """Private helper routine for writing nodes with array payload."""
+        if arraywriter is not None and not isinstance(array, HSDBinaryInclude):
+            include = arraywriter(node, array)
+            if include is not None:
+                array = include
+        hsdattrib = node.hsdattrib
+        if (isinstance(array, HSDBinaryInclude)
+            and hsdattrib.get(HSDATTR_EQUAL, False)):
+            # Interrupts are only allowed in blocks
+            hsdattrib = hsdattrib.copy()
+            del hsdattrib[HSDATTR_EQUAL]
+        formatter.start_tag(node.tag, node.attrib, hsdattrib)
+        formatter.array(array)
         
 
-class _ElementInterface(etree._ElementInterface):
-    """Element Interface containing extra dictionary with hsd attributes."""
+class _ElementInterface(etree.Element):
+    """Element Interface containing extra dictionary with hsd attributes.
+    
+    Elements can calculate a content based fingerprint of their subtree (see
+    fingerprint()). The fingerprints are cached and the caches of the changed
+    node and its ancestors are invalidated when the tree is changed via the
+    element methods or by setting the tag or the text. Changes made directly
+    in the attrib or hsdattrib dictionaries must be followed by calling
+    invalidate().
+    """
     
     hsdattrib = None
+    _digests = None      # cached fingerprints of the subtree
+    _parentref = None    # weak reference to parent, set when fingerprinting
     
     def __init__(self, tag, attrib, hsdattrib=None):
         super().__init__(tag, attrib)
         self.hsdattrib = hsdattrib
         
+    def _settext(self, text):
+        _ELEMENT_TEXT.__set__(self, text)
+        if self._digests:
+            self.invalidate()
+        
+    text = property(_ELEMENT_TEXT.__get__, _settext)
+        
+    def _settag(self, tag):
+        _ELEMENT_TAG.__set__(self, tag)
+        if self._digests:
+            self.invalidate()
+        
+    tag = property(_ELEMENT_TAG.__get__, _settag)
+        
     def sethsdattribs(self, hsdattrib):
         self.hsdattrib = hsdattrib
+        if self._digests:
+            self.invalidate()
         
     def makeelement(self, tag, attrib, hsdattrib):
         return Element(tag, attrib, hsdattrib)
     
+    def __copy__(self):
+        """Returns a shallow copy, which shares the children with the node."""
+        elem = _ElementInterface(self.tag, self.attrib.copy(),
+                                 copy.copy(self.hsdattrib))
+        _ELEMENT_TEXT.__set__(elem, _ELEMENT_TEXT.__get__(self))
+        elem.tail = self.tail
+        etree.Element.extend(elem, self)
+        return elem
+    
+    def __deepcopy__(self, memo):
+        """Returns a deep copy of the subtree."""
+        elem = _ElementInterface(self.tag, copy.deepcopy(self.attrib, memo),
+                                 copy.deepcopy(self.hsdattrib, memo))
+        _ELEMENT_TEXT.__set__(elem, _ELEMENT_TEXT.__get__(self))
+        elem.tail = self.tail
+        etree.Element.extend(elem, [ copy.deepcopy(child, memo)
+                                     for child in self ])
+        return elem
+    
+    def __reduce_ex__(self, protocol):
+        """Pickles the entire subtree in flattened form (see _flatten()).
+        
+        Every pickled node carries its own copy of its subtree. Identity is
+        kept for a node pickled several times, but not between a node and
+        its descendants pickled separately: after unpickling [ root, root[0] ]
+        the second item is a copy of the first child of the first item, not
+        the child itself. Pickle only the root and look the nodes up after
+        unpickling, if they must share identity.
+        """
+        return _unflatten, _flatten(self)
+        
     def clear(self):
         super().clear()
         self.hsdattrib.clear()
+        self.invalidate()
+        
+    def set(self, key, value):
+        super().set(key, value)
+        self.invalidate()
+        
+    def append(self, subelement):
+        super().append(subelement)
+        self.invalidate()
+        
+    def extend(self, elements):
+        super().extend(elements)
+        self.invalidate()
         
+    def insert(self, index, subelement):
+        super().insert(index, subelement)
+        self.invalidate()
+        
+    def remove(self, subelement):
+        super().remove(subelement)
+        self.invalidate()
+        
+    def __setitem__(self, index, element):
+        super().__setitem__(index, element)
+        self.invalidate()
+        
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.invalidate()
+        
+    def fingerprint(self, hsdattribs=FINGERPRINT_HSDATTRIBS):
+        """Returns a content based fingerprint of the subtree.
+        
+        The fingerprint is a hash calculated bottom-up from tag, attributes,
+        selected hsd attributes, text (or array payload) and the fingerprints
+        of the children. Equal subtrees have equal fingerprints, independent
+        of the line numbers or files they were read from. Fingerprints are
+        cached, so after a change only the changed node and its ancestors
+        must be rehashed.
+        
+        Args:
+            hsdattribs: Names of the hsd attributes to include.
+                (default: FINGERPRINT_HSDATTRIBS)
+        
+        Returns:
+            Hexadecimal string with the fingerprint.
+        """
+        hsdattribs = tuple(hsdattribs)
+        digests = self._digests
+        if digests is None:
+            digests = self._digests = {}
+        digest = digests.get(hsdattribs)
+        if digest is None:
+            digest = self._calcfingerprint(hsdattribs)
+            digests[hsdattribs] = digest
+        return digest
+        
+    def invalidate(self):
+        """Drops the cached fingerprints of the node and of its ancestors.
+        
+        Nodes shared between several trees only notify the parent, they had
+        been fingerprinted with most recently.
+        """
+        node = self
+        while node is not None and node._digests:
+            node._digests = None
+            parentref = node._parentref
+            node = parentref() if parentref is not None else None
+        
+    def _calcfingerprint(self, hsdattribs):
+        """Calculates the fingerprint of the subtree."""
+        hsdattrib = self.hsdattrib or {}
+        fields = (self.tag, sorted(self.attrib.items()),
+                  [ (key, hsdattrib[key]) for key in hsdattribs
+                    if key in hsdattrib ],
+                  _ELEMENT_TEXT.__get__(self))
+        hasher = hashlib.blake2b(repr(fields).encode(), digest_size=20)
+        array = hsdattrib.get(HSDATTR_ARRAY)
+        if isinstance(array, HSDBinaryInclude):
+            hasher.update(array.totext().encode())
+        elif array is not None:
+            hasher.update(repr((array.dtype.str, array.shape)).encode())
+            hasher.update(array.tobytes())
+        parentref = weakref.ref(self)
+        for child in self:
+            child._parentref = parentref
+            hasher.update(child.fingerprint(hsdattribs).encode())
+        return hasher.hexdigest()
+        
+
+def _flatten(root):
+    """Flattens a subtree for pickling without recursion.
+    
+    Every node is described by a signature consisting of its tag, flags, the
+    names of its options and the names (and boolean values) of its hsd
+    attributes. Strings and signatures are stored once in tables. The nodes
+    are stored in document order as integer codes: index of the signature,
+    indices of the option values, integer hsd attribute values and the number
+    of children. Other hsd attribute values, texts and tails are collected in
+    separate lists.
+    
+    Args:
+        root: Root of the subtree.
+    
+    Returns:
+        Tuple of string table, signature table, list of texts, list of other
+        hsd attribute values and the integer codes, as expected by
+        _unflatten().
+    """
+    strings = []
+    stringindex = {}
+    signatures = []
+    signatureindex = {}
+    texts = []
+    objects = []
+    codes = []
+    
+    def intern(string):
+        index = stringindex.get(string)
+        if index is None:
+            index = stringindex[string] = len(strings)
+            strings.append(string)
+        return index
+    
+    stack = [ root, ]
+    while stack:
+        elem = stack.pop()
+        text = _ELEMENT_TEXT.__get__(elem)
+        hsdattrib = elem.hsdattrib
+        flags = 0
+        if text is not None:
+            flags |= _FLAG_TEXT
+            texts.append(text)
+        if elem.tail is not None:
+            flags |= _FLAG_TAIL
+            texts.append(elem.tail)
+        attribkeys = tuple([ intern(key) for key in elem.attrib ])
+        intvalues = []
+        if hsdattrib is None:
+            flags |= _FLAG_NOHSDATTRIB
+            hsdkeys = ()
+        else:
+            hsdkeys = []
+            for key, value in hsdattrib.items():
+                if value is True:
+                    kind = _VALUE_TRUE
+                elif value is False:
+                    kind = _VALUE_FALSE
+                elif type(value) is int and -2**63 <= value < 2**63:
+                    kind = _VALUE_INT
+                    intvalues.append(value)
+                else:
+                    kind = _VALUE_OBJECT
+                    objects.append(value)
+                hsdkeys.append((intern(key), kind))
+            hsdkeys = tuple(hsdkeys)
+        signature = (intern(elem.tag), flags, attribkeys, hsdkeys)
+        index = signatureindex.get(signature)
+        if index is None:
+            index = signatureindex[signature] = len(signatures)
+            signatures.append(signature)
+        codes.append(index)
+        for value in elem.attrib.values():
+            codes.append(intern(value))
+        codes.extend(intvalues)
+        codes.append(len(elem))
+        stack.extend(reversed(elem))
+    return strings, signatures, texts, objects, _packcodes(codes)
+
+
+def _packcodes(codes):
+    """Stores integer codes in an array with the smallest sufficient type."""
+    low, high = min(codes), max(codes)
+    for typecode in "bhi":
+        packed = array(typecode)
+        bound = 2**(8 * packed.itemsize - 1)
+        if -bound <= low and high < bound:
+            break
+    else:
+        packed = array("q")
+    packed.extend(codes)
+    return packed
+
+
+def _unflatten(strings, signatures, texts, objects, codes):
+    """Rebuilds a subtree flattened by _flatten() without recursion."""
+    signatures = [ (strings[tag], flags,
+                    [ strings[key] for key in attribkeys ],
+                    [ (strings[key], kind) for key, kind in hsdkeys ])
+                   for tag, flags, attribkeys, hsdkeys in signatures ]
+    nextcode = iter(codes).__next__
+    nexttext = iter(texts).__next__
+    nextobject = iter(objects).__next__
+    settext = _ELEMENT_TEXT.__set__
+    element = _ElementInterface
+    # Nodes with missing children as [ node, number of missing children ]
+    stack = []
+    while True:
+        tag, flags, attribkeys, hsdkeys = signatures[nextcode()]
+        attrib = {}
+        for key in attribkeys:
+            attrib[key] = strings[nextcode()]
+        if flags & _FLAG_NOHSDATTRIB:
+            hsdattrib = None
+        else:
+            hsdattrib = {}
+            for key, kind in hsdkeys:
+                if kind == _VALUE_INT:
+                    hsdattrib[key] = nextcode()
+                elif kind == _VALUE_OBJECT:
+                    hsdattrib[key] = nextobject()
+                else:
+                    hsdattrib[key] = kind == _VALUE_TRUE
+        elem = element(tag, attrib, hsdattrib)
+        if flags & _FLAG_TEXT:
+            settext(elem, nexttext())
+        if flags & _FLAG_TAIL:
+            elem.tail = nexttext()
+        nchild = nextcode()
+        if stack:
+            _APPEND(stack[-1][0], elem)
+            stack[-1][1] -= 1
+        else:
+            root = elem
+        if nchild:
+            stack.append([ elem, nchild ])
+        else:
+            while stack and not stack[-1][1]:
+                stack.pop()
+        if not stack:
+            return root
+
 
 def Element(tag, attrib={}, hsdattrib={}):
     """Element factory with extra hsd attributes."""
@@ -1,33 +1,188 @@
+import xml.etree.ElementTree as etree
 import hsd.parser as hsdparser
 import hsd.tree as hsdtree
+from hsd.common import HSDATTR_ARRAY, HSDParserError
     
 class HSDTreeBuilder:
     
-    def __init__(self, roottag="hsd", parser=None):
+    def __init__(self, roottag="hsd", parser=None, interner=None):
+        """Initializes a tree builder.
+        
+        Args:
+            roottag: Tag name of the root element.
+            parser: Parser to use (default: HSDParser(interner=interner)).
+            interner: HSDInterner instance used by the parser, if the builder
+                creates it (see HSDParser). A shared instance lets the trees
+                of a batch of documents share their tag names and values.
+        """
         if parser:
             self.parser = parser
         else:
-            self.parser = hsdparser.HSDParser()
+            self.parser = hsdparser.HSDParser(interner=interner)
         self.roottag = roottag
         self.target = hsdtree.TreeBuilder()
         self.parser.start_handler = self.start
         self.parser.close_handler = self.close
         self.parser.text_handler = self.data
+        self.parser.array_handler = self.array
+        interner = getattr(self.parser, "interner", None)
+        self._internvalue = interner.value if interner else None
+        self._sinkfactories = {}
+        self._paths = []
+        self._sinks = []
+        self._array = None
+        
+    def registersink(self, path, sinkfactory):
+        """Registers a sink for the text of the tags with a given path.
+        
+        The text of those tags is passed to the sink while being parsed (see
+        HSDParser.settextsink()) instead of being stored as text of the node.
+        When the tag is closed, the value returned by the close() method of the
+        sink is stored as array payload in the hsd attributes of the node
+        (with key HSDATTR_ARRAY).
+        
+        Args:
+            path: Path of the tag relative to the root, with tag names
+                separated by "/" (e.g. "Geometry/GenFormat").
+            sinkfactory: Callable returning a new sink object (e.g. the class
+                hsdnum.sink.ArraySink).
+        """
+        self._sinkfactories[path] = sinkfactory
         
     def start(self, tagname, options, hsdoptions):
+        if self._array is not None or self._sinkfactories:
+            self._prepare(tagname)
         return self.target.start(tagname, options, hsdoptions)
     
     def data(self, text):
         return self.target.data(text)
     
+    def array(self, array):
+        self._array = array
+    
     def close(self, tagname):
-        return self.target.end(tagname)
+        elem = self.target.end(tagname)
+        # The target joins the text anew, restore the interned instance
+        text = _GETTEXT(elem)
+        if text is not None and self._internvalue is not None:
+            _SETTEXT(elem, self._internvalue(text))
+        if self._array is not None or self._sinkfactories:
+            self._finish(elem)
+        return elem
     
     def build(self, fileobj):
-        self.target.start(self.roottag, {}, {})
+        self.startdocument()
         self.parser.feed(fileobj)
+        return self.enddocument()
+    
+    def startdocument(self):
+        """Opens the root element.
+        
+        Together with enddocument() it allows to build a tree while the
+        parser is fed by other means than build() (e.g. asynchronously).
+        """
+        self.target.start(self.roottag, {}, {})
+        
+    def enddocument(self):
+        """Closes the root element and returns it."""
         self.target.end(self.roottag)
         return self.target.close()
+    
+    def _prepare(self, tagname):
+        """Checks for pending payloads and opens the sink of a new tag."""
+        if self._array is not None:
+            raise HSDParserError("Tag '{}' follows array payload.".format(
+                tagname))
+        if self._sinkfactories:
+            if self._paths:
+                path = self._paths[-1] + "/" + tagname
+            else:
+                path = tagname
+            self._paths.append(path)
+            sinkfactory = self._sinkfactories.get(path)
+            sink = sinkfactory() if sinkfactory is not None else None
+            if sink is not None:
+                self.parser.settextsink(sink)
+            self._sinks.append(sink)
+    
+    def _finish(self, elem):
+        """Attaches the array payload (if any) to a closed element."""
+        if self._array is not None:
+            elem.hsdattrib[HSDATTR_ARRAY] = self._array
+            self._array = None
+        if self._sinkfactories:
+            self._paths.pop()
+            sink = self._sinks.pop()
+            if (sink is not None and not len(elem)
+                and HSDATTR_ARRAY not in elem.hsdattrib):
+                elem.hsdattrib[HSDATTR_ARRAY] = sink.close()
+
+
+class HSDDirectTreeBuilder(HSDTreeBuilder):
+    """Tree builder creating the elements directly.
+    
+    It produces the same trees as HSDTreeBuilder, but instead of forwarding
+    the parser events to an hsd.tree.TreeBuilder instance, it keeps its own
+    stack of open elements, creates each element with its attributes and hsd
+    attributes in one step and sets the text directly.
+    """
+    
+    def __init__(self, roottag="hsd", parser=None, interner=None):
+        super().__init__(roottag, parser, interner)
+        self.target = None
+        self._elems = []
+        self._last = None
+        self._tail = False
+        
+    def start(self, tagname, options, hsdoptions):
+        if self._array is not None or self._sinkfactories:
+            self._prepare(tagname)
+        elem = hsdtree._ElementInterface(tagname, options, hsdoptions)
+        _APPEND(self._elems[-1], elem)
+        self._elems.append(elem)
+        self._last = elem
+        self._tail = False
+        return elem
+    
+    def data(self, text):
+        last = self._last
+        if self._tail:
+            if last.tail is not None:
+                text = last.tail + text
+            last.tail = text
+        else:
+            oldtext = _GETTEXT(last)
+            if oldtext is not None:
+                text = oldtext + text
+                if self._internvalue is not None:
+                    text = self._internvalue(text)
+            _SETTEXT(last, text)
+    
+    def close(self, tagname):
+        elem = self._last = self._elems.pop()
+        self._tail = True
+        if self._array is not None or self._sinkfactories:
+            self._finish(elem)
+        return elem
+    
+    def startdocument(self):
+        root = hsdtree._ElementInterface(self.roottag, {}, {})
+        self._elems = [ root, ]
+        self._last = root
+        self._tail = False
+        
+    def enddocument(self):
+        root = self._elems[0]
+        self._elems = []
+        self._last = None
+        return root
+
+
+# Unbound methods of the underlying element implementation, which do not
+# invalidate fingerprints (not needed for elements being built).
+_APPEND = etree.Element.append
+_GETTEXT = hsdtree._ELEMENT_TEXT.__get__
+_SETTEXT = hsdtree._ELEMENT_TEXT.__set__
 
 if __name__ == "__main__":
     from io import StringIO
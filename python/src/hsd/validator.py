@@ -0,0 +1,245 @@
+"""Validation of HSD input against a schema while it is being parsed.
+
+A schema describes the allowed children, the allowed attributes and the
+allowed text of the tags as nested HSDRule objects. It is compiled into a
+state machine, which is driven directly by the parser events, so that invalid
+input is rejected as soon as the offending event arrives, without building a
+tree. Errors are reported with the HSDQueryError exceptions also raised by
+HSDQuery, carrying the file and line of the offending tag.
+"""
+import re
+from hsd.common import *
+from hsd.parser import HSDParser
+
+__all__ = [ "HSDRule", "HSDSchema", "HSDValidator" ]
+
+
+class HSDRule:
+    """Constraints for a tag.
+
+    Attributes:
+        children: Dictionary mapping the names of the allowed children onto
+            their rules. The rule with key "*" applies to all children not
+            listed explicitly. If None, the tag may not have children.
+        attribs: Set of the allowed attribute names.
+        pattern: Compiled regular expression the (stripped) text of the tag
+            must match entirely or None.
+        required: Whether the tag must be present in its parent.
+        unique: Whether the tag may appear only once in its parent.
+    """
+
+    def __init__(self, children=None, attribs=(), pattern=None, required=False,
+                 unique=False):
+        """Initializes an HSDRule instance.
+
+        Args:
+            children: Dictionary with the rules of the allowed children (see
+                above). Rules may be reused, also recursively.
+            attribs: Allowed attribute names (see also
+                HSDConverter.setallowedattribs()).
+            pattern: Regular expression (string or compiled) for the text of
+                the tag. If None, any text is allowed for tags without
+                children, while tags with children may not contain text.
+            required: Whether the tag must be present in its parent.
+            unique: Whether the tag may appear only once in its parent.
+        """
+        self.children = children
+        self.attribs = frozenset(attribs)
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+        self.required = required
+        self.unique = unique
+
+
+class _State:
+    """State of the validator corresponding to a rule."""
+
+    __slots__ = ("path", "transitions", "wildcard", "attribs", "pattern",
+                 "textallowed", "required", "unique")
+
+    def __init__(self, path, rule):
+        self.path = path
+        self.transitions = {}
+        self.wildcard = None
+        self.attribs = rule.attribs
+        self.pattern = rule.pattern
+        self.textallowed = rule.children is None or rule.pattern is not None
+        self.required = ()
+        self.unique = rule.unique
+
+
+class HSDSchema:
+    """Compiled schema for the validation of HSD input."""
+
+    def __init__(self, root):
+        """Compiles a schema.
+
+        Args:
+            root: Rule for the root of the document or dictionary with the
+                rules of the tags allowed on the top level.
+        """
+        if not isinstance(root, HSDRule):
+            root = HSDRule(children=root)
+        self._states = []
+        self.root = self._compile(root, "", {})
+
+    def _compile(self, rule, path, compiled):
+        """Compiles a rule and the rules of its children."""
+        state = compiled.get(id(rule))
+        if state is not None:
+            return state
+        state = _State(path, rule)
+        compiled[id(rule)] = state
+        self._states.append(state)
+        if rule.children is None:
+            return state
+        required = []
+        for name, childrule in rule.children.items():
+            childpath = path + "/" + name if path else name
+            childstate = self._compile(childrule, childpath, compiled)
+            if name == "*":
+                state.wildcard = childstate
+            else:
+                state.transitions[name] = childstate
+                if childrule.required:
+                    required.append(name)
+        state.required = tuple(required)
+        return state
+
+    def validator(self, parser=None):
+        """Returns a validator for the schema (see HSDValidator)."""
+        return HSDValidator(self, parser)
+
+    def validate(self, fileobj, parser=None):
+        """Validates an input.
+
+        Args:
+            fileobj: File like object or name of a file containing the input.
+            parser: Parser to use (default: HSDParser()).
+
+        Raises:
+            HSDQueryError: If the input does not conform to the schema.
+        """
+        HSDValidator(self, parser).validate(fileobj)
+
+
+class _EventNode:
+    """Stand-in for a node, carrying the information of a start event."""
+
+    __slots__ = ("tag", "attrib", "hsdattrib")
+
+    def __init__(self, tag, attrib, hsdattrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.hsdattrib = hsdattrib
+
+
+class HSDValidator:
+    """Validates the events of a parser against a schema.
+
+    The validator can be connected to a parser (default), or its methods
+    start(), close(), text() and array() can be called by an other event
+    handler.
+    """
+
+    def __init__(self, schema, parser=None):
+        """Initializes an HSDValidator instance.
+
+        Args:
+            schema: HSDSchema instance.
+            parser: Parser, whose handlers should be set to the methods of the
+                validator. If None, an HSDParser is created.
+        """
+        if parser is None:
+            parser = HSDParser()
+        self.parser = parser
+        self._schema = schema
+        parser.start_handler = self.start
+        parser.close_handler = self.close
+        parser.text_handler = self.text
+        parser.array_handler = self.array
+        self.reset()
+
+    def reset(self):
+        """Resets the validator to the beginning of a document."""
+        # Open tags, each as [ state, node, children seen, texts ]
+        self._stack = [ [ self._schema.root, None, set(), [] ] ]
+
+    def validate(self, fileobj):
+        """Feeds an input into the parser and validates it.
+
+        Args:
+            fileobj: File like object or name of a file containing the input.
+
+        Raises:
+            HSDQueryError: If the input does not conform to the schema.
+        """
+        self.reset()
+        self.parser.feed(fileobj)
+        self.finish()
+
+    def finish(self):
+        """Checks the top level tags at the end of a document."""
+        self._checkrequired(self._stack[0])
+
+    def start(self, tagname, options, hsdoptions):
+        parent = self._stack[-1]
+        state = parent[0].transitions.get(tagname, parent[0].wildcard)
+        node = _EventNode(tagname, options, self._hsdattrib(hsdoptions))
+        if state is None:
+            raise HSDInvalidTagException(node=node, msg="Invalid tag '{}'{}."
+                                         .format(tagname, _location(parent)))
+        if tagname in parent[2] and state.unique:
+            raise HSDInvalidTagException(node=node, msg="Double occurrence of "
+                                         "unique tag '{}'.".format(tagname))
+        parent[2].add(tagname)
+        if options and not state.attribs.issuperset(options):
+            invalid = "', '".join([ key for key in options
+                                    if key not in state.attribs ])
+            raise HSDInvalidAttributeException(node=node, msg="Tag '{}' "
+                "contains invalid attribute(s) '{}'.".format(tagname, invalid))
+        self._stack.append([ state, node, set(), [] ])
+
+    def text(self, text):
+        frame = self._stack[-1]
+        if not frame[0].textallowed:
+            raise HSDInvalidTagValueException(node=frame[1], msg="Tag '{}' "
+                "can not contain text.".format(frame[1].tag))
+        if frame[0].pattern is not None:
+            frame[3].append(text)
+
+    def array(self, array):
+        frame = self._stack[-1]
+        if frame[0].pattern is not None or not frame[0].textallowed:
+            raise HSDInvalidTagValueException(node=frame[1], msg="Tag '{}' "
+                "can not contain an array.".format(frame[1].tag))
+
+    def close(self, tagname):
+        frame = self._stack.pop()
+        state, node = frame[0], frame[1]
+        if state.pattern is not None:
+            text = "".join(frame[3])
+            if not state.pattern.fullmatch(text):
+                raise HSDInvalidTagValueException(node=node, msg="Invalid "
+                    "value '{}' of tag '{}'.".format(text, tagname))
+        self._checkrequired(frame)
+
+    def _checkrequired(self, frame):
+        """Checks, whether all required children have been seen."""
+        for name in frame[0].required:
+            if name not in frame[2]:
+                raise HSDMissingTagException(node=frame[1], msg="Required tag "
+                    "'{}' not found{}.".format(name, _location(frame)))
+
+    def _hsdattrib(self, hsdoptions):
+        """Returns the hsd attributes (with file name) of a new tag."""
+        return { HSDATTR_LINE: hsdoptions.get(HSDATTR_LINE),
+                 HSDATTR_FILE: self.parser.currentfile() }
+
+
+def _location(frame):
+    """Returns the description of the parent in error messages."""
+    if frame[1] is None:
+        return " on top level"
+    return " in tag '{}'".format(frame[0].path)
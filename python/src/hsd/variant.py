@@ -0,0 +1,124 @@
+"""Copy-on-write variants of HSD trees."""
+import copy
+from hsd.tree import HSDTree, Element
+
+__all__ = [ "HSDVariant" ]
+
+
+class HSDVariant:
+    """Variant of a HSD tree sharing all unmodified subtrees with its base.
+
+    Only the nodes along the paths to the modified nodes are copied, all other
+    subtrees are shared with the base tree. Creating a variant costs therefore
+    time and memory proportional to the number of edits (and to the number of
+    children of the nodes along the edited paths), but not to the size of the
+    base tree. The variant is a normal tree and can be queried, formatted or
+    written with HSDTree.writehsd().
+
+    The base tree must not be changed as long as its variants are in use, and
+    nodes of the variant should only be changed after being obtained via
+    getnode(), as all other nodes may be shared.
+    """
+
+    def __init__(self, base):
+        """Initializes a variant.
+
+        Args:
+            base: Root node of the base tree (or the HSDTree instance).
+        """
+        if isinstance(base, HSDTree):
+            base = base.getroot()
+        self.base = base
+        self.root = copy.copy(base)
+        # Nodes owned by the variant by their id. The nodes are kept, so that
+        # their ids can not be reused by other nodes.
+        self._private = { id(self.root): self.root }
+
+    def getnode(self, path):
+        """Returns a private (modifiable) copy of the node with a given path.
+
+        Args:
+            path: Path of the node relative to the root, with tag names
+                separated by "/" (e.g. "Hamiltonian/DFTB/SCCTolerance"). The
+                first child with matching tag is taken at every level.
+
+        Returns:
+            The node, which is not shared with the base tree any more.
+
+        Raises:
+            KeyError: If the node does not exist.
+        """
+        node = self.root
+        if not path:
+            return node
+        for tag in path.split("/"):
+            for index, child in enumerate(node):
+                if child.tag == tag:
+                    break
+            else:
+                raise KeyError(path)
+            if self._private.get(id(child)) is not child:
+                child = copy.copy(child)
+                node[index] = child
+                self._private[id(child)] = child
+            node = child
+        return node
+
+    def settext(self, path, text):
+        """Sets the text of a node.
+
+        Args:
+            path: Path of the node (see getnode()).
+            text: New text.
+        """
+        self.getnode(path).text = text
+
+    def setattrib(self, path, key, value):
+        """Sets an attribute of a node.
+
+        Args:
+            path: Path of the node (see getnode()).
+            key: Name of the attribute.
+            value: Value of the attribute.
+        """
+        self.getnode(path).set(key, value)
+
+    def replacenode(self, path, node):
+        """Replaces a node by an other one.
+
+        Args:
+            path: Path of the node to replace (see getnode()).
+            node: The new node. It is inserted into the variant as it is and
+                changed by later edits of its path.
+        """
+        parentpath, _, tag = path.rpartition("/")
+        parent = self.getnode(parentpath)
+        for index, child in enumerate(parent):
+            if child.tag == tag:
+                parent[index] = node
+                self._private[id(node)] = node
+                return
+        raise KeyError(path)
+
+    def addnode(self, path, tag, text=None, attrib={}, hsdattrib={}):
+        """Appends a new child to a node.
+
+        Args:
+            path: Path of the parent node (see getnode()).
+            tag: Tag of the new node.
+            text: Text of the new node.
+            attrib: Attributes of the new node.
+            hsdattrib: Hsd attributes of the new node.
+
+        Returns:
+            The new node.
+        """
+        node = Element(tag, attrib, hsdattrib)
+        node.text = text
+        self.getnode(path).append(node)
+        self._private[id(node)] = node
+        return node
+
+    def gettree(self):
+        """Returns the variant as HSDTree instance."""
+        return HSDTree(self.root)
@@ -0,0 +1,301 @@
+"""Streaming conversion between HSD and XML.
+
+The HSD tags are mapped onto XML elements with the same name, the HSD options
+onto XML attributes and the text of the tags onto the text of the elements.
+The hsd attributes (e.g. whether a tag was opened with an equal sign or the
+line number it was defined in) are stored as XML attributes in the namespace
+HSD_XMLNS. All tags are enclosed in a root element.
+
+Both directions process the input event by event and pass the text in chunks,
+so the memory needed does not depend on the size of the converted document.
+"""
+import sys
+from collections import OrderedDict
+import xml.etree.ElementTree as etree
+from xml.sax.saxutils import escape, quoteattr
+from hsd.common import *
+from hsd.formatter import HSDFormatter, HSDStreamFormatter, arraytotext
+from hsd.parser import HSDParser
+
+__all__ = [ "HSD_XMLNS", "HSDXMLFormatter", "HSDXMLParser",
+            "hsdtoxml", "xmltohsd" ]
+
+# Namespace of the XML attributes containing the hsd attributes
+HSD_XMLNS = "urn:hsd:hsdattrib"
+
+# Prefix used for the namespace in the XML output
+_XMLNS_PREFIX = "hsd"
+
+# Converters of the hsd attribute values which are not strings
+_ENCODERS = { HSDATTR_EQUAL: lambda value: "1" if value else "0",
+              HSDATTR_PROC: lambda value: "1" if value else "0" }
+_DECODERS = { HSDATTR_EQUAL: lambda value: value == "1",
+              HSDATTR_PROC: lambda value: value == "1",
+              HSDATTR_LINE: int }
+
+# Size of the chunks read from XML input
+_CHUNKSIZE = 65536
+
+
+class HSDXMLFormatter:
+    """Event controlled formatter producing XML output.
+
+    It has the same interface as HSDFormatter, so it can be driven by an
+    HSDStreamFormatter or by HSDTree.writehsd(). The output is written
+    immediately, only the closing tag of the root element is deferred until
+    close() is called.
+    """
+
+    def __init__(self, target=sys.stdout, roottag="hsd", hsdattribs=None,
+                 parser=None):
+        """Initializes HSDXMLFormatter instance.
+
+        Args:
+            target: File where the output is written (default: sys.stdout).
+            roottag: Tag of the XML root element (default: "hsd").
+            hsdattribs: Names of the hsd attributes to store (default: all,
+                except the array payload which is written as text).
+            parser: If specified, the text of the tags is obtained from the
+                parser chunk by chunk (see HSDParser.settextsink()) instead of
+                being collected by the parser first. This keeps the memory
+                usage low even for tags with huge texts.
+        """
+        self._target = target
+        self._roottag = roottag
+        self._hsdattribs = hsdattribs
+        self._parser = parser
+        self._tags = []
+        self._opened = False      # whether root element has been written
+        self._pending = False     # whether start tag is not terminated yet
+        self._hastext = False     # whether current element received text
+        self._whitespace = ""     # whitespace held back from last chunk
+
+    def start_tag(self, tagname, options, hsdoptions):
+        """Starts a tag.
+
+        Args:
+            tagname: Name of the tag to be started.
+            options: Dictionary of the tag options.
+            hsdoptions: Dictionary of the hsd options.
+        """
+        self._terminate()
+        parts = [ "<", tagname ]
+        for key, value in options.items():
+            parts += [ " ", key, "=", quoteattr(value) ]
+        for key, value in hsdoptions.items():
+            if key == HSDATTR_ARRAY or (self._hsdattribs is not None
+                                        and key not in self._hsdattribs):
+                continue
+            encoder = _ENCODERS.get(key, str)
+            parts += [ " ", _XMLNS_PREFIX, ":", key, "=",
+                       quoteattr(encoder(value)) ]
+        self._target.write("".join(parts))
+        self._tags.append(tagname)
+        self._pending = True
+        self._hastext = False
+        self._whitespace = ""
+        if self._parser is not None:
+            self._parser.settextsink(_TextSink(self))
+
+    def close_tag(self, tagname):
+        """Closes a tag.
+
+        Args:
+            tagname: Name of the tag to be closed.
+        """
+        if self._pending:
+            self._target.write(" />")
+            self._pending = False
+        else:
+            self._target.write("</" + self._tags[-1] + ">")
+        del self._tags[-1]
+        self._hastext = False
+        self._whitespace = ""
+
+    def text(self, text):
+        """Adds text between tag opening and closing.
+
+        Args:
+            text: Text to be added.
+        """
+        self._terminate()
+        self._target.write(escape(self._whitespace + text))
+        self._whitespace = ""
+        self._hastext = True
+
+    def array(self, array):
+        """Adds an array payload between tag opening and closing.
+
+        Args:
+            array: Array payload (HSDBinaryInclude or numpy array like object).
+        """
+        if isinstance(array, HSDBinaryInclude):
+            text = array.totext()
+        else:
+            text = arraytotext(array)
+        if self._hastext:
+            text = "\n" + text
+        self.text(text)
+
+    def close(self):
+        """Closes the root element and finishes the output."""
+        self._terminate()
+        self._target.write("</" + self._roottag + ">\n")
+
+    def _textchunk(self, chunk):
+        """Adds a chunk of text, stripping the text as a whole."""
+        if not self._hastext:
+            chunk = chunk.lstrip()
+        stripped = chunk.rstrip()
+        if stripped:
+            self.text(stripped)
+        self._whitespace += chunk[len(stripped):]
+
+    def _terminate(self):
+        """Writes the root element and terminates pending start tags."""
+        if not self._opened:
+            self._target.write("<{} xmlns:{}={}>".format(
+                self._roottag, _XMLNS_PREFIX, quoteattr(HSD_XMLNS)))
+            self._opened = True
+        elif self._pending:
+            self._target.write(">")
+            self._pending = False
+
+
+class _TextSink:
+    """Text sink passing the text chunks to an HSDXMLFormatter."""
+
+    def __init__(self, formatter):
+        self.feed = formatter._textchunk
+
+
+class HSDXMLParser:
+    """Event based parser for XML representations of HSD documents.
+
+    It has the same interface as HSDParser, so it can be used as parser for an
+    HSDStreamFormatter or an HSDTreeBuilder. The XML input is read chunk by
+    chunk and the events of the underlying XML parser are turned directly into
+    HSD events without building XML elements. The text of an element may be
+    passed in several chunks to text_handler(). Leading and trailing
+    whitespace of the text (and text consisting of whitespace only) is
+    dropped.
+    """
+
+    def start_handler(self, tagname, options, hsdoptions):
+        pass
+
+    def close_handler(self, tagname):
+        pass
+
+    def text_handler(self, text):
+        pass
+
+    def array_handler(self, array):
+        pass
+
+    def feed(self, fileobj):
+        """Feeds the parser with data.
+
+        Args:
+            fileobj: Binary file like object or name of a file containing the
+                data.
+        """
+        isfilename = isinstance(fileobj, str)
+        fp = open(fileobj, "rb") if isfilename else fileobj
+        xmlparser = etree.XMLParser(target=_XMLTarget(self))
+        try:
+            while True:
+                chunk = fp.read(_CHUNKSIZE)
+                if not chunk:
+                    break
+                xmlparser.feed(chunk)
+            xmlparser.close()
+        finally:
+            if isfilename:
+                fp.close()
+
+
+class _XMLTarget:
+    """Target for the XML parser emitting the events of an HSDXMLParser."""
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._depth = 0
+        self._hastext = False     # whether text of current run was emitted
+        self._whitespace = ""     # whitespace held back from last chunk
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        self._hastext = False
+        self._whitespace = ""
+        if self._depth == 1:
+            return
+        options = OrderedDict()
+        hsdoptions = OrderedDict()
+        nsprefix = "{" + HSD_XMLNS + "}"
+        for key, value in attrib.items():
+            if key.startswith(nsprefix):
+                key = key[len(nsprefix):]
+                decoder = _DECODERS.get(key)
+                hsdoptions[key] = decoder(value) if decoder else value
+            else:
+                options[key] = value
+        self._parser.start_handler(tag, options, hsdoptions)
+
+    def data(self, data):
+        if self._depth < 2:
+            return
+        if not self._hastext:
+            data = data.lstrip()
+        stripped = data.rstrip()
+        if stripped:
+            self._parser.text_handler(self._whitespace + stripped)
+            self._whitespace = ""
+            self._hastext = True
+        self._whitespace += data[len(stripped):]
+
+    def end(self, tag):
+        if self._depth > 1:
+            self._parser.close_handler(tag)
+        self._depth -= 1
+        self._hastext = False
+        self._whitespace = ""
+
+    def close(self):
+        pass
+
+
+def hsdtoxml(fileobj, target=sys.stdout, parser=None, **options):
+    """Converts HSD input into XML.
+
+    Args:
+        fileobj: File like object or name of a file containing the HSD input.
+        target: File where the XML output is written (default: sys.stdout).
+        parser: Parser to use (default: HSDParser()).
+        **options: Further options passed to HSDXMLFormatter (roottag,
+            hsdattribs).
+    """
+    if parser is None:
+        parser = HSDParser()
+    formatter = HSDXMLFormatter(target=target, parser=parser, **options)
+    try:
+        HSDStreamFormatter(parser, formatter).feed(fileobj)
+    finally:
+        formatter.close()
+
+
+def xmltohsd(fileobj, target=sys.stdout, **options):
+    """Converts XML input into HSD.
+
+    Args:
+        fileobj: Binary file like object or name of a file containing the XML
+            input.
+        target: File where the HSD output is written (default: sys.stdout).
+        **options: Further options passed to HSDFormatter (indentstring,
+            closecomments, defattrib, compression).
+    """
+    formatter = HSDFormatter(target=target, **options)
+    try:
+        HSDStreamFormatter(HSDXMLParser(), formatter).feed(fileobj)
+    finally:
+        formatter.close()
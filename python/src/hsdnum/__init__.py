@@ -0,0 +1,38 @@
+"""Numpy based extensions of the hsd package.
+
+The objects of the top-level API are imported on first access. Numpy itself is
+only imported when an array is converted, read or written.
+"""
+import importlib
+
+# Objects of the top-level API and the modules defining them
+_API = {
+    "HSDArray": "hsdnum.converter",
+    "HSDArrayUnit": "hsdnum.converter",
+    "HSDTable": "hsdnum.converter",
+    "hsdfloatarray": "hsdnum.converter",
+    "hsdintarray": "hsdnum.converter",
+    "getarraypayload": "hsdnum.converter",
+    "ArraySink": "hsdnum.sink",
+    "SidecarArrayWriter": "hsdnum.sidecar",
+    "loadbinaryinclude": "hsdnum.sidecar",
+}
+
+_SUBMODULES = frozenset([ "converter", "sidecar", "sink" ])
+
+__all__ = list(_API)
+
+
+def __getattr__(name):
+    modname = _API.get(name)
+    if modname is not None:
+        value = getattr(importlib.import_module(modname), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module("hsdnum." + name)
+    raise AttributeError("module 'hsdnum' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_API) | _SUBMODULES)
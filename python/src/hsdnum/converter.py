@@ -1,10 +1,10 @@
-from hsd.converter import HSDConverter, ATTR_UNIT
+from hsd.converter import HSDConverter, ATTR_UNIT, unitconversion
+from hsd.converter import _invalidunit
 from hsd.common import *
-from hsd.tree import Element
-import numpy as np
+from hsdnum.sidecar import loadbinaryinclude
 
-__all__ = [ "HSDArray", "HSDArrayUnit",
-            "hsdfloatarray", "hsdintarray" ]
+__all__ = [ "HSDArray", "HSDArrayUnit", "HSDTable",
+            "hsdfloatarray", "hsdintarray", "getarraypayload" ]
 
 ###########################################################################
 # Converter
@@ -24,10 +24,16 @@ class HSDArray(HSDConverter):
         self.setallowedattribs([])
 
     def fromhsd(self, node):
+        import numpy as np
         self.checkattributes(node)
+        array = getarraypayload(node)
+        if array is not None:
+            return np.asanyarray(array, dtype=self.dtype).reshape(self.shape)
         return np.array(node.text.split(), dtype=self.dtype).reshape(self.shape)
 
     def tohsd(self, tag, value, attrib):
+        import numpy as np
+        from hsd.tree import Element
         node = Element(tag, attrib)
         tmp = np.array(value)
         tmp2 = tmp.reshape(( tmp.shape[0], -1))
@@ -39,7 +45,12 @@ class HSDArray(HSDConverter):
 
        
 class HSDArrayUnit(HSDArray):
-    """Converter for numpy arrays with units."""
+    """Converter for numpy arrays with units.
+    
+    If the unit converter is able to provide the conversion factor and offset
+    for a unit (see hsd.converter.unitconversion), the conversion is applied
+    in place on the entire array.
+    """
     
     def __init__(self, dtype, converter, shape=(-1,), unitattrib=ATTR_UNIT):
         """Initializes a list converter.
@@ -57,18 +68,224 @@ class HSDArrayUnit(HSDArray):
         self.setallowedattribs([ unitattrib, ])
         
     def fromhsd(self, node):
-        array = super().fromhsd(self, node)
+        array = super().fromhsd(node)
         unit = node.get(self.unitattrib, None)
-        if unit:
-            return self.unitconverter(array, unit)
-        else:
+        if not unit:
             return array
+        conversion = unitconversion(self.converter, unit, node)
+        if conversion is None:
+            try:
+                return self.converter(array, unit)
+            except KeyError:
+                raise _invalidunit(node, unit)
+        factor, offset = conversion
+        if node.hsdattrib and HSDATTR_ARRAY in node.hsdattrib:
+            # Array belongs to the node, it must not be changed in place.
+            return array * factor + offset
+        if array.dtype.kind not in "fc":
+            array = array.astype(float)
+        array *= factor
+        if offset:
+            array += offset
+        return array
+
+
+class HSDTable(HSDConverter):
+    """Converter for tables with columns of different types.
+    
+    Every row of the table is written in a separate line, the columns are
+    separated by whitespace (e.g. "symbol x y z" tables for geometries). The
+    entire table is converted in one go, without creating Python objects for
+    the individual rows. Tables with one row per line are parsed directly by
+    numpy.loadtxt(). Otherwise (rows spanning several lines) or on errors the
+    text is split into words, which are converted column by column.
+    """
+    
+    def __init__(self, columns, structured=True, codes=None, formats=None):
+        """Initializes a table converter.
+        
+        Args:
+            columns: List of (name, type) or (name, type, width) tuples
+                describing the columns. Type can be str, int, float or any
+                other numpy data type. If width is specified, the given number
+                of consecutive columns are stored in one 2D field.
+            structured: If True, the table is returned as numpy structured
+                array, otherwise as dictionary of arrays with the column names
+                as keys. (default: True)
+            codes: Name of a str column, whose entries should be replaced by
+                integer codes numbering the distinct entries in the order of
+                their first occurrence. If set, the converted value is the
+                tuple (table, names) with names being the list of the distinct
+                entries. (default: None)
+            formats: Dictionary with %-style format strings for individual
+                columns (used by tohsd()). Float columns are written with
+                "%.12E" and int columns with "%d" by default. 
+        """
+        import numpy as np
+        self.columns = []
+        for column in columns:
+            name, dtype = column[0], column[1]
+            width = column[2] if len(column) > 2 else 1
+            self.columns.append((name, np.dtype(dtype), width))
+        self.ncol = sum([ width for name, dtype, width in self.columns ])
+        self.structured = structured
+        self.codes = codes
+        self.formats = formats or {}
+        self.setallowedattribs([])
+        
+    def fromhsd(self, node):
+        import numpy as np
+        self.checkattributes(node)
+        columns = self._loadcolumns(node.text)
+        if columns is None:
+            columns = self._splitcolumns(node)
+        fields = []
+        names = None
+        for name, dtype, width in self.columns:
+            fieldvalue = columns[name]
+            if name == self.codes:
+                fieldvalue, names = self._encode(fieldvalue)
+            fields.append((name, fieldvalue))
+        if self.structured:
+            table = np.empty(len(fields[0][1]) if fields else 0,
+                             dtype=[ (name, value.dtype, value.shape[1:])
+                                     for name, value in fields ])
+            for name, value in fields:
+                table[name] = value
+        else:
+            table = dict(fields)
+        if self.codes is not None:
+            return table, names
+        return table
+
+    def _loadcolumns(self, text):
+        """Parses a table with one row per line directly with numpy.
+
+        Returns:
+            Dictionary with the columns by name or None, if the text is empty,
+            its lines are not the rows of the table or it contains invalid
+            values (so that it should be parsed by _splitcolumns()).
+        """
+        import io
+        import numpy as np
+        if not text or text.isspace():
+            return None
+        # Strings are read as objects, as their length is not known
+        dtype = [ (name, object if dtype.kind == "U" else dtype,
+                   (width,) if width > 1 else ())
+                  for name, dtype, width in self.columns ]
+        try:
+            rows = np.loadtxt(io.StringIO(text), dtype=dtype, comments=None,
+                              ndmin=1)
+        except (ValueError, OverflowError):
+            return None
+        return dict([ (name, rows[name].astype(str) if dtype.kind == "U"
+                       else rows[name])
+                      for name, dtype, width in self.columns ])
+
+    def _splitcolumns(self, node):
+        """Parses a table by splitting its text into words.
+
+        It also handles rows spanning several lines.
+
+        Returns:
+            Dictionary with the columns by name.
+        """
+        import numpy as np
+        words = node.text.split() if node.text else []
+        if len(words) % self.ncol:
+            raise HSDInvalidTagValueException(node=node, msg="Number of entries"
+                " in tag '{}' is not a multiple of {}.".format(node.tag,
+                                                                self.ncol))
+        cells = np.array(words, dtype=str).reshape((-1, self.ncol))
+        columns = {}
+        icol = 0
+        for name, dtype, width in self.columns:
+            cols = cells[:,icol] if width == 1 else cells[:,icol:icol+width]
+            icol += width
+            if dtype.kind != "U":
+                try:
+                    cols = cols.astype(dtype)
+                except (ValueError, OverflowError):
+                    raise HSDInvalidTagValueException(node=node, msg="Invalid "
+                        "value in column '{}' of tag '{}'.".format(name,
+                                                                   node.tag))
+            columns[name] = cols
+        return columns
+            
+    def tohsd(self, tag, value, attrib):
+        import numpy as np
+        from hsd.tree import Element
+        if self.codes is not None:
+            value, names = value
+            names = np.array(names, dtype=str)
+        rows = None
+        for name, dtype, width in self.columns:
+            cols = np.asarray(value[name])
+            if name == self.codes:
+                cols = names[cols]
+            else:
+                cols = self._formatcolumn(name, cols.astype(dtype, copy=False))
+            if width == 1:
+                cols = cols.reshape((-1, 1))
+            for icol in range(width):
+                if rows is None:
+                    rows = cols[:,icol]
+                else:
+                    rows = np.char.add(np.char.add(rows, " "), cols[:,icol])
+        node = Element(tag, attrib)
+        node.text = "\n".join(rows.tolist()) if rows is not None else ""
+        return node
+    
+    def _formatcolumn(self, name, cols):
+        """Converts the values of a column to strings."""
+        import numpy as np
+        fmt = self.formats.get(name)
+        if fmt is None:
+            if cols.dtype.kind == "U":
+                return cols
+            elif cols.dtype.kind == "f":
+                fmt = "%.12E"
+            elif cols.dtype.kind in "iu":
+                fmt = "%d"
+            else:
+                return cols.astype(str)
+        return np.char.mod(fmt, cols)
+        
+    @staticmethod
+    def _encode(cols):
+        """Replaces strings by integer codes in order of first occurrence."""
+        import numpy as np
+        uniques, first, inverse = np.unique(cols, return_index=True,
+                                            return_inverse=True)
+        order = np.argsort(first)
+        ranks = np.empty(len(order), dtype=int)
+        ranks[order] = np.arange(len(order))
+        return ranks[inverse.reshape(cols.shape)], uniques[order].tolist()
 
         
 ###########################################################################
 # Convenience functions
 ###########################################################################
 
+def getarraypayload(node):
+    """Returns the array payload of a node.
+    
+    Args:
+        node: HSD node.
+        
+    Returns:
+        The array stored in the hsd attributes of the node (e.g. by an
+        ArraySink) or None, if the node has no array payload. Arrays in binary
+        files are returned as read-only memory mapped arrays.
+    """
+    if not node.hsdattrib:
+        return None
+    array = node.hsdattrib.get(HSDATTR_ARRAY)
+    if isinstance(array, HSDBinaryInclude):
+        return loadbinaryinclude(array)
+    return array
+
 def hsdfloatarray(shape=(-1,)):
     return HSDArray(float, shape)
 
@@ -0,0 +1,67 @@
+"""Arrays stored in binary sidecar files next to the HSD input."""
+import os.path
+from hsd.common import HSDBinaryInclude
+
+__all__ = [ "loadbinaryinclude", "SidecarArrayWriter" ]
+
+
+def loadbinaryinclude(include):
+    """Maps the array referenced by a binary include into memory.
+
+    Args:
+        include: HSDBinaryInclude instance.
+
+    Returns:
+        Read-only memory mapped array.
+    """
+    import numpy as np
+    if include.dtype is None:
+        return np.load(include.fname, mmap_mode="r")
+    array = np.memmap(include.fname, dtype=include.dtype, mode="r")
+    if include.shape is not None:
+        array = array.reshape(include.shape)
+    return array
+
+
+class SidecarArrayWriter:
+    """Stores large array payloads in .npy files when writing a tree.
+
+    Instances can be passed as arraywriter to HSDTree.writehsd().
+    """
+
+    def __init__(self, prefix, threshold=1000):
+        """Initializes a SidecarArrayWriter instance.
+
+        Args:
+            prefix: Prefix of the file names. The files are called
+                <prefix><tag>.npy, with a running number appended to the tag
+                name if necessary to make the names unique.
+            threshold: Arrays with at least that many elements are written to
+                sidecar files, smaller ones are kept as text. (default: 1000)
+        """
+        self.prefix = prefix
+        self.threshold = threshold
+        self.fnames = []
+
+    def __call__(self, node, array):
+        """Writes an array to a sidecar file if it is large enough.
+
+        Args:
+            node: Node containing the array.
+            array: The array payload of the node.
+
+        Returns:
+            HSDBinaryInclude instance referencing the file or None, if the
+            array should be written as text.
+        """
+        if array.size < self.threshold:
+            return None
+        fname = self.prefix + node.tag + ".npy"
+        ii = 0
+        while fname in self.fnames or os.path.exists(fname):
+            ii += 1
+            fname = "{}{}{:d}.npy".format(self.prefix, node.tag, ii)
+        import numpy as np
+        np.save(fname, array)
+        self.fnames.append(fname)
+        return HSDBinaryInclude(fname)
@@ -0,0 +1,80 @@
+"""Sinks converting the text of tags into arrays while it is being parsed."""
+from hsd.common import HSDParserError
+import numpy as np
+
+__all__ = [ "ArraySink" ]
+
+
+class ArraySink:
+    """Sink storing streamed text as numpy array.
+
+    The text is converted batchwise and the values are appended to a buffer
+    growing on demand. The text of the tag is therefore never kept in memory
+    as a whole. Use it with HSDParser.settextsink() or
+    HSDTreeBuilder.registersink().
+    """
+
+    def __init__(self, dtype=float, shape=(-1,), batchsize=65536):
+        """Initializes an ArraySink instance.
+
+        Args:
+            dtype: Numpy data type of the array. (default: float)
+            shape: Shape of the resulting array. (default: (-1,))
+            batchsize: Nr. of characters to collect before converting them.
+        """
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+        self.batchsize = batchsize
+        self._data = np.empty(0, dtype=self.dtype)
+        self._size = 0
+        self._batch = []
+        self._batchlen = 0
+
+    def feed(self, text):
+        """Feeds the sink with text.
+
+        Args:
+            text: Text containing complete whitespace separated values.
+        """
+        self._batch.append(text)
+        self._batchlen += len(text)
+        if self._batchlen >= self.batchsize:
+            self._flush()
+
+    def close(self):
+        """Finishes the conversion.
+
+        Returns:
+            The array with all values fed into the sink.
+
+        Raises:
+            HSDParserError: if the values can not be converted or the array
+                can not be brought to the desired shape.
+        """
+        self._flush()
+        data = self._data
+        data.resize(self._size, refcheck=False)
+        self._data = np.empty(0, dtype=self.dtype)
+        self._size = 0
+        try:
+            return data.reshape(self.shape)
+        except ValueError:
+            raise HSDParserError("Array with {} elements can not be reshaped "
+                                 "to {}.".format(len(data), self.shape))
+
+    def _flush(self):
+        """Converts the collected text and appends the values to the buffer."""
+        if not self._batch:
+            return
+        try:
+            values = np.array(" ".join(self._batch).split(), dtype=self.dtype)
+        except ValueError:
+            raise HSDParserError("Invalid value in array data.")
+        self._batch = []
+        self._batchlen = 0
+        newsize = self._size + len(values)
+        if newsize > len(self._data):
+            self._data.resize(max(newsize, 3 * len(self._data) // 2),
+                              refcheck=False)
+        self._data[self._size:newsize] = values
+        self._size = newsize
@@ -0,0 +1,45 @@
+import os
+import sys
+import subprocess
+
+# Modules timed and their maximal import time in ms
+MODULES = [ ("hsd", 50.0), ("hsd.query", 50.0), ("hsd.converter", 50.0),
+            ("hsdnum.converter", 60.0) ]
+
+# Modules which must not be loaded when importing the modules above
+HEAVY = [ "numpy", "xml.etree.ElementTree", "json", "shlex" ]
+
+def importtime(module):
+    """Returns the cumulative import time of a module in a fresh interpreter
+    in ms and the heavy modules it loaded."""
+    script = ("import sys, {}; print(' '.join(name for name in {!r} "
+              "if name in sys.modules))".format(module, HEAVY))
+    result = subprocess.run([ sys.executable, "-X", "importtime", "-c",
+                              script ], env=os.environ,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return float(fields[1]) / 1000.0, result.stdout.split()
+    raise RuntimeError("No import time found for " + module)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    failed = False
+    print("{:20s} {:>10s} {:>10s}  {}".format("module", "time [ms]",
+                                              "limit", "heavy imports"))
+    for module, limit in MODULES:
+        results = [ importtime(module) for ii in range(repeat) ]
+        time = min([ time for time, heavy in results ])
+        heavy = results[0][1]
+        ok = time <= limit * scale and not heavy
+        failed = failed or not ok
+        print("{:20s} {:10.2f} {:10.2f}  {}{}".format(
+            module, time, limit * scale, " ".join(heavy) or "-",
+            "" if ok else "  FAILED"))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import gc
+import sys
+import tracemalloc
+from hsd.common import HSDInterner
+from hsd.treebuilder import HSDTreeBuilder
+
+# Interners passed to the builders (False: no interning, None: new interner for
+# each document, "shared": one interner for the entire batch)
+MODES = [ ("none", False), ("document", None), ("shared", "shared") ]
+
+def buildall(fnames, ncopies, interner):
+    """Builds the trees of all files (each ncopies times)."""
+    if interner == "shared":
+        interner = HSDInterner()
+    trees = []
+    for ii in range(ncopies):
+        for fname in fnames:
+            trees.append(HSDTreeBuilder(interner=interner).build(fname))
+    return trees
+
+def main():
+    fnames = sys.argv[1:]
+    ncopies = 1
+    if fnames[-1].isdigit():
+        ncopies = int(fnames.pop())
+    print("{:12s} {:>14s} {:>10s}".format("interning", "memory [kB]", "saved"))
+    reference = None
+    for name, interner in MODES:
+        gc.collect()
+        tracemalloc.start()
+        trees = buildall(fnames, ncopies, interner)
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del trees
+        if reference is None:
+            reference = memory
+        print("{:12s} {:14.1f} {:9.1f}%".format(
+            name, memory / 1024, 100.0 * (reference - memory) / reference))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.stderr.write("Script needs at least one argument (the input files"
+                         " to be used, optionally followed by the number of"
+                         " copies to build)!\n")
+        sys.exit()
+    main()
@@ -0,0 +1,34 @@
+import io
+import sys
+import timeit
+from hsd.treebuilder import HSDTreeBuilder, HSDDirectTreeBuilder
+from hsd.events import HSDEventRecorder, HSDEventReplayer
+
+BUILDERS = [ HSDTreeBuilder, HSDDirectTreeBuilder ]
+
+def main():
+    fp = open(sys.argv[1], "r")
+    text = fp.read()
+    fp.close()
+    if len(sys.argv) > 2:
+        repeat = int(sys.argv[2])
+    else:
+        repeat = 5
+    recording = HSDEventRecorder().record(io.StringIO(text))
+    print("{:24s} {:>12s} {:>12s}".format("builder", "parse [s]", "replay [s]"))
+    for builder in BUILDERS:
+        parsetime = min(timeit.repeat(
+            lambda: builder().build(io.StringIO(text)),
+            number=1, repeat=repeat))
+        replaytime = min(timeit.repeat(
+            lambda: builder(parser=HSDEventReplayer()).build(recording),
+            number=1, repeat=repeat))
+        print("{:24s} {:12.4f} {:12.4f}".format(builder.__name__, parsetime,
+                                                 replaytime))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.stderr.write("Script needs at least one argument (the input file to"
+                         " be used for benchmarking)!\n")
+        sys.exit()
+    main()
@@ -1,7 +1,27 @@
 import unittest
 import test_parser
 import test_formatter
+import test_converter
+import test_tree
+import test_xmlstream
+import test_dicts
+import test_index
+import test_corpus
+import test_aio
+import test_shared
+import test_validator
+import test_server
 
 runner = unittest.TextTestRunner()
 runner.run(unittest.TestSuite(test_parser.getsuites()
-                              + test_formatter.getsuites()))
+                              + test_formatter.getsuites()
+                              + test_converter.getsuites()
+                              + test_tree.getsuites()
+                              + test_xmlstream.getsuites()
+                              + test_dicts.getsuites()
+                              + test_index.getsuites()
+                              + test_corpus.getsuites()
+                              + test_aio.getsuites()
+                              + test_shared.getsuites()
+                              + test_validator.getsuites()
+                              + test_server.getsuites()))
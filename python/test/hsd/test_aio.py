@@ -0,0 +1,198 @@
+import unittest
+import io
+import asyncio
+from hsd.common import *
+from hsd.formatter import HSDFormatter
+from hsd.aio import AsyncHSDParser, AsyncTarget, buildtree, formathsd, writehsd
+from hsd.parser import HSDParser
+from hsd.tree import HSDTree
+from test_tree import HSDINPUT
+import test_tree
+
+
+async def _chunks(data, size):
+    for pos in range(0, len(data), size):
+        yield data[pos:pos + size]
+
+
+def _tohsd(root):
+    stream = io.StringIO()
+    HSDTree(root).writehsd(HSDFormatter(target=stream))
+    return stream.getvalue()
+
+
+class _Writer:
+    """Mimics a StreamWriter, recording the data and the drain calls."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+
+class AsyncParserTestCase(unittest.TestCase):
+    """Tests parsing of asynchronous sources."""
+
+    def testStreamReader(self):
+        data = ("# äöü\r\n" + HSDINPUT).encode("utf-8")
+
+        async def parse():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await buildtree(reader)
+
+        root = asyncio.run(parse())
+        reference = test_tree.buildtree("\n" + HSDINPUT)
+        self.assertEqual(_tohsd(root), _tohsd(reference))
+        self.assertEqual(root.fingerprint(), reference.fingerprint())
+        self.assertEqual(root.find("Hamiltonian").hsdattrib[HSDATTR_LINE],
+                         reference.find("Hamiltonian").hsdattrib[HSDATTR_LINE])
+
+    def testChunks(self):
+        # Chunks splitting lines and multibyte characters
+        data = ("A = äöü\n" + HSDINPUT).encode("utf-8")
+        root = asyncio.run(buildtree(
+            _chunks(data, 5), parser=AsyncHSDParser(yieldinterval=2)))
+        self.assertEqual(root.find("A").text, "äöü")
+        root = asyncio.run(buildtree(_chunks(HSDINPUT, 7)))
+        self.assertEqual(_tohsd(root), _tohsd(test_tree.buildtree()))
+
+    def testEvents(self):
+        async def collect():
+            parser = AsyncHSDParser()
+            return [ event async for event
+                     in parser.events(_chunks("A {\n  B = 1\n}\n", 3)) ]
+
+        events = asyncio.run(collect())
+        self.assertEqual([ event[:2] for event in events ],
+                         [ ("start", "A"), ("start", "B"), ("text", "1"),
+                           ("close", "B"), ("close", "A") ])
+
+    def testEventsTick(self):
+        ticks = []
+
+        async def tick():
+            ticks.append(len(ticks))
+
+        async def collect():
+            parser = AsyncHSDParser(yieldinterval=2)
+            return [ event async for event
+                     in parser.events(_chunks(HSDINPUT, 10), tick=tick) ]
+
+        asyncio.run(collect())
+        self.assertEqual(len(ticks), HSDINPUT.count("\n") // 2)
+
+    def testIncludes(self):
+        files = { "inc.hsd": "C {\n  <<< \"text.txt\"\n}\n",
+                  "text.txt": "included text" }
+        loaded = []
+
+        async def loader(fname):
+            loaded.append(fname)
+            if fname not in files:
+                raise OSError(fname)
+            return files[fname]
+
+        source = "# <<! missing.hsd\nA {\n  <<! inc.hsd\n}\n"
+        root = asyncio.run(buildtree(_chunks(source, 4),
+                                     parser=AsyncHSDParser(loader=loader)))
+        self.assertEqual(root.find("A/C").text, "included text")
+        self.assertEqual(sorted(loaded), [ "inc.hsd", "missing.hsd",
+                                           "text.txt" ])
+        parser = AsyncHSDParser(loader=loader)
+        self.assertRaises(OSError, asyncio.run,
+                          buildtree(_chunks("A {\n  <<< missing.txt\n}\n", 4),
+                                    parser=parser))
+
+    def testNestedIncludes(self):
+        files = { "inc.hsd": "B {\n  <<! inc2.hsd\n}\nC = 1\n",
+                  "inc2.hsd": "D = 2\n" }
+
+        async def loader(fname):
+            return files[fname]
+
+        parser = AsyncHSDParser(loader=loader)
+        positions = {}
+        parser.start_handler = lambda tagname, *args: positions.setdefault(
+            tagname, parser.tagposition())
+        asyncio.run(parser.feed_async(_chunks("A {\n  <<! inc.hsd\n}\n", 4)))
+        self.assertEqual(positions, { "A": (0, 0), "B": (0, 0), "D": (0, 0),
+                                      "C": (3, 0) })
+
+    def testNestedIncludeLevels(self):
+        files = { "inc.hsd": "B {\n  <<! inc2.hsd\n}\nC = 1\n",
+                  "inc2.hsd": "D = 2\n" }
+
+        async def loader(fname):
+            return files[fname]
+
+        parser = AsyncHSDParser(loader=loader)
+        states = {}
+        parser.start_handler = lambda tagname, *args: states.setdefault(
+            tagname, (parser.includelevel(), parser.currentfile(),
+                      parser.depth()))
+        parser.setposition("main.hsd")
+        asyncio.run(parser.feed_async(_chunks("A {\n  <<! inc.hsd\n}\n", 4)))
+        self.assertEqual(states, { "A": (0, "main.hsd", 0),
+                                   "B": (1, "inc.hsd", 1),
+                                   "D": (2, "inc2.hsd", 2),
+                                   "C": (1, "inc.hsd", 1) })
+
+    def testLineEndings(self):
+        text = "A {\r\n  B = 1\x0c2\r\n}\r\n}\r\nC = \u2028\r\nD {\r\n"
+        data = text.encode("utf-8")
+        # Chunks ending right after each "\r"
+        bounds = [ 0 ] + [ ii + 1 for ii, byte in enumerate(data)
+                           if byte == ord("\r") ] + [ len(data) ]
+        chunks = [ data[start:end] for start, end in zip(bounds, bounds[1:]) ]
+
+        async def source():
+            for chunk in chunks:
+                yield chunk
+
+        parser = AsyncHSDParser(recover=True)
+        asyncio.run(parser.feed_async(source()))
+        reference = HSDParser(recover=True)
+        reference.feed(io.BytesIO(data))
+        self.assertTrue(reference.errors)
+        self.assertEqual(
+            [ (error.code, error.lines) for error in parser.errors ],
+            [ (error.code, error.lines) for error in reference.errors ])
+
+
+class AsyncTargetTestCase(unittest.TestCase):
+    """Tests formatting into asynchronous targets."""
+
+    def testWriteHSD(self):
+        root = test_tree.buildtree()
+        writer = _Writer()
+        asyncio.run(writehsd(HSDTree(root), AsyncTarget(writer, highwater=16),
+                             yieldinterval=1))
+        self.assertEqual(writer.data.decode("utf-8"), _tohsd(root))
+        self.assertGreater(writer.drains, 1)
+
+    def testFormatHSD(self):
+        writer = _Writer()
+        asyncio.run(formathsd(_chunks(HSDINPUT, 10),
+                              AsyncTarget(writer, highwater=0),
+                              parser=AsyncHSDParser(yieldinterval=1)))
+        self.assertEqual(writer.data.decode("utf-8"),
+                         _tohsd(test_tree.buildtree()))
+        self.assertGreater(writer.drains, 1)
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(AsyncParserTestCase, 'test'),
+             unittest.makeSuite(AsyncTargetTestCase, 'test') ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,104 @@
+import unittest
+import os
+import sys
+import subprocess
+from hsd.common import *
+from hsd.tree import Element
+from hsd.converter import *
+
+
+class UnitConverterTestCase(unittest.TestCase):
+    """Tests the unit converters and the unit aware list converter."""
+
+    def setUp(self):
+        self.energy = MultiplicativeUnitConverter(
+            { "eV": 0.5, "AA": 2.0, "kcal": 3.0, "mol": 4.0 })
+        self.temperature = AffineUnitConverter(
+            { "Kelvin": (1.0, 0.0), "Celsius": (1.0, 273.15) })
+
+    def _node(self, text, unit=None):
+        node = Element("test", { "unit": unit } if unit else {})
+        node.text = text
+        return node
+
+    def testSimpleUnit(self):
+        self.assertEqual(self.energy(3.0, "eV"), 1.5)
+        self.assertEqual(self.energy.getconversion("AA"), (2.0, 0.0))
+
+    def testCompoundUnit(self):
+        self.assertEqual(self.energy.getfactor("eV/AA"), 0.25)
+        self.assertEqual(self.energy.getfactor("kcal / mol"), 0.75)
+        self.assertEqual(self.energy.getfactor("eV*AA^2"), 2.0)
+        self.assertEqual(self.energy.getfactor("1/AA^-1"), 2.0)
+        self.assertRaises(KeyError, self.energy.getfactor, "eV/bohr")
+
+    def testListConversion(self):
+        converter = HSDListUnit(TxtFloat(), self.energy)
+        self.assertEqual(converter.fromhsd(self._node("1.0 2.0")), [1.0, 2.0])
+        self.assertEqual(converter.fromhsd(self._node("1.0 2.0", "eV/AA")),
+                         [0.25, 0.5])
+
+    def testAffineListConversion(self):
+        converter = HSDListUnit(TxtFloat(), self.temperature, nitem=2)
+        self.assertEqual(converter.fromhsd(self._node("0.0 10.0", "Celsius")),
+                         [273.15, 283.15])
+
+    def testInvalidUnit(self):
+        converter = HSDListUnit(TxtFloat(), self.energy)
+        self.assertRaises(HSDInvalidAttributeValueException, converter.fromhsd,
+                          self._node("1.0", "Hartree"))
+
+    def testCallableUnitConverter(self):
+        converter = HSDScalarUnit(TxtFloat(), lambda value, unit: 2 * value)
+        self.assertEqual(converter.fromhsd(self._node("1.5", "any")), 3.0)
+
+    def testNodeWithoutText(self):
+        node = self._node(None)
+        self.assertEqual(hsdfloatlist().fromhsd(node), [])
+        self.assertRaises(HSDInvalidTagValueException, hsdfloat.fromhsd, node)
+        node.hsdattrib[HSDATTR_ARRAY] = [ 1.0, 2.0 ]
+        for converter in [ hsdfloat, hsdstr, hsdfloatlist() ]:
+            self.assertRaises(HSDInvalidTagValueException, converter.fromhsd,
+                              node)
+
+
+def loadedmodules(script, modules):
+    """Returns those of the modules loaded after running a script in a fresh
+    interpreter."""
+    script += ("\nimport sys\nprint(' '.join(name for name in {!r} "
+               "if name in sys.modules))".format(modules))
+    output = subprocess.check_output([ sys.executable, "-c", script ],
+                                     env=os.environ, universal_newlines=True)
+    return output.split()
+
+
+class LazyImportTestCase(unittest.TestCase):
+    """Tests that light-weight modules do not pull in the entire package."""
+
+    def testQueryAndConverter(self):
+        self.assertEqual(loadedmodules(
+            "import hsd.query, hsd.converter",
+            [ "xml.etree.ElementTree", "json", "shlex", "hsd.parser",
+              "numpy" ]), [])
+        self.assertEqual(loadedmodules(
+            "import hsd\nhsd.to_json\nhsd.converter.hsdfloat",
+            [ "hsd.dicts", "hsd.converter", "hsd.index" ]),
+            [ "hsd.dicts", "hsd.converter" ])
+
+    def testTopLevelAPI(self):
+        import hsd
+        from hsd.parser import HSDParser
+        self.assertIs(hsd.HSDParser, HSDParser)
+        self.assertIn("HSDQuery", dir(hsd))
+        self.assertRaises(AttributeError, getattr, hsd, "missing")
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(UnitConverterTestCase, 'test'),
+             unittest.makeSuite(LazyImportTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+from hsd.corpus import HSDCorpus
+from test_tree import HSDINPUT
+
+
+class CorpusTestCase(unittest.TestCase):
+    """Tests the searchable index of many HSD files."""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._fnames = []
+        for ii, (mixer, tolerance) in enumerate([ ("Broyden", "1.0E-007"),
+                                                  ("Anderson", "1.0E-009"),
+                                                  ("Anderson", "1.0E-007") ]):
+            text = HSDINPUT.replace("Broyden", mixer).replace("1.0E-007",
+                                                              tolerance)
+            self._fnames.append(self._write("deck{:d}.hsd".format(ii), text))
+        self._write("broken.hsd", "A {")
+        self._corpus = HSDCorpus(os.path.join(self._tmpdir.name, "corpus.db"))
+
+    def tearDown(self):
+        self._corpus.close()
+        self._tmpdir.cleanup()
+
+    def _write(self, name, text):
+        fname = os.path.join(self._tmpdir.name, name)
+        fp = open(fname, "w")
+        fp.write(text)
+        fp.close()
+        return fname
+
+    def testQueries(self):
+        fnames = self._fnames + [ os.path.join(self._tmpdir.name,
+                                               "broken.hsd") ]
+        self.assertEqual(len(self._corpus.update(fnames, processes=2)), 4)
+        self.assertEqual(self._corpus.update(fnames), [])
+        self.assertEqual([ name for name, _ in self._corpus.errors() ],
+                         [ fnames[-1] ])
+        self.assertEqual(
+            self._corpus.files("Hamiltonian/DFTB/Mixer/Anderson",
+                               ("Hamiltonian/DFTB/SCCTolerance", "<", 1e-8)),
+            [ self._fnames[1] ])
+        self.assertEqual(self._corpus.files("*/Mixer/Anderson"),
+                         self._fnames[1:])
+        self.assertEqual(self._corpus.find("*/Temperature", "=", "1.0E-006"),
+                         [ (fname, 11, "1.0E-006") for fname in self._fnames ])
+
+    def testIncrementalUpdate(self):
+        self._corpus.update(self._fnames)
+        self._write("deck0.hsd", HSDINPUT.replace("Broyden", "Anderson"))
+        os.utime(self._fnames[0], ns=(0, 0))
+        self.assertEqual(self._corpus.update(self._fnames),
+                         [ self._fnames[0] ])
+        self.assertEqual(len(self._corpus.files("*/Mixer/Anderson")), 3)
+        os.remove(self._fnames[2])
+        self.assertEqual(self._corpus.prune(), [ self._fnames[2] ])
+        self.assertEqual(len(self._corpus.files("*/Mixer/Anderson")), 2)
+
+    def testMissingFiles(self):
+        self._corpus.update(self._fnames)
+        os.remove(self._fnames[1])
+        missing = os.path.join(self._tmpdir.name, "missing.hsd")
+        self.assertEqual(self._corpus.update(self._fnames + [ missing ]), [])
+        self.assertEqual(self._corpus.files("*/Mixer/Anderson"),
+                         [ self._fnames[2] ])
+        self.assertEqual(self._corpus.errors(), [])
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(CorpusTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,75 @@
+import unittest
+import io
+import json
+import hsd
+from hsd.common import *
+from hsd.converter import TxtBool, TxtFloat, TxtInt
+from hsd.formatter import HSDFormatter
+from test_tree import HSDINPUT, buildtree
+
+
+class DictTestCase(unittest.TestCase):
+    """Tests the conversion between HSD and dictionaries."""
+
+    def testToDict(self):
+        data = hsd.to_dict(io.StringIO(HSDINPUT + "Options {\n  A = 1\n}\n"))
+        dftb = data["Hamiltonian"]["DFTB"]
+        self.assertEqual(dftb["SCC"], "Yes")
+        self.assertIsNone(dftb["Mixer"]["Broyden"])
+        self.assertEqual(dftb["Filling"]["Fermi"]["Temperature"],
+                         { "@default": "Kelvin", "#text": "1.0E-006" })
+        self.assertEqual(data["Options"], [ { "WriteHS": "No" },
+                                            { "A": "1" } ])
+
+    def testConverters(self):
+        converters = { "SCC": TxtBool(), "WriteHS": TxtBool(),
+                       "Hamiltonian/DFTB/SCCTolerance": TxtFloat(),
+                       "Temperature": TxtFloat() }
+        data = hsd.to_dict(io.StringIO(HSDINPUT), converters=converters)
+        dftb = data["Hamiltonian"]["DFTB"]
+        self.assertIs(dftb["SCC"], True)
+        self.assertEqual(dftb["SCCTolerance"], 1.0E-7)
+        self.assertEqual(dftb["Filling"]["Fermi"]["Temperature"]["#text"],
+                         1.0E-6)
+        self.assertIs(data["Options"]["WriteHS"], False)
+        for text in [ "SCC = Maybe", "Temperature = high" ]:
+            self.assertRaises(HSDInvalidTagValueException, hsd.to_dict,
+                              io.StringIO(text), converters=converters)
+
+    def testRoundTrip(self):
+        data = hsd.to_dict(io.StringIO(HSDINPUT),
+                           converters={ "SCC": TxtBool() })
+        stream = io.StringIO()
+        hsd.from_dict(data, HSDFormatter(target=stream))
+        self.assertEqual(hsd.to_dict(io.StringIO(stream.getvalue()),
+                                     converters={ "SCC": TxtBool() }), data)
+        self.assertEqual(buildtree(stream.getvalue()).find(
+            "Hamiltonian/DFTB/SCC").hsdattrib[HSDATTR_EQUAL], True)
+        stream = io.StringIO()
+        hsd.from_dict({ "A": { "B": [ 1, 2 ] } }, HSDFormatter(target=stream),
+                      converters={ "A/B": TxtInt("{:03d}") })
+        self.assertEqual(stream.getvalue(), "A {\n  B = 001\n  B = 002\n}")
+
+    def testJSON(self):
+        reference = hsd.to_dict(io.StringIO(HSDINPUT))
+        self.assertEqual(json.loads(hsd.to_json(io.StringIO(HSDINPUT))),
+                         reference)
+        stream = io.StringIO()
+        hsd.to_json(io.StringIO(HSDINPUT), stream, indent=2)
+        self.assertEqual(json.loads(stream.getvalue()), reference)
+        stream = io.StringIO()
+        hsd.to_json(io.StringIO("A = 1\nA = 2\nB {}\n"), stream)
+        self.assertEqual(json.loads(stream.getvalue()),
+                         { "A": [ "1", "2" ], "B": None })
+        self.assertRaises(HSDException, hsd.to_json,
+                          io.StringIO("A = 1\nB = 2\nA = 3\n"), io.StringIO())
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(DictTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -1,6 +1,10 @@
 import unittest
 import io
 from hsd.formatter import HSDFormatter
+from hsd.treebuilder import HSDTreeBuilder
+from hsd.tree import HSDTree
+from hsd.template import HSDTemplate
+from hsd.converter import TxtFloat
 import hsdtests
 
 
@@ -66,11 +70,66 @@ class ExpAttribTestCase(FormatterTestCase):
         return HSDFormatter(target=stream, defattrib="default")
 
 
+class TemplateTestCase(unittest.TestCase):
+    """Checks whether templates render the same output as the formatter."""
+
+    _input = hsdtests.hsdtests_simple[3][0][0] + """
+Hamiltonian = DFTB {
+  SCCTolerance = 1.0E-007
+  Filling = Fermi {
+    Temperature [Kelvin] = 1.0E-006
+  }
+}
+"""
+    _slots = { "tol": "Hamiltonian/DFTB/SCCTolerance",
+               "temp": ("Hamiltonian/DFTB/Filling/Fermi/Temperature",
+                        TxtFloat("{:.3E}")) }
+
+    def _format(self, text, **options):
+        root = HSDTreeBuilder().build(io.StringIO(text))
+        stream = io.StringIO()
+        HSDTree(root).writehsd(HSDFormatter(target=stream, **options))
+        return stream.getvalue()
+
+    def testRender(self):
+        for options in [ {}, { "closecomments": True, "indentstring": " " } ]:
+            template = HSDTemplate.fromfile(io.StringIO(self._input),
+                                            self._slots, **options)
+            self.assertEqual(template.render({}),
+                             self._format(self._input, **options))
+            reference = self._format(self._input.replace(
+                "1.0E-007", "1e-9").replace("1.0E-006", "3.000E+02"),
+                **options)
+            self.assertEqual(template.render({ "tol": "1e-9", "temp": 300.0 }),
+                             reference)
+
+    def testEmptySlot(self):
+        text = self._input + "Options {}\n"
+        for options in [ {}, { "closecomments": True } ]:
+            template = HSDTemplate.fromfile(
+                io.StringIO(text), dict(self._slots, opts="Options"),
+                **options)
+            self.assertEqual(template.render({}), self._format(text, **options))
+            self.assertEqual(template.render({ "opts": "Yes" }),
+                             self._format(text.replace("Options {}",
+                                                       "Options { Yes }"),
+                                          **options))
+
+    def testRenderAll(self):
+        template = HSDTemplate.fromfile(io.StringIO(self._input), self._slots)
+        valuesets = [ { "tol": "1e-{:d}".format(ii) } for ii in range(5) ]
+        reference = list(template.renderall(valuesets))
+        self.assertEqual(list(template.renderall(valuesets, processes=2,
+                                                 chunksize=2)), reference)
+        self.assertEqual(reference[3].count("SCCTolerance = 1e-3"), 1)
+
+
 def getsuites():
     """Returns the test suites defined in the module."""
     return [ unittest.makeSuite(SimpleTestCase, 'test'),
             unittest.makeSuite(DefaultAttribTestCase, 'test'),
             unittest.makeSuite(ExpAttribTestCase, 'test'),
+            unittest.makeSuite(TemplateTestCase, 'test'),
             ]
 
 
@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+import hsd
+from hsd.common import *
+from hsd.index import HSDIndex, INDEX_SUFFIX
+from test_tree import HSDINPUT, buildtree
+
+
+class IndexTestCase(unittest.TestCase):
+    """Tests random access to blocks via sidecar index files."""
+
+    _input = HSDINPUT + "Options { A = 1\n}\n"
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._fname = os.path.join(self._tmpdir.name, "input.hsd")
+        fp = open(self._fname, "w")
+        fp.write(self._input)
+        fp.close()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _lines(self, node):
+        return [ elem.hsdattrib.get(HSDATTR_LINE) for elem in node.iter() ]
+
+    def testLoadBlock(self):
+        reference = buildtree(self._input)
+        for path in [ "Geometry", "Hamiltonian", "Hamiltonian/DFTB",
+                      "Options/WriteHS" ]:
+            node = hsd.load_block(self._fname, path)
+            refnode = reference.find(path)
+            self.assertEqual(node.fingerprint(), refnode.fingerprint())
+            self.assertEqual(self._lines(node), self._lines(refnode))
+        node = hsd.load_block(self._fname, "Options", occurrence=1)
+        self.assertEqual(node.find("A").text, "1")
+        self.assertEqual(node.hsdattrib[HSDATTR_LINE], 20)
+        self.assertRaises(KeyError, hsd.load_block, self._fname,
+                          "Options", 2)
+        self.assertRaises(KeyError, hsd.load_block, self._fname,
+                          "Hamiltonian/DFTB/SCC")
+
+    def testValidation(self):
+        index = HSDIndex.get(self._fname)
+        self.assertTrue(os.path.exists(self._fname + INDEX_SUFFIX))
+        self.assertEqual(HSDIndex.load(self._fname).entries, index.entries)
+        os.utime(self._fname, ns=(0, 0))
+        self.assertIsNone(HSDIndex.load(self._fname))
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(IndexTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -1,6 +1,15 @@
 import unittest
 import io
-from hsd.parser import HSDParser
+import os
+import gzip
+import bz2
+import lzma
+import tempfile
+from hsd.common import HSDInterner
+from hsd.parser import *
+from hsd.events import HSDEventRecorder, HSDEventReplayer
+from hsd.formatter import HSDFormatter, HSDStreamFormatter
+from hsd.treebuilder import HSDTreeBuilder
 import hsdtests
 
 
@@ -73,12 +82,239 @@ class ErrorTestCase(ParserTestCase):
     _tests = hsdtests.hsdtests_error
 
 
+class _RecordingParser(HSDEventReplayer):
+    """Replays the events of a saved and reloaded recording of the input."""
+
+    def feed(self, fileobj):
+        recording = HSDEventRecorder().record(fileobj)
+        stream = io.BytesIO()
+        recording.save(stream)
+        stream.seek(0)
+        super().feed(stream)
+
+
+class ReplayTestCase(ParserTestCase):
+    _tests = hsdtests.hsdtests_simple + hsdtests.hsdtests_expattr
+
+    def _launch_parser(self):
+        return _RecordingParser()
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Tests reading and writing compressed HSD files."""
+
+    _input = "A {\n  B = 1\n  C [unit=eV] = 2 3\n}"
+    _modules = { "gzip": gzip, "bz2": bz2, "xz": lzma }
+
+    def _events(self, fileobj):
+        recording = HSDEventRecorder().record(fileobj)
+        result = []
+        replayer = HSDEventReplayer()
+        replayer.start_handler = lambda *args: result.append(args[:2])
+        replayer.text_handler = result.append
+        replayer.feed(recording)
+        return result
+
+    def testCompressedInput(self):
+        reference = self._events(io.StringIO(self._input))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for suffix, module in [ (".gz", gzip), (".bz2", bz2),
+                                    (".xz", lzma) ]:
+                data = module.compress(self._input.encode())
+                fname = os.path.join(tmpdir, "input.hsd" + suffix)
+                with open(fname, "wb") as fp:
+                    fp.write(data)
+                self.assertEqual(self._events(fname), reference)
+                self.assertEqual(self._events(io.BytesIO(data)), reference)
+                # Detection by magic bytes
+                fname = os.path.join(tmpdir, "input" + suffix[1:])
+                with open(fname, "wb") as fp:
+                    fp.write(data)
+                self.assertEqual(self._events(fname), reference)
+
+    def testCompressedOutput(self):
+        for compression, module in self._modules.items():
+            stream = io.BytesIO()
+            formatter = HSDFormatter(target=stream, compression=compression)
+            HSDStreamFormatter(HSDParser(), formatter).feed(
+                io.StringIO(self._input))
+            formatter.close()
+            self.assertFalse(stream.closed)
+            self.assertEqual(module.decompress(stream.getvalue()).decode(),
+                             self._input)
+
+
+class InterningTestCase(unittest.TestCase):
+    """Tests the interning of tag names, option names and values."""
+
+    _input = ("Hamiltonian {\n  Solver [method=dense] = Yes\n"
+              "  Description = \"a rather long text, not interned\"\n}")
+
+    def _build(self, interner):
+        return HSDTreeBuilder(interner=interner).build(io.StringIO(self._input))
+
+    def testSharedInterner(self):
+        interner = HSDInterner()
+        root1, root2 = self._build(interner), self._build(interner)
+        solver1, solver2 = root1.find("Hamiltonian/Solver"), \
+            root2.find("Hamiltonian/Solver")
+        self.assertIs(root1[0].tag, root2[0].tag)
+        self.assertIs(solver1.text, solver2.text)
+        self.assertIs(list(solver1.attrib)[0], list(solver2.attrib)[0])
+        self.assertIs(solver1.get("method"), solver2.get("method"))
+        self.assertIsNot(root1.find("Hamiltonian/Description").text,
+                         root2.find("Hamiltonian/Description").text)
+
+    def testDocumentScope(self):
+        root1, root2 = self._build(None), self._build(None)
+        self.assertIsNot(root1[0].tag, root2[0].tag)
+        root1, root2 = self._build(False), self._build(False)
+        self.assertEqual(root1[0].tag, root2[0].tag)
+        self.assertIsNot(root1[0].tag, root2[0].tag)
+
+    def testValueCap(self):
+        interner = HSDInterner(maxvaluelen=3, maxvalues=1)
+        values = [ "".join(value) for value in [ "Yes", "Yes", "No", "No",
+                                                  "Long" ] ]
+        interned = [ interner.value(value) for value in values ]
+        self.assertIs(interned[1], values[0])
+        self.assertIs(interned[3], values[3])
+        self.assertIs(interner.name(values[2]), values[2])
+        self.assertIs(interner.value(values[3]), values[2])
+        self.assertIs(interned[4], values[4])
+
+
+class RecoveryTestCase(unittest.TestCase):
+    """Tests the collection of all errors in recovery mode."""
+
+    _input = ("Geometry {\n  Periodic [x = Yes\n}\nDriver = 1 }\n"
+              "Hamiltonian {\n  SCC = Yes\n}\n}\nOptions {\n")
+
+    def _parse(self, text, **kwargs):
+        parser = HSDParser(recover=True, **kwargs)
+        tags = []
+        parser.start_handler = lambda tag, options, hsdoptions: tags.append(tag)
+        parser.feed(io.StringIO(text))
+        return parser.errors, tags
+
+    def testAllErrors(self):
+        errors, tags = self._parse(self._input)
+        self.assertEqual(
+            [ (error.code, error.lines) for error in errors ],
+            [ (SYNTAX_ERROR, (1, 1)), (SYNTAX_ERROR, (3, 3)),
+              (SYNTAX_ERROR, (0, 7)), (UNCLOSED_TAG_ERROR, (8, 8)) ])
+        self.assertEqual(tags, [ "Geometry", "Driver",
+                                 "Hamiltonian", "SCC", "Options" ])
+        self.assertIsInstance(errors[0], HSDDiagnostic)
+        self.assertEqual(str(errors[-1]), "Parsing error ({}) between lines "
+                         "9 - 9 in file ''.".format(UNCLOSED_TAG_ERROR))
+
+    def testMaxErrors(self):
+        errors, tags = self._parse(self._input, maxerrors=2)
+        self.assertEqual(len(errors), 2)
+        self.assertNotIn("Hamiltonian", tags)
+
+    def testIncludedFile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "include.hsd")
+            with open(fname, "w") as fp:
+                fp.write("A = 1 }\nB = 2\n")
+            errors, tags = self._parse("<<! {}\n}}\nC {{\n".format(fname))
+            self.assertEqual([ (error.code, error.file) for error in errors ],
+                             [ (SYNTAX_ERROR, fname), (SYNTAX_ERROR, ""),
+                               (UNCLOSED_TAG_ERROR, "") ])
+            self.assertEqual(tags, [ "A", "B", "C" ])
+            errors, tags = self._parse("<<! {}\nC {{\n".format(fname),
+                                       maxerrors=1)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(tags, [ "A" ])
+
+    def testUnclosedOptionOfEqualSignTag(self):
+        for text in [ "a = [x\n", "=[\n", "a=[\nB = 1\n" ]:
+            errors, tags = self._parse(text)
+            self.assertEqual(errors[0].code, UNCLOSED_OPTION_ERROR)
+        self.assertEqual(tags, [ "a", "B" ])
+
+    def testReturningErrorHandler(self):
+        # Outside of recovery mode only the unexpected sign is skipped
+        for recover, expected in [ (False, [ "2" ]), (True, []) ]:
+            parser = HSDParser(recover=recover)
+            texts, codes = [], []
+            parser.text_handler = texts.append
+            parser.error_handler = lambda code, file, lines: codes.append(code)
+            parser.feed(io.StringIO("A = 1 ] 2\n"))
+            self.assertEqual(texts, expected)
+            self.assertEqual(codes, [ SYNTAX_ERROR ])
+        parser = HSDParser()
+        options = []
+        parser.start_handler = (lambda tag, opts, hsdopts:
+                                options.append((tag, dict(opts))))
+        parser.error_handler = lambda code, file, lines: None
+        parser.feed(io.StringIO("A [u{v] { 1 }\n"))
+        self.assertEqual(options, [ ("A", { "default": "v" }) ])
+
+    def testNoRecovery(self):
+        parser = HSDParser()
+        self.assertRaises(HSDParserError, parser.feed,
+                          io.StringIO(self._input))
+        self.assertEqual(parser.errors, [])
+
+
+_VARIABLES = { "TEMP": "300", "SCC": "Yes" }
+
+def _variable(parser, before, command):
+    """Substitutes the variable marked by the "<<$" interrupt."""
+    parser.flushtext(before)
+    parser.addtext(_VARIABLES[command.strip()])
+
+
+class _VariableParser(HSDParser):
+    pass
+
+_VariableParser.registerinterrupt("<<$", _variable)
+
+
+class InterruptRegistryTestCase(unittest.TestCase):
+    """Tests interrupt types registered for parser classes."""
+
+    def _texts(self, parser, text):
+        texts = []
+        parser.text_handler = texts.append
+        parser.feed(io.StringIO(text))
+        return texts
+
+    def testRegisteredInterrupt(self):
+        self.assertEqual(self._texts(_VariableParser(),
+                                     "Temp {\n  <<$ TEMP\n}\n"), [ "300" ])
+        self.assertEqual(self._texts(HSDParser(), "Temp {\n  <<$ TEMP\n}\n"),
+                         [ "<<$ TEMP" ])
+
+    def testIncludedFile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "include.hsd")
+            with open(fname, "w") as fp:
+                fp.write("SCC {\n  <<$ SCC\n}\n")
+            self.assertEqual(self._texts(_VariableParser(),
+                                         "<<! {}\n".format(fname)), [ "Yes" ])
+
+    def testInvalidMarker(self):
+        self.assertRaises(ValueError, _VariableParser.registerinterrupt, "<$",
+                          _variable)
+        self.assertRaises(ValueError, _VariableParser.registerinterrupt, "$$$",
+                          _variable)
+
+
 def getsuites():
     """Returns the test suites defined in the module."""
     return [ unittest.makeSuite(SimpleTestCase, 'test'),
             unittest.makeSuite(DefaultAttribTestCase, 'test'),
             unittest.makeSuite(ExpAttribTestCase, 'test'),
-            unittest.makeSuite(ErrorTestCase, 'test')
+            unittest.makeSuite(ErrorTestCase, 'test'),
+            unittest.makeSuite(ReplayTestCase, 'test'),
+            unittest.makeSuite(CompressionTestCase, 'test'),
+            unittest.makeSuite(InterningTestCase, 'test'),
+            unittest.makeSuite(RecoveryTestCase, 'test'),
+            unittest.makeSuite(InterruptRegistryTestCase, 'test')
             ]
 
 if __name__ == "__main__": 
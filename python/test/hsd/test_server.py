@@ -0,0 +1,112 @@
+import unittest
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+from hsd.common import *
+from hsd.client import HSDClient
+from hsd.server import HSDServer, encodetree, decodetree
+from test_tree import HSDINPUT, buildtree
+
+
+class ServerTestCase(unittest.TestCase):
+    """Tests the parse server and its client over a local socket."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmpdir.name, "hsd.sock")
+        self.fname = os.path.join(self.tmpdir.name, "input.hsd")
+        with open(self.fname, "w") as fp:
+            fp.write(HSDINPUT)
+        self.server = HSDServer(self.address, maxtrees=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = HSDClient(self.address, timeout=10)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmpdir.cleanup()
+
+    def testParse(self):
+        self.client.ping()
+        reference = buildtree()
+        root = self.client.parse(self.fname)
+        self.assertEqual(root.fingerprint(), reference.fingerprint())
+        self.assertEqual(root.find("Hamiltonian/DFTB/SCC").hsdattrib,
+                         reference.find("Hamiltonian/DFTB/SCC").hsdattrib)
+        self.client.parse(self.fname)
+        self.assertEqual(self.client.stats(),
+                         { "trees": 1, "hits": 1, "misses": 1 })
+        self.assertEqual(os.stat(self.address).st_mode & 0o077, 0)
+
+    def testQueryAndFormat(self):
+        nodes = self.client.query(self.fname, "Hamiltonian/DFTB/SCC")
+        self.assertEqual([ node.text for node in nodes ], [ "Yes" ])
+        self.assertEqual(self.client.query(self.fname, "Missing"), [])
+        text = self.client.format(self.fname)
+        self.assertIn("SCC = Yes", text)
+        with HSDClient(self.address) as client:
+            self.assertEqual(client.format(self.fname), text)
+
+    def testInvalidation(self):
+        self.client.parse(self.fname)
+        with open(self.fname, "a") as fp:
+            fp.write("Analysis {}\n")
+        root = self.client.parse(self.fname)
+        self.assertEqual(root[-1].tag, "Analysis")
+        self.assertEqual(self.client.stats()["misses"], 2)
+        others = []
+        for name in [ "a.hsd", "b.hsd" ]:
+            others.append(os.path.join(self.tmpdir.name, name))
+            with open(others[-1], "w") as fp:
+                fp.write("Tag = {}\n".format(name))
+            self.client.parse(others[-1])
+        self.assertEqual(self.client.stats()["trees"], 2)
+
+    def testErrors(self):
+        self.assertRaises(FileNotFoundError, self.client.parse,
+                          os.path.join(self.tmpdir.name, "missing.hsd"))
+        with open(self.fname, "w") as fp:
+            fp.write("Tag {\n")
+        self.assertRaises(HSDParserError, self.client.parse, self.fname)
+        self.assertRaises(HSDException, self.client._request, "unknown")
+        self.client.ping()
+        self.assertRaises(HSDException, HSDServer, self.address)
+
+    def testSocketDirectory(self):
+        address = os.path.join(self.tmpdir.name, "run", "hsd.sock")
+        server = HSDServer(address)
+        server.server_close()
+        self.assertEqual(os.stat(os.path.dirname(address)).st_mode & 0o777,
+                         0o700)
+        os.chmod(os.path.dirname(address), 0o755)
+        self.assertRaises(HSDException, HSDServer, address)
+
+    def testEncoding(self):
+        root = buildtree(HSDINPUT + "A {\n  <<@ data.bin int32 3\n}")
+        root[0].hsdattrib[HSDATTR_FILE] = "geo.hsd"
+        root[1].hsdattrib[HSDATTR_ARRAY] = np.arange(6.0).reshape(2, 3)
+        root2 = decodetree(json.loads(json.dumps(encodetree(root))))
+        self.assertEqual(root2.fingerprint(), root.fingerprint())
+        self.assertEqual(root2[0].hsdattrib, root[0].hsdattrib)
+        array = root2[1].hsdattrib[HSDATTR_ARRAY]
+        self.assertTrue(np.all(array == root[1].hsdattrib[HSDATTR_ARRAY]))
+        array[0, 0] = 1.0
+        include = root2.find("A").hsdattrib[HSDATTR_ARRAY]
+        self.assertEqual(include.totext(), "<<@ data.bin int32 3")
+        root[0].hsdattrib["object"] = object()
+        self.assertRaises(HSDException, encodetree, root)
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(ServerTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,81 @@
+import unittest
+import pickle
+import multiprocessing
+from hsd.common import *
+from hsd.converter import hsdbool, hsdfloat
+from hsd.query import HSDQuery
+from hsd.shared import SharedHSDTree, SharedElement
+from test_tree import buildtree
+
+
+def _scctolerance(node):
+    """Queries a shared node (runs in the worker processes)."""
+    return HSDQuery().getvalue(node.find("DFTB"), "SCCTolerance", hsdfloat)
+
+
+class SharedTreeTestCase(unittest.TestCase):
+    """Tests read-only trees in shared memory."""
+
+    def setUp(self):
+        self.root = buildtree()
+        self.tree = SharedHSDTree.publish(self.root)
+
+    def tearDown(self):
+        self.tree.close()
+        self.tree.unlink()
+
+    def testStructure(self):
+        root = self.tree.getroot()
+        self.assertEqual(root.tag, self.root.tag)
+        self.assertEqual(len(root), len(self.root))
+        for elem, shared in zip(self.root.iter(), root.iter()):
+            self.assertEqual(shared.tag, elem.tag)
+            self.assertEqual(shared.text, elem.text)
+            self.assertEqual(dict(shared.attrib), elem.attrib)
+            self.assertEqual(dict(shared.hsdattrib), elem.hsdattrib)
+        temp = root.find("Hamiltonian/DFTB/Filling/*/Temperature")
+        self.assertEqual(temp.get("default"), "Kelvin")
+        self.assertEqual(temp.hsdattrib[HSDATTR_LINE],
+                         self.root.find("Hamiltonian/DFTB/Filling/Fermi/"
+                                        "Temperature").hsdattrib[HSDATTR_LINE])
+        self.assertEqual([ elem.tag for elem in root[-2:] ],
+                         [ elem.tag for elem in self.root[-2:] ])
+        self.assertEqual(root.findall("./Options"), [ root[-1], ])
+        self.assertIsNone(root.find("Missing"))
+
+    def testQuery(self):
+        query = HSDQuery()
+        dftb = query.findchild(self.tree.getroot().find("Hamiltonian"), "DFTB")
+        self.assertIs(query.getvalue(dftb, "SCC", hsdbool), True)
+        try:
+            query.findchild(dftb, "Missing")
+        except HSDMissingTagException as exc:
+            self.assertEqual(exc.line, dftb.hsdattrib[HSDATTR_LINE])
+        else:
+            self.fail("No exception raised")
+        self.assertRaises(TypeError, HSDQuery(markprocessed=True).findchild,
+                          dftb, "SCC")
+
+    def testPickle(self):
+        data = pickle.dumps(self.tree.getroot().find("Hamiltonian"))
+        self.assertLess(len(data), 200)
+        ham = pickle.loads(data)
+        self.assertIsInstance(ham, SharedElement)
+        self.assertEqual(ham, self.tree.getroot().find("Hamiltonian"))
+        self.assertIs(pickle.loads(pickle.dumps(self.tree)), self.tree)
+
+    def testPool(self):
+        ham = self.tree.getroot().find("Hamiltonian")
+        with multiprocessing.Pool(2) as pool:
+            results = pool.map(_scctolerance, [ ham ] * 4)
+        self.assertEqual(results, [ 1.0E-7 ] * 4)
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(SharedTreeTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,380 @@
+import unittest
+import io
+import pickle
+from hsd.common import *
+from hsd.tree import Element, SubElement, HSDTree
+from hsd.treebuilder import HSDTreeBuilder, HSDDirectTreeBuilder
+from hsd.diff import *
+from hsd.variant import HSDVariant
+from hsd.merge import *
+from hsd.formatter import HSDFormatter
+
+HSDINPUT = """Geometry = GenFormat {
+2  S
+Ga As
+1    1    0.0 0.0 0.0
+2    2    0.1 0.1 0.1
+}
+Hamiltonian = DFTB {
+  SCC = Yes
+  SCCTolerance = 1.0E-007
+  Mixer = Broyden {}
+  Filling = Fermi {
+    Temperature [Kelvin] = 1.0E-006
+  }
+  KPointsAndWeights {
+    0.0 0.0 0.0   1.0
+  }
+}
+Options {
+  WriteHS = No
+}
+"""
+
+
+def buildtree(text=HSDINPUT):
+    """Builds a HSD tree from a string."""
+    return HSDTreeBuilder().build(io.StringIO(text))
+
+
+def _write(root):
+    """Returns a tree in HSD format."""
+    stream = io.StringIO()
+    HSDTree(root).writehsd(HSDFormatter(target=stream))
+    return stream.getvalue()
+
+
+class FingerprintTestCase(unittest.TestCase):
+    """Tests the content based fingerprints of subtrees."""
+
+    def testEqualTrees(self):
+        root1 = buildtree()
+        root2 = buildtree("\n\n" + HSDINPUT)
+        self.assertEqual(root1.fingerprint(), root2.fingerprint())
+        ham1, ham2 = root1.find("Hamiltonian"), root2.find("Hamiltonian")
+        self.assertNotEqual(ham1.hsdattrib[HSDATTR_LINE],
+                            ham2.hsdattrib[HSDATTR_LINE])
+        self.assertEqual(ham1.fingerprint(), ham2.fingerprint())
+        self.assertNotEqual(root1.fingerprint(), ham1.fingerprint())
+
+    def testDifferentTrees(self):
+        root1 = buildtree()
+        root2 = buildtree(HSDINPUT.replace("Kelvin", "Celsius"))
+        self.assertNotEqual(root1.fingerprint(), root2.fingerprint())
+        self.assertEqual(root1.find("Options").fingerprint(),
+                         root2.find("Options").fingerprint())
+        self.assertEqual(root1.fingerprint(()), root1.fingerprint([]))
+
+    def testInvalidation(self):
+        root = buildtree()
+        reference = root.fingerprint()
+        options = root.find("Options")
+        optionsref = options.fingerprint()
+        tolerance = root.find("Hamiltonian/DFTB/SCCTolerance")
+        tolerance.text = "1.0E-008"
+        self.assertIsNone(root._digests)
+        self.assertIsNotNone(options._digests)
+        self.assertNotEqual(root.fingerprint(), reference)
+        self.assertEqual(options.fingerprint(), optionsref)
+        tolerance.text = "1.0E-007"
+        self.assertEqual(root.fingerprint(), reference)
+        SubElement(options, "WriteBandOut").text = "Yes"
+        self.assertNotEqual(root.fingerprint(), reference)
+        options.remove(options[-1])
+        self.assertEqual(root.fingerprint(), reference)
+        options[0].set("unit", "none")
+        self.assertNotEqual(root.fingerprint(), reference)
+
+    def testRenamedTag(self):
+        root = buildtree()
+        reference = root.fingerprint()
+        optionsref = root.find("Options").fingerprint()
+        root.find("Options/WriteHS").tag = "WriteBandOut"
+        self.assertNotEqual(root.find("Options").fingerprint(), optionsref)
+        self.assertNotEqual(root.fingerprint(), reference)
+
+
+class DiffTestCase(unittest.TestCase):
+    """Tests the creation and application of patches between trees."""
+
+    def _checkpatch(self, oldtext, newtext):
+        old, new = buildtree(oldtext), buildtree(newtext)
+        ops = difftrees(old, new)
+        patched = patchtree(buildtree(oldtext), ops)
+        self.assertEqual(patched.fingerprint(), new.fingerprint())
+        return ops
+
+    def testIdentical(self):
+        self.assertEqual(self._checkpatch(HSDINPUT, HSDINPUT), [])
+
+    def testChangedValue(self):
+        ops = self._checkpatch(HSDINPUT,
+                               HSDINPUT.replace("1.0E-007", "1.0E-008"))
+        self.assertEqual(len(ops), 1)
+        self.assertEqual(ops[0].op, REPLACE)
+        self.assertEqual(ops[0].path, (("Hamiltonian", 0), ("DFTB", 0),
+                                       ("SCCTolerance", 0)))
+
+    def testChangedAttribute(self):
+        ops = self._checkpatch(HSDINPUT, HSDINPUT.replace("[Kelvin]", ""))
+        self.assertEqual([ op.op for op in ops ], [ ATTRIB ])
+
+    def testInsertDelete(self):
+        newtext = HSDINPUT.replace("  Mixer = Broyden {}\n", "").replace(
+            "  WriteHS = No\n", "  WriteHS = No\n  WriteHS = Yes\n  A = 1\n")
+        ops = self._checkpatch(HSDINPUT, newtext)
+        self.assertEqual(sorted([ op.op for op in ops ]),
+                         [ DELETE, INSERT, INSERT ])
+        self._checkpatch(newtext, HSDINPUT)
+
+    def testReordered(self):
+        newtext = "Options {\n  WriteHS = No\n}\n" + HSDINPUT.replace(
+            "Options {\n  WriteHS = No\n}\n", "")
+        ops = self._checkpatch(HSDINPUT, newtext)
+        self.assertEqual([ op.op for op in ops ], [ REPLACE ])
+        self.assertEqual(ops[0].path, ())
+
+    def testPatchOtherTree(self):
+        old = buildtree()
+        new = buildtree(HSDINPUT.replace("SCC = Yes", "SCC = No"))
+        other = buildtree(HSDINPUT.replace("WriteHS = No", "WriteHS = Yes"))
+        patchtree(other, difftrees(old, new))
+        self.assertEqual(other.find("Hamiltonian/DFTB/SCC").text, "No")
+        self.assertEqual(other.find("Options/WriteHS").text, "Yes")
+
+    def testRenamedTagAfterFingerprint(self):
+        old, new = buildtree(), buildtree()
+        old.fingerprint()
+        new.fingerprint()
+        new.find("Options/WriteHS").tag = "WriteBandOut"
+        ops = difftrees(old, new)
+        self.assertNotEqual(ops, [])
+        patched = patchtree(buildtree(), ops)
+        self.assertEqual(_write(patched), _write(new))
+
+    def testPatchNodeWithoutHsdAttributes(self):
+        oldtext = HSDINPUT.replace("SCC = Yes", "SCC {\nYes\n}")
+        ops = difftrees(buildtree(oldtext), buildtree())
+        self.assertEqual([ op.op for op in ops ], [ ATTRIB ])
+        other = buildtree(oldtext)
+        other.find("Hamiltonian/DFTB/SCC").hsdattrib = None
+        scc = patchtree(other, ops).find("Hamiltonian/DFTB/SCC")
+        self.assertEqual(scc.hsdattrib, { HSDATTR_EQUAL: True })
+
+
+class VariantTestCase(unittest.TestCase):
+    """Tests copy-on-write variants of trees."""
+
+    def testVariant(self):
+        base = buildtree()
+        basetext = _write(base)
+        variant = HSDVariant(base)
+        variant.settext("Hamiltonian/DFTB/SCCTolerance", "1.0E-008")
+        variant.setattrib("Hamiltonian/DFTB/Filling/Fermi/Temperature",
+                          "default", "Celsius")
+        variant.addnode("Options", "WriteBandOut", "Yes",
+                        hsdattrib={ HSDATTR_EQUAL: True })
+        self.assertEqual(_write(base), basetext)
+        self.assertIs(variant.root.find("Geometry"), base.find("Geometry"))
+        self.assertIs(variant.root.find("Hamiltonian/DFTB/Mixer"),
+                      base.find("Hamiltonian/DFTB/Mixer"))
+        self.assertIsNot(variant.root.find("Hamiltonian"),
+                         base.find("Hamiltonian"))
+        reference = buildtree(HSDINPUT.replace("1.0E-007", "1.0E-008")
+                              .replace("Kelvin", "Celsius")
+                              .replace("WriteHS = No\n",
+                                       "WriteHS = No\nWriteBandOut = Yes\n"))
+        self.assertEqual(_write(variant.root), _write(reference))
+
+    def testRepeatedEdits(self):
+        variant = HSDVariant(buildtree())
+        node = variant.getnode("Hamiltonian/DFTB/SCC")
+        self.assertIs(variant.getnode("Hamiltonian/DFTB/SCC"), node)
+        self.assertRaises(KeyError, variant.getnode, "Hamiltonian/xTB")
+
+    def testReplacedNode(self):
+        variant = HSDVariant(buildtree())
+        mixer = Element("Mixer")
+        variant.replacenode("Hamiltonian/DFTB/Mixer", mixer)
+        self.assertIs(variant.getnode("Hamiltonian/DFTB/Mixer"), mixer)
+
+
+_USERINPUT = """Hamiltonian = DFTB {
+  SCCTolerance = 1.0E-008
+  Mixer = Anderson {}
+  Filling = Fermi {
+    Temperature [Kelvin] = 300
+  }
+  KPointsAndWeights {
+    0.5 0.5 0.5   1.0
+  }
+}
+Options {
+  WriteBandOut = Yes
+}
+"""
+
+
+class MergeTestCase(unittest.TestCase):
+    """Tests the overlay merging of trees."""
+
+    def setUp(self):
+        self.base = HSDTree(buildtree())
+        self.user = HSDTree(buildtree(_USERINPUT))
+        self.files = [ "defaults.hsd", "user.hsd" ]
+
+    def testDeepMerge(self):
+        basetext = _write(self.base.getroot())
+        merged = self.base.merge(self.user, files=self.files).getroot()
+        self.assertEqual(_write(self.base.getroot()), basetext)
+        reference = buildtree(HSDINPUT.replace("1.0E-007", "1.0E-008")
+                              .replace("Broyden", "Anderson")
+                              .replace("1.0E-006", "300")
+                              .replace("0.0 0.0 0.0   1.0", "0.5 0.5 0.5   1.0")
+                              .replace("WriteHS = No\n",
+                                       "WriteHS = No\nWriteBandOut = Yes\n"))
+        self.assertEqual(merged.fingerprint(), reference.fingerprint())
+        scc = merged.find("Hamiltonian/DFTB/SCC")
+        tolerance = merged.find("Hamiltonian/DFTB/SCCTolerance")
+        self.assertEqual((scc.hsdattrib[HSDATTR_FILE],
+                          scc.hsdattrib[HSDATTR_LINE]), ("defaults.hsd", 7))
+        self.assertEqual((tolerance.hsdattrib[HSDATTR_FILE],
+                          tolerance.hsdattrib[HSDATTR_LINE]), ("user.hsd", 1))
+        self.assertTrue(merged.find("Hamiltonian").hsdattrib[HSDATTR_EQUAL])
+
+    def testPolicies(self):
+        merged = self.base.merge(self.user, policies={
+            "Options": MERGE_OVERRIDE, "*/DFTB/KPointsAndWeights": MERGE_APPEND
+        }).getroot()
+        self.assertEqual([ node.tag for node in merged.find("Options") ],
+                         [ "WriteBandOut" ])
+        self.assertEqual(merged.findtext("Hamiltonian/DFTB/KPointsAndWeights")
+                         .split(), "0.0 0.0 0.0 1.0 0.5 0.5 0.5 1.0".split())
+        merged = self.base.merge(self.user, default=MERGE_APPEND).getroot()
+        self.assertEqual([ node.tag for node in merged ],
+                         [ "Geometry", "Hamiltonian", "Options", "Hamiltonian",
+                           "Options" ])
+        self.assertRaises(ValueError, self.base.merge, self.user,
+                          default="replace")
+
+    def testWildcardPolicies(self):
+        kpoints = "Hamiltonian/DFTB/KPointsAndWeights"
+        merged = self.base.merge(self.user, policies={
+            "Hamiltonian": MERGE_DEEP, "*/DFTB/KPointsAndWeights": MERGE_APPEND
+        }).getroot()
+        self.assertEqual(len(merged.findtext(kpoints).split()), 8)
+        merged = self.base.merge(self.user, policies={
+            "*/DFTB/KPointsAndWeights": MERGE_APPEND,
+            "Hamiltonian/*/KPointsAndWeights": MERGE_OVERRIDE,
+        }).getroot()
+        self.assertEqual(merged.findtext(kpoints).split(),
+                         "0.5 0.5 0.5 1.0".split())
+
+    def testChoice(self):
+        user = HSDTree(buildtree("Hamiltonian = xTB {\n  Method = GFN2\n}\n"
+                                 "Options = {}\n"))
+        merged = self.base.merge(user).getroot()
+        self.assertEqual([ node.tag for node in merged.find("Hamiltonian") ],
+                         [ "xTB" ])
+        self.assertEqual(merged.findtext("Hamiltonian/xTB/Method"), "GFN2")
+        self.assertIsNotNone(merged.find("Options/WriteHS"))
+
+    def testLazyView(self):
+        view = self.base.merge(self.user, files=self.files, lazy=True)
+        self.assertIsInstance(view, HSDMergedElement)
+        temp = view.find("Hamiltonian/DFTB/Filling/Fermi/Temperature")
+        self.assertEqual((temp.text, temp.get("default"), temp.layer),
+                         ("300", "Kelvin", 1))
+        self.assertEqual(temp.hsdattrib[HSDATTR_FILE], "user.hsd")
+        self.assertEqual(len(view.find("Options")), 2)
+        self.assertEqual(view.materialize().fingerprint(),
+                         self.base.merge(self.user).getroot().fingerprint())
+
+    def testWideBlock(self):
+        nchild = 20000
+        base = Element("hsd")
+        user = Element("hsd")
+        for ii in range(nchild):
+            SubElement(base, "Atom").text = str(ii)
+            SubElement(user, "Atom" + str(ii % 2)).text = str(ii)
+        merged = mergetrees([ base, user ])
+        self.assertEqual(len(merged), 2 * nchild)
+        self.assertEqual(merged[-1].text, str(nchild - 1))
+
+
+class DirectTreeBuilderTestCase(unittest.TestCase):
+    """Tests whether the direct tree builder yields the same trees."""
+
+    def _dump(self, root):
+        return [ (node.tag, node.attrib, node.hsdattrib, node.text, node.tail)
+                 for node in root.iter() ]
+
+    def testIdenticalTrees(self):
+        for text in [ HSDINPUT, "A { B [unit=1, dim=3] {} }\nC = 1 2 3",
+                      "A = B {\n  <<< \"" + __file__ + "\"\n}" ]:
+            reference = buildtree(text)
+            root = HSDDirectTreeBuilder().build(io.StringIO(text))
+            self.assertEqual(self._dump(root), self._dump(reference))
+            self.assertEqual(root.fingerprint(), reference.fingerprint())
+
+
+class PickleTestCase(unittest.TestCase):
+    """Tests the pickling of (sub)trees."""
+
+    def _dump(self, root):
+        return [ (node.tag, node.attrib, self._hsdattrib(node), node.text,
+                  node.tail) for node in root.iter() ]
+
+    def _hsdattrib(self, node):
+        if node.hsdattrib is None:
+            return None
+        return dict([ (key, value.totext()
+                       if isinstance(value, HSDBinaryInclude) else value)
+                      for key, value in node.hsdattrib.items() ])
+
+    def testRoundTrip(self):
+        root = buildtree(HSDINPUT + "A [unit=eV] {\n  <<@ data.bin int32 3\n}")
+        root[0].hsdattrib[HSDATTR_FILE] = "geo.hsd"
+        root[0].hsdattrib["counter"] = 2**70
+        root[1].tail = "tail"
+        root[2].hsdattrib = None
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            root2 = pickle.loads(pickle.dumps(root, protocol))
+            self.assertEqual(self._dump(root2), self._dump(root))
+            self.assertEqual(root2.fingerprint(), root.fingerprint())
+        array = root2.find("A").hsdattrib[HSDATTR_ARRAY]
+        self.assertEqual(array.totext(), "<<@ data.bin int32 3")
+        tree = pickle.loads(pickle.dumps(HSDTree(root)))
+        self.assertEqual(self._dump(tree.getroot()), self._dump(root))
+
+    def testDeepTree(self):
+        root = node = Element("root")
+        for ii in range(20000):
+            node = SubElement(node, "level", hsdattrib={ HSDATTR_LINE: ii })
+        node.text = "leaf"
+        root2 = pickle.loads(pickle.dumps(root))
+        self.assertEqual(self._dump(root2), self._dump(root))
+
+    def testSharedReferences(self):
+        root = buildtree(HSDINPUT)
+        root2, child, root3 = pickle.loads(pickle.dumps([ root, root[0],
+                                                          root ]))
+        self.assertIs(root3, root2)
+        # Descendants pickled separately are independent copies
+        self.assertIsNot(child, root2[0])
+        self.assertEqual(self._dump(child), self._dump(root2[0]))
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(FingerprintTestCase, 'test'),
+             unittest.makeSuite(DiffTestCase, 'test'),
+             unittest.makeSuite(VariantTestCase, 'test'),
+             unittest.makeSuite(MergeTestCase, 'test'),
+             unittest.makeSuite(DirectTreeBuilderTestCase, 'test'),
+             unittest.makeSuite(PickleTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -0,0 +1,103 @@
+import unittest
+import io
+import os
+import tempfile
+from hsd.common import *
+from hsd.validator import HSDRule, HSDSchema
+from test_tree import HSDINPUT
+
+_FLOAT = r"[-+]?[0-9.]+([eE][-+]?[0-9]+)?"
+_LOGICAL = r"Yes|No"
+
+_SCHEMA = {
+    "Geometry": HSDRule({ "GenFormat": HSDRule() }, required=True),
+    "Hamiltonian": HSDRule({
+        "DFTB": HSDRule({
+            "SCC": HSDRule(pattern=_LOGICAL, unique=True),
+            "SCCTolerance": HSDRule(pattern=_FLOAT),
+            "Mixer": HSDRule({ "*": HSDRule({}) }),
+            "Filling": HSDRule({
+                "Fermi": HSDRule({
+                    "Temperature": HSDRule(attribs=["default"],
+                                           pattern=_FLOAT,
+                                           required=True) }) }),
+            "KPointsAndWeights": HSDRule(),
+        }),
+    }, required=True),
+    "Options": HSDRule({ "WriteHS": HSDRule(pattern=_LOGICAL) }),
+}
+
+
+class ValidatorTestCase(unittest.TestCase):
+    """Tests the validation of parser events against a schema."""
+
+    def setUp(self):
+        self.schema = HSDSchema(_SCHEMA)
+
+    def _error(self, text, exception):
+        with self.assertRaises(exception) as context:
+            self.schema.validate(io.StringIO(text))
+        return context.exception
+
+    def testValid(self):
+        self.schema.validate(io.StringIO(HSDINPUT))
+
+    def testEarlyRejection(self):
+        # Rejected at the invalid tag, before the unclosed tag is detected
+        exc = self._error(HSDINPUT + "Driver {\n  Steps = 1\n",
+                          HSDInvalidTagException)
+        self.assertEqual(exc.tag, "Driver")
+        self.assertEqual(exc.line, HSDINPUT.count("\n"))
+
+    def testInvalidValues(self):
+        text = HSDINPUT.replace("SCC = Yes", "SCC = Maybe")
+        exc = self._error(text, HSDInvalidTagValueException)
+        self.assertEqual((exc.tag, exc.line), ("SCC", 7))
+        text = HSDINPUT.replace("SCC = Yes", "SCC = Yes\n  SCC = No")
+        self._error(text, HSDInvalidTagException)
+        text = HSDINPUT.replace("Broyden {}", "Broyden { 1 }")
+        self._error(text, HSDInvalidTagValueException)
+
+    def testAttributes(self):
+        text = HSDINPUT.replace("[Kelvin]", "[unit=Kelvin]")
+        exc = self._error(text, HSDInvalidAttributeException)
+        self.assertEqual(exc.tag, "Temperature")
+
+    def testRequired(self):
+        exc = self._error(HSDINPUT.replace(
+            "    Temperature [Kelvin] = 1.0E-006\n", ""),
+            HSDMissingTagException)
+        self.assertEqual((exc.tag, exc.line), ("Fermi", 10))
+        exc = self._error("Hamiltonian {}\n", HSDMissingTagException)
+        self.assertIsNone(exc.tag)
+
+    def testRecursiveSchema(self):
+        block = HSDRule(attribs=[ "name" ])
+        block.children = { "Block": block, "Value": HSDRule(pattern=_FLOAT) }
+        schema = HSDSchema({ "Block": block })
+        schema.validate(io.StringIO(
+            "Block {\n  Block [name=a] {\n    Block {\n      Value = 1\n"
+            "    }\n  }\n}\n"))
+        self.assertRaises(HSDInvalidTagValueException, schema.validate,
+                          io.StringIO("Block {\n  Value = a\n}\n"))
+
+    def testIncludedFile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "options.hsd")
+            with open(fname, "w") as fp:
+                fp.write("WriteHS = No\nWriteCharges = No\n")
+            exc = self._error(HSDINPUT.replace(
+                "  WriteHS = No\n", "  <<! " + fname + "\n"),
+                HSDInvalidTagException)
+            self.assertEqual((exc.tag, exc.file, exc.line),
+                             ("WriteCharges", fname, 1))
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(ValidatorTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
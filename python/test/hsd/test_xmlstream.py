@@ -0,0 +1,85 @@
+import unittest
+import io
+import os
+import gzip
+import tempfile
+import xml.etree.ElementTree as etree
+from hsd.common import *
+from hsd.parser import HSDParser
+from hsd.formatter import HSDFormatter, HSDStreamFormatter
+from hsd.treebuilder import HSDTreeBuilder
+from hsd.xmlstream import *
+from test_tree import HSDINPUT, buildtree
+
+
+class XMLStreamTestCase(unittest.TestCase):
+    """Tests the streaming conversion between HSD and XML."""
+
+    def _toxml(self, text, **options):
+        stream = io.StringIO()
+        hsdtoxml(io.StringIO(text), stream, **options)
+        return stream.getvalue()
+
+    def _format(self, text):
+        stream = io.StringIO()
+        HSDStreamFormatter(HSDParser(),
+                           HSDFormatter(target=stream)).feed(io.StringIO(text))
+        return stream.getvalue()
+
+    def testHSDToXML(self):
+        xmlroot = etree.fromstring(self._toxml(HSDINPUT))
+        temperature = xmlroot.find("Hamiltonian/DFTB/Filling/Fermi/"
+                                   "Temperature")
+        self.assertEqual(temperature.text, "1.0E-006")
+        self.assertEqual(temperature.get("default"), "Kelvin")
+        self.assertEqual(temperature.get("{" + HSD_XMLNS + "}" + HSDATTR_EQUAL),
+                         "1")
+        self.assertEqual(temperature.get("{" + HSD_XMLNS + "}" + HSDATTR_LINE),
+                         "11")
+        self.assertEqual(len(xmlroot.find("Hamiltonian/DFTB/Mixer/Broyden")),
+                         0)
+        xmlroot = etree.fromstring(self._toxml(HSDINPUT, hsdattribs=()))
+        self.assertFalse(xmlroot.find("Hamiltonian").attrib)
+
+    def testRoundTrip(self):
+        text = HSDINPUT + 'Special [x="<&>"] {\n  "a < b"\n  & c\n}\n'
+        xml = self._toxml(text)
+        stream = io.StringIO()
+        xmltohsd(io.BytesIO(xml.encode()), stream)
+        self.assertEqual(stream.getvalue(), self._format(text))
+        root = HSDTreeBuilder(parser=HSDXMLParser()).build(
+            io.BytesIO(xml.encode()))
+        self.assertEqual(root.fingerprint(), buildtree(text).fingerprint())
+        self.assertEqual(root.find("Options").hsdattrib[HSDATTR_LINE], 17)
+
+    def testIndentedXML(self):
+        xml = "<hsd>\n  <A>\n    <B> 1 2\n3 </B>\n  </A>\n</hsd>\n"
+        stream = io.StringIO()
+        xmltohsd(io.BytesIO(xml.encode()), stream)
+        self.assertEqual(stream.getvalue(), "A {\n  B {\n1 2\n3\n  }\n}")
+
+    def testCompressedOutput(self):
+        xml = self._toxml(HSDINPUT)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "out.hsd.gz")
+            xmltohsd(io.BytesIO(xml.encode()), fname)
+            with gzip.open(fname, "rt") as fp:
+                self.assertEqual(fp.read(), self._format(HSDINPUT))
+            # Output written before an error must be finished nevertheless
+            try:
+                xmltohsd(io.BytesIO(b"<hsd><A>1</A><B>"), fname)
+            except etree.ParseError:
+                with gzip.open(fname, "rt") as fp:
+                    self.assertEqual(fp.read(), "A {\n1\n}\nB {")
+            else:
+                self.fail("ParseError not raised")
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(XMLStreamTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))
@@ -20,7 +20,7 @@ ATTR_UNIT = "unit"
 # Converter for some complex datatypes in the input
 ###########################################################################
 
-class HSDGeometry(HSDConverter):
+class HSDGeometry(HSDTable):
     """Converts geometry from HSD to (types, coords) tuple.
     
     The tuple returned contains the (-1,) shaped array types, with the chemical
@@ -37,23 +37,18 @@ class HSDGeometry(HSDConverter):
             basis: Basis vectors of the lattice to used for conversion from
                 fractional coordinates into cartesian.
         """
+        super().__init__([ ("types", str), ("coords", float, 3) ],
+                         structured=False)
         self.basis = basis
         self.setallowedattribs([ ATTR_UNIT, ])
         
     def fromhsd(self, node):
-        self.checkattributes(node)
         unit = node.get(ATTR_UNIT, "fractional")
         isfractional = (unit == "fractional")
         if not isfractional and unit != "cartesian":
             raise HSDInvalidAttributeValueException() 
-        words = node.text.split()
-        nn = len(words)
-        if nn % 4:
-            raise HSDInvalidTagValueException()
-        types = [ words[ii] for ii in range(0, nn, 4) ]
-        tmp = [ (float(words[ii]), float(words[ii+1]), float(words[ii+2])) 
-               for ii in range(1, nn, 4) ]
-        coords = np.array(tmp, dtype=float)
+        table = super().fromhsd(node)
+        types, coords = table["types"], table["coords"]
         if isfractional:
             coords = np.dot(coords, self.basis)
         return types, coords
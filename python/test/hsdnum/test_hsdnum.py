@@ -0,0 +1,227 @@
+import unittest
+import io
+import sys
+import subprocess
+import os.path
+import tempfile
+import numpy as np
+from hsd.common import *
+from hsd.tree import Element, HSDTree
+from hsd.treebuilder import HSDTreeBuilder
+from hsd.formatter import HSDFormatter
+from hsd.converter import MultiplicativeUnitConverter, AffineUnitConverter
+from hsdnum.converter import *
+from hsdnum.sink import ArraySink
+from hsdnum.sidecar import SidecarArrayWriter
+from hsd.shared import SharedHSDTree
+
+
+class ArrayUnitTestCase(unittest.TestCase):
+    """Tests the unit conversion of arrays."""
+
+    def _node(self, text, unit=None):
+        node = Element("test", { "unit": unit } if unit else {})
+        node.text = text
+        return node
+
+    def testCompoundUnit(self):
+        converter = HSDArrayUnit(float, MultiplicativeUnitConverter(
+            { "eV": 0.5, "AA": 2.0 }), shape=(-1, 2))
+        array = converter.fromhsd(self._node("1 2\n3 4", "eV/AA"))
+        self.assertTrue(np.allclose(array, [[0.25, 0.5], [0.75, 1.0]]))
+
+    def testAffineIntArray(self):
+        converter = HSDArrayUnit(int, AffineUnitConverter(
+            { "Celsius": (1.0, 273.15) }))
+        array = converter.fromhsd(self._node("0 100", "Celsius"))
+        self.assertEqual(array.dtype.kind, "f")
+        self.assertTrue(np.allclose(array, [273.15, 373.15]))
+
+
+class TableTestCase(unittest.TestCase):
+    """Tests the conversion of mixed type tables."""
+
+    _text = "Ga 1 0.0 0.0 0.0\nAs 2 0.5 0.5 0.5\nGa 3 1.0 1.0 1.0"
+    _columns = [ ("species", str), ("index", int), ("coords", float, 3) ]
+
+    def _node(self, text):
+        node = Element("test")
+        node.text = text
+        return node
+
+    def testStructured(self):
+        table = HSDTable(self._columns).fromhsd(self._node(self._text))
+        self.assertEqual(table["species"].tolist(), [ "Ga", "As", "Ga" ])
+        self.assertEqual(table["index"].tolist(), [ 1, 2, 3 ])
+        self.assertEqual(table["coords"].shape, (3, 3))
+        self.assertTrue(np.allclose(table["coords"][1], 0.5))
+
+    def testRowsSpanningLines(self):
+        converter = HSDTable(self._columns)
+        reference = converter.fromhsd(self._node(self._text))
+        table = converter.fromhsd(self._node(" ".join(self._text.split())))
+        self.assertEqual(table.dtype.names, reference.dtype.names)
+        for name in table.dtype.names:
+            self.assertTrue(np.all(table[name] == reference[name]))
+        self.assertEqual(len(converter.fromhsd(self._node(""))), 0)
+
+    def testColumnsWithCodes(self):
+        converter = HSDTable(self._columns, structured=False, codes="species")
+        table, names = converter.fromhsd(self._node(self._text))
+        self.assertEqual(names, [ "Ga", "As" ])
+        self.assertEqual(table["species"].tolist(), [ 0, 1, 0 ])
+        node = converter.tohsd("test", (table, names), {})
+        self.assertEqual(node.text.split("\n")[1].split()[:2], [ "As", "2" ])
+        table2, names2 = converter.fromhsd(node)
+        self.assertEqual(names2, names)
+        self.assertTrue(np.allclose(table2["coords"], table["coords"]))
+
+    def testInvalidTable(self):
+        converter = HSDTable(self._columns)
+        self.assertRaises(HSDInvalidTagValueException, converter.fromhsd,
+                          self._node("Ga 1 0.0 0.0"))
+        self.assertRaises(HSDInvalidTagValueException, converter.fromhsd,
+                          self._node("Ga 1.5 0.0 0.0 0.0"))
+
+
+class ArraySinkTestCase(unittest.TestCase):
+    """Tests the streaming of tag texts into arrays."""
+
+    _input = """Geometry {
+  Coords {
+    1.0 2.0 3.0  # first atom
+    4.0 5.0 6.0
+    7.0 8.0 9.0 }
+  Vector = 1 2 3
+  Types = Ga {}
+}
+"""
+
+    def _build(self, batchsize=1048576):
+        builder = HSDTreeBuilder()
+        builder.registersink("Geometry/Coords",
+                             lambda: ArraySink(float, (-1, 3), batchsize))
+        builder.registersink("Geometry/Vector", lambda: ArraySink(int))
+        builder.registersink("Geometry/Types", ArraySink)
+        return builder.build(io.StringIO(self._input))
+
+    def testSink(self):
+        for batchsize in [ 1, 1048576 ]:
+            root = self._build(batchsize)
+            coords = root.find("Geometry/Coords")
+            self.assertIsNone(coords.text)
+            array = hsdfloatarray((3, 3)).fromhsd(coords)
+            self.assertTrue(np.all(array.ravel() == np.arange(1.0, 10.0)))
+            vector = root.find("Geometry/Vector")
+            self.assertEqual(vector.hsdattrib[HSDATTR_ARRAY].tolist(),
+                             [ 1, 2, 3 ])
+            types = root.find("Geometry/Types")
+            self.assertNotIn(HSDATTR_ARRAY, types.hsdattrib)
+            self.assertEqual(types[0].tag, "Ga")
+
+    def testWrite(self):
+        stream = io.StringIO()
+        HSDTree(self._build()).writehsd(HSDFormatter(target=stream))
+        root = HSDTreeBuilder().build(io.StringIO(stream.getvalue()))
+        self.assertEqual(root.find("Geometry/Coords").text.split("\n")[1],
+                         "4.0 5.0 6.0")
+        self.assertEqual(root.find("Geometry/Vector").text, "1 2 3")
+
+    def testMixedContent(self):
+        builder = HSDTreeBuilder()
+        builder.registersink("Coords", ArraySink)
+        self.assertRaises(HSDParserError, builder.build,
+                          io.StringIO("Coords {\n1.0\nTag = 2\n}\n"))
+
+
+class BinaryIncludeTestCase(unittest.TestCase):
+    """Tests arrays stored in binary files."""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._dir = self._tmpdir.name
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def testInclude(self):
+        npyfile = os.path.join(self._dir, "coords.npy")
+        rawfile = os.path.join(self._dir, "charges.bin")
+        np.save(npyfile, np.arange(6.0).reshape((2, 3)))
+        np.arange(4, dtype=np.int32).tofile(rawfile)
+        stream = io.StringIO("Coords {{\n  <<@ '{}'\n}}\nCharges {{ <<@ "
+                             "{} int32 2 2\n}}\n".format(npyfile, rawfile))
+        root = HSDTreeBuilder().build(stream)
+        self.assertIsInstance(root[0].hsdattrib[HSDATTR_ARRAY],
+                              HSDBinaryInclude)
+        coords = hsdfloatarray((2, 3)).fromhsd(root[0])
+        self.assertIsInstance(coords, np.memmap)
+        self.assertEqual(coords[1].tolist(), [ 3.0, 4.0, 5.0 ])
+        charges = hsdintarray((-1,)).fromhsd(root[1])
+        self.assertEqual(charges.tolist(), [ 0, 1, 2, 3 ])
+
+    def testSidecarWriter(self):
+        builder = HSDTreeBuilder()
+        builder.registersink("Big", ArraySink)
+        builder.registersink("Small", ArraySink)
+        root = builder.build(io.StringIO("Big = 1 2 3 4\nSmall = 1 2\n"))
+        stream = io.StringIO()
+        writer = SidecarArrayWriter(os.path.join(self._dir, "out_"), 3)
+        HSDTree(root).writehsd(HSDFormatter(target=stream), writer)
+        self.assertEqual(len(writer.fnames), 1)
+        root2 = HSDTreeBuilder().build(io.StringIO(stream.getvalue()))
+        self.assertEqual(getarraypayload(root2[0]).tolist(), [ 1, 2, 3, 4 ])
+        self.assertEqual(root2[1].text, "1.0 2.0")
+
+
+class SharedArrayTestCase(unittest.TestCase):
+    """Tests array payloads of trees in shared memory."""
+
+    def testArrayViews(self):
+        builder = HSDTreeBuilder()
+        builder.registersink("Geometry/Coords",
+                             lambda: ArraySink(float, (-1, 3)))
+        root = builder.build(io.StringIO(ArraySinkTestCase._input))
+        with SharedHSDTree.publish(root) as tree:
+            coords = tree.getroot().find("Geometry/Coords")
+            array = getarraypayload(coords)
+            self.assertEqual(array.shape, (3, 3))
+            self.assertFalse(array.flags.writeable)
+            self.assertFalse(array.flags.owndata)
+            self.assertTrue(np.all(hsdfloatarray((3, 3)).fromhsd(coords)
+                                   == getarraypayload(root[0][0])))
+            self.assertEqual(hsdintarray().fromhsd(
+                tree.getroot().find("Geometry/Vector")).tolist(), [ 1, 2, 3 ])
+            del array
+
+
+class LazyImportTestCase(unittest.TestCase):
+    """Tests that numpy is only imported when arrays are converted."""
+
+    def _loaded(self, script):
+        script += "\nimport sys\nprint('numpy' in sys.modules)"
+        return subprocess.check_output([ sys.executable, "-c", script ],
+                                       env=os.environ, universal_newlines=True)
+
+    def testDeferredNumpy(self):
+        self.assertEqual(self._loaded(
+            "import hsdnum\nconverter = hsdnum.hsdfloatarray()"), "False\n")
+        self.assertEqual(self._loaded(
+            "import hsdnum\nfrom hsd.tree import Element\n"
+            "node = Element('Values')\nnode.text = '1 2'\n"
+            "hsdnum.hsdfloatarray().fromhsd(node)"), "True\n")
+
+
+def getsuites():
+    """Returns the test suites defined in the module."""
+    return [ unittest.makeSuite(ArrayUnitTestCase, 'test'),
+             unittest.makeSuite(TableTestCase, 'test'),
+             unittest.makeSuite(ArraySinkTestCase, 'test'),
+             unittest.makeSuite(BinaryIncludeTestCase, 'test'),
+             unittest.makeSuite(SharedArrayTestCase, 'test'),
+             unittest.makeSuite(LazyImportTestCase, 'test'), ]
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(unittest.TestSuite(getsuites()))